@@ -15,6 +15,23 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+
+def lambda_code():
+    """
+    Packages the ./lambda folder together with the packages of lambda/requirements.txt,
+    which are not part of the AWS Lambda Python runtime.
+    """
+    return _lambda.Code.from_asset('./lambda',
+        bundling=cdk.BundlingOptions(
+            image=_lambda.Runtime.PYTHON_3_7.bundling_image,
+            command=['bash', '-c', 'pip install -r requirements.txt -t /asset-output && cp -au . /asset-output']
+        ))
+
+# IoU above which overlapping text detections of a frame are suppressed to the most
+# confident one before they are written, '0' writes every detection, see lambda/text_nms.py
+TEXT_NMS_IOU='0.5'
+
+
 class AmazonRekognitionDynamodbStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -87,7 +104,7 @@ class AmazonRekognitionDynamodbStack(Stack):
                                                runtime=_lambda.Runtime.PYTHON_3_7,
                                                handler='detect_text.lambda_handler',
                                                role=my_role,
-                                               code=_lambda.Code.from_asset('./lambda'),
+                                               code=lambda_code(),
                                                timeout=Duration.seconds(300),                                               
                                                environment={
                                                    'SQS_RESPONSE_QUEUE': response_queue.queue_name,
@@ -138,11 +155,12 @@ class AmazonRekognitionDynamodbStack(Stack):
                                                #function_name='AmazonRekognitionDynamodbStack_write_results_text',
                                                handler='write_results_text.lambda_handler',
                                                role=my_role,
-                                               code=_lambda.Code.from_asset('./lambda'),
+                                               code=lambda_code(),
                                                timeout=Duration.seconds(300),
                                                environment={
                                                    'SQS_RESPONSE_QUEUE': response_queue.queue_name,
-                                                   'TABLE_NAME': results_table.table_name}
+                                                   'TABLE_NAME': results_table.table_name,
+                                                   'TEXT_NMS_IOU': TEXT_NMS_IOU}
                                                )
 
         # Set SQS response_queue Queue as event source for write_results_lambda results_table
@@ -172,6 +190,14 @@ class AmazonRekognitionDynamodbStack(Stack):
                        description='Write result lambda name')
 
 REKOGNITION_CONFIDENCE='50'
+LABEL_CACHE_TTL_DAYS='30'
+HASH_RADIUS='4'
+# Index partition keys per label of the labels table, see lambda/label_schema.py
+LABEL_SHARDS='8'
+# Largest side of the images sent to Rekognition as bytes, '0' sends the S3 object reference.
+# Decoding large photos needs more than the 128 MB of the function, raise its
+# memory_size before enabling it.
+IMAGE_MAX_DIMENSION='0'
 
 
 class AmazonRekognitionDetectLabelDynamodbStack(Stack):
@@ -213,16 +239,45 @@ class AmazonRekognitionDetectLabelDynamodbStack(Stack):
                        write_capacity=200
         )
 
+        # Reverse lookup of the images by label, sorted by confidence. The partition key is Label_Name#shard, so a popular label is spread over LABEL_SHARDS partitions. Only the keys are projected.
+        results_table.add_global_secondary_index(index_name='Label_Confidence_Index',
+                       partition_key=dynamodb.Attribute(name='Label_Shard', type=dynamodb.AttributeType.STRING),
+                       sort_key=dynamodb.Attribute(name='Label_Confidence', type=dynamodb.AttributeType.NUMBER),
+                       projection_type=dynamodb.ProjectionType.KEYS_ONLY,
+                       read_capacity=200,
+                       write_capacity=200
+        )
+
+        # Cache of DetectLabels responses keyed on the image ETag and request parameters. Expired entries are removed by the table TTL.
+        label_cache_table = dynamodb.Table(self, 'detect_label_cache',
+                       partition_key=dynamodb.Attribute(name='Cache_Key', type=dynamodb.AttributeType.STRING),
+                       billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                       time_to_live_attribute='Expires_At'
+        )
+
+        # Multi-index table of perceptual image hashes, used to reuse the labels of near-duplicate images
+        hash_index_table = dynamodb.Table(self, 'detect_label_hash_index',
+                       partition_key=dynamodb.Attribute(name='Chunk', type=dynamodb.AttributeType.STRING),
+                       sort_key=dynamodb.Attribute(name='Image_Hash', type=dynamodb.AttributeType.STRING),
+                       billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
         # Define the AWS Lambda to write results into DyanamoDB results_table
         write_results_lambda = _lambda.Function(self, 'write_results_text',
                                                runtime=_lambda.Runtime.PYTHON_3_7,
                                                handler='detect_labels.lambda_handler',
                                                role=my_role,
-                                               code=_lambda.Code.from_asset('./lambda'),
+                                               code=lambda_code(),
                                                timeout=Duration.seconds(300),
                                                environment={
                                                    'REKOGNITION_CONFIDENCE': REKOGNITION_CONFIDENCE,
-                                                   'TABLE_NAME': results_table.table_name}
+                                                   'TABLE_NAME': results_table.table_name,
+                                                   'LABEL_CACHE_TABLE': label_cache_table.table_name,
+                                                   'LABEL_CACHE_TTL_DAYS': LABEL_CACHE_TTL_DAYS,
+                                                   'HASH_INDEX_TABLE': hash_index_table.table_name,
+                                                   'HASH_RADIUS': HASH_RADIUS,
+                                                   'LABEL_SHARDS': LABEL_SHARDS,
+                                                   'IMAGE_MAX_DIMENSION': IMAGE_MAX_DIMENSION}
                                                )
         
         video_bucket.add_event_notification(event=s3.EventType.OBJECT_CREATED,
@@ -246,6 +301,12 @@ class AmazonRekognitionDetectLabelDynamodbStack(Stack):
         # Allow AWS Lambda write_results_lambda to Write to Dynamodb
         results_table.grant_write_data(write_results_lambda)
 
+        # Allow AWS Lambda write_results_lambda to read and write the label cache
+        label_cache_table.grant_read_write_data(write_results_lambda)
+
+        # Allow AWS Lambda write_results_lambda to read and write the hash index
+        hash_index_table.grant_read_write_data(write_results_lambda)
+
         
         # Output to Amazon S3 Image Bucket
         cdk.CfnOutput(self, 'cdk_output_bucket',
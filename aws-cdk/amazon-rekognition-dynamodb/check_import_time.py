@@ -0,0 +1,97 @@
+"""
+Purpose
+
+Checks the import time of the Lambda handler modules against a budget, to keep
+the cold start of the functions short. Each module is imported in a fresh
+interpreter with `python -X importtime`, several times, and the fastest run is
+compared with the budget of the module. The script exits with a non-zero status
+when a module is over budget, so it can run as a build step:
+
+    python check_import_time.py
+    python check_import_time.py --runs 10 --budget-ms detect_labels=40
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda')
+# Cumulative import time budgets in milliseconds. Creating Boto3 clients or
+# importing boto3, NumPy or Pillow at import time exceeds them.
+DEFAULT_BUDGETS_MS = {
+    'detect_labels': 60,
+    'detect_text': 60,
+    'write_results_text': 60,
+}
+DEFAULT_RUNS = 5
+# The handlers read their configuration from the environment at import.
+HANDLER_ENVIRONMENT = {
+    'TABLE_NAME': 'import-time-check',
+    'SQS_RESPONSE_QUEUE': 'import-time-check',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:import-time-check',
+    'REKOGNITION_CONFIDENCE': '50',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+
+def measure_import_ms(module, python=sys.executable):
+    """
+    Imports a module in a fresh interpreter and gets its cumulative import time.
+
+    :param module: The module name.
+    :param python: The Python interpreter to run.
+    :return: The import time of the module, including its imports, in milliseconds.
+    """
+    environment = dict(os.environ, **HANDLER_ENVIRONMENT)
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=LAMBDA_DIR, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Couldn't import {}:\n{}".format(module, result.stderr[-2000:]))
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError("No import time reported for {}.".format(module))
+
+
+def check(budgets, runs):
+    """
+    Measures every module and compares it with its budget.
+
+    :param budgets: A dict of module name to budget in milliseconds.
+    :param runs: The number of imports per module, the fastest one is kept.
+    :return: The list of modules that are over budget.
+    """
+    over_budget = []
+    for module, budget in sorted(budgets.items()):
+        best = min(measure_import_ms(module) for _ in range(runs))
+        status = 'ok' if best <= budget else 'OVER BUDGET'
+        print('{:<22} {:>8.1f} ms  budget {:>6.1f} ms  {}'.format(module, best, budget, status))
+        if best > budget:
+            over_budget.append(module)
+    return over_budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--budget-ms', nargs='+', default=[], metavar='MODULE=MS',
+                        help='override the budget of a module')
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for override in args.budget_ms:
+        module, budget = override.split('=')
+        budgets[module] = float(budget)
+    if check(budgets, args.runs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,246 @@
+"""
+Downloads the images listed in a CSV file and uploads them to an Amazon S3 bucket.
+
+Each HTTP response body is streamed straight into a (multipart) S3 upload, so no
+temporary files are written and memory stays bounded by the upload chunk size.
+Downloads share a pooled HTTP session and run on a bounded number of workers.
+URLs that fail are retried in later passes.
+
+When a manifest path is given, the state of every URL is checkpointed to it, and
+a restarted run only transfers the URLs that are not in the bucket yet.
+"""
+
 import csv
+import logging
 import os
-import requests
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ingest_manifest import IngestManifest
+
+logger = logging.getLogger(__name__)
+
+# Number of URLs streamed at the same time
+DOWNLOAD_WORKERS = 32
+# Number of threads uploading the parts of one object
+UPLOAD_WORKERS = 4
+# Size of the parts of a multipart upload, objects below this size use a single PutObject
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Number of passes over the URLs that failed
+MAX_RETRIES = 3
+# Connect and read timeouts of the HTTP requests, in seconds
+HTTP_TIMEOUT = (10, 60)
+
 
-def download_files_from_csv(csv_file, s3_bucket):
-    # Create an S3 client
-    s3 = boto3.client('s3')
+class TransferStats:
+    """Thread-safe counters of the objects and bytes transferred."""
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
 
+    def add(self, num_bytes):
+        with self._lock:
+            self.objects += 1
+            self.bytes += num_bytes
+
+    def to_dict(self):
+        """
+        Renders the counters and the throughput to a dict.
+
+        :return: A dict that contains the transfer counters and rates.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            'objects': self.objects,
+            'failed': self.failed,
+            'megabytes': round(self.bytes / 1e6, 2),
+            'seconds': round(elapsed, 2),
+            'objects_per_second': round(self.objects / elapsed, 2) if elapsed else 0.0,
+            'megabytes_per_second': round(self.bytes / 1e6 / elapsed, 2) if elapsed else 0.0}
+
+
+class _CountingReader:
+    """File-like wrapper that counts the bytes read from a response body."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def read_urls(csv_file):
+    """
+    Reads the image URLs from the first column of a CSV file.
+
+    :param csv_file: The path of the CSV file.
+    :return: The list of URLs.
+    """
     with open(csv_file, 'r') as file:
         reader = csv.reader(file)
-        for row in reader:
-            url = row[0]  # Assuming the URL is in the first column of the CSV
-            url = url.replace(u'\ufeff', '')
-
-            # Download the file
-            response = requests.get(url)
-            if response.status_code == 200:
-                file_name = url.split('/')[-1]  # Extract the file name from the URL
-                with open(file_name, 'wb') as f:
-                    f.write(response.content)
-                
-                # Upload the file to S3
-                s3.upload_file(file_name, s3_bucket, file_name)
-                #print(f'Uploading file: {file_name}')
-                
-                # Remove the local file after uploading to S3
-                os.remove(file_name)
-            else:
-                print(f"Failed to download file from URL: {url}")
-
-# Usage example
-csv_file = 'Image_urls.csv'
-s3_bucket = 'detectlabels-rekogntion-inboundimagess3bucket406-10y4rhkn8ry8k'
-
-download_files_from_csv(csv_file, s3_bucket)
+        return [row[0].replace(u'\ufeff', '').strip() for row in reader if row]
+
+
+def object_key_from_url(url):
+    """
+    Gets the S3 object key of a URL, which is the file name of the URL.
+
+    :param url: The image URL.
+    :return: The object key.
+    """
+    return url.split('/')[-1]
+
+
+def create_http_session(pool_size, max_retries=MAX_RETRIES):
+    """
+    Creates an HTTP session whose connection pool fits the number of workers and
+    that retries connection errors and throttling responses.
+
+    :param pool_size: The number of connections kept per host.
+    :param max_retries: The number of retries of a single request.
+    :return: The requests Session.
+    """
+    retry = Retry(total=max_retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def stream_url_to_s3(session, s3_client, url, s3_bucket, transfer_config):
+    """
+    Streams the body of a URL into an S3 object without buffering it on disk.
+
+    :param session: A requests Session.
+    :param s3_client: A Boto3 S3 client.
+    :param url: The URL to download.
+    :param s3_bucket: The name of the destination bucket.
+    :param transfer_config: The TransferConfig of the upload.
+    :return: The object key and the number of bytes uploaded.
+    """
+    key = object_key_from_url(url)
+    with session.get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        body = _CountingReader(response.raw)
+        extra_args = {}
+        if response.headers.get('Content-Type'):
+            extra_args['ContentType'] = response.headers['Content-Type']
+        s3_client.upload_fileobj(body, s3_bucket, key,
+                                 ExtraArgs=extra_args, Config=transfer_config)
+    return key, body.bytes_read
+
+
+def download_files_from_csv(csv_file, s3_bucket, download_workers=DOWNLOAD_WORKERS,
+                            upload_workers=UPLOAD_WORKERS, max_retries=MAX_RETRIES,
+                            manifest_path=None):
+    """
+    Downloads every URL of a CSV file into an S3 bucket, using concurrent streams.
+
+    :param csv_file: The path of the CSV file, with the URLs in the first column.
+    :param s3_bucket: The name of the destination bucket.
+    :param download_workers: The number of URLs streamed at the same time.
+    :param upload_workers: The number of threads uploading the parts of one object.
+    :param max_retries: The number of passes over the URLs that failed.
+    :param manifest_path: The path of the manifest that checkpoints the run, or
+                          None to transfer every URL without checkpoints.
+    :return: The TransferStats of the run and the list of URLs that still failed.
+    """
+    # Create an S3 client whose pool fits every concurrent part upload
+    s3 = boto3.client('s3', config=Config(
+        max_pool_connections=download_workers * upload_workers,
+        retries={'max_attempts': 10, 'mode': 'adaptive'}))
+    transfer_config = TransferConfig(multipart_threshold=UPLOAD_CHUNK_SIZE,
+                                     multipart_chunksize=UPLOAD_CHUNK_SIZE,
+                                     max_concurrency=upload_workers)
+    session = create_http_session(download_workers)
+    stats = TransferStats()
+    failed = []
+
+    urls = read_urls(csv_file)
+    manifest = None
+    if manifest_path is not None:
+        resuming = os.path.exists(manifest_path)
+        manifest = IngestManifest(manifest_path)
+        manifest.add_urls(urls, object_key_from_url)
+        if resuming:
+            manifest.reconcile(s3, s3_bucket)
+        urls = manifest.pending_urls()
+        logger.info("%s URLs left to transfer.", len(urls))
+
+    def transfer(url):
+        """Returns the URL when it failed and is worth retrying, None otherwise."""
+        try:
+            key, num_bytes = stream_url_to_s3(
+                session, s3, url, s3_bucket, transfer_config)
+        except requests.HTTPError as error:
+            logger.warning("Failed to download %s: %s", url, error)
+            if manifest is not None:
+                manifest.mark_failed(url, error)
+            status = error.response.status_code
+            if status < 500 and status != 429:
+                # Client errors such as 404 will not succeed on a retry.
+                failed.append(url)
+                return None
+            return url
+        except (requests.RequestException, ClientError, BotoCoreError) as error:
+            logger.warning("Failed to transfer %s: %s", url, error)
+            if manifest is not None:
+                manifest.mark_failed(url, error)
+            return url
+        stats.add(num_bytes)
+        if manifest is not None:
+            manifest.mark_uploaded(url, num_bytes)
+        logger.debug("Uploaded %s (%s bytes).", key, num_bytes)
+        return None
+
+    pending = urls
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt > 0:
+                logger.info("Retrying %s failed URLs, pass %s of %s.",
+                            len(pending), attempt, max_retries)
+                time.sleep(2 ** attempt)
+            pending = [url for url in executor.map(transfer, pending) if url is not None]
+            logger.info("Transfer stats: %s", stats.to_dict())
+
+    failed.extend(pending)
+    if manifest is not None:
+        manifest.close()
+        logger.info("Manifest %s: %s", manifest_path, manifest.summary())
+    stats.failed = len(failed)
+    for url in failed:
+        print(f"Failed to download file from URL: {url}")
+    print(f"Transfer stats: {stats.to_dict()}")
+    return stats, failed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    # Usage example: python from_csv_to_s3.py [csv_file] [s3_bucket] [manifest]
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else 'Image_urls.csv'
+    s3_bucket = sys.argv[2] if len(sys.argv) > 2 else 'detectlabels-rekogntion-inboundimagess3bucket406-10y4rhkn8ry8k'
+    manifest_path = sys.argv[3] if len(sys.argv) > 3 else csv_file + '.manifest.jsonl'
+
+    download_files_from_csv(csv_file, s3_bucket, manifest_path=manifest_path)
@@ -0,0 +1,202 @@
+"""
+Manifest of a CSV-to-S3 ingestion run.
+
+The manifest records the state of every URL (pending, uploaded or failed) with
+the object key, size and, once listed, ETag. State changes are appended to a JSON Lines journal
+in batches, each batch with a single write and fsync, so a crash loses at most
+the last unflushed batch. A torn trailing line is cut off on load, so the next
+batch starts on a line of its own. Closing the manifest compacts the journal to
+one line per URL and atomically replaces it.
+
+On restart, reconcile() marks the URLs whose objects already exist in the bucket
+as uploaded, using one ListObjectsV2 sweep instead of a HEAD request per key.
+The sweep is limited to the common prefix of the keys of the manifest.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+UPLOADED = 'uploaded'
+FAILED = 'failed'
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class IngestManifest:
+    """Tracks the state of every URL of an ingestion run in a local journal."""
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Initializes the manifest and loads the journal, if it exists.
+
+        :param path: The path of the JSON Lines journal.
+        :param batch_size: The number of state changes buffered before they are
+                           written to the journal.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.entries = {}
+        self._buffer = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            # A batch was cut off by a crash; the next one would be appended to
+            # its last line.
+            logger.warning("Cutting off the torn last line of %s.", self.path)
+            with open(self.path, 'rb+') as fp:
+                fp.truncate(complete)
+        lines = data[:complete].decode('utf-8').splitlines()
+        for line_number, line in enumerate(lines, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Ignoring torn line %s of %s.", line_number, self.path)
+                continue
+            self.entries[entry['url']] = entry
+        logger.info("Loaded %s manifest entries from %s: %s",
+                    len(self.entries), self.path, self.summary())
+
+    def _record(self, entry):
+        self.entries[entry['url']] = entry
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        data = ''.join(json.dumps(entry) + '\n' for entry in self._buffer)
+        with open(self.path, 'a') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._buffer = []
+
+    def flush(self):
+        """Writes the buffered state changes to the journal."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Flushes the journal and compacts it to one line per URL."""
+        with self._lock:
+            self._buffer = []
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as fp:
+                for entry in self.entries.values():
+                    fp.write(json.dumps(entry) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp_path, self.path)
+
+    def add_urls(self, urls, key_func):
+        """
+        Adds the URLs that are not in the manifest yet as pending.
+
+        :param urls: The URLs of the run.
+        :param key_func: A function that returns the object key of a URL.
+        """
+        with self._lock:
+            for url in urls:
+                if url not in self.entries:
+                    self._record({'url': url, 'key': key_func(url), 'state': PENDING})
+            self._flush_locked()
+
+    def pending_urls(self):
+        """
+        Gets the URLs that still need to be transferred.
+
+        :return: The list of URLs that are not uploaded.
+        """
+        return [url for url, entry in self.entries.items() if entry['state'] != UPLOADED]
+
+    def mark_uploaded(self, url, size, etag=None):
+        """Records that the object of a URL was uploaded."""
+        with self._lock:
+            entry = dict(self.entries[url], state=UPLOADED, size=size, etag=etag)
+            entry.pop('error', None)
+            self._record(entry)
+
+    def mark_failed(self, url, error):
+        """Records that a URL failed, with the error message."""
+        with self._lock:
+            self._record(dict(self.entries[url], state=FAILED, error=str(error)))
+
+    def reconcile(self, s3_client, s3_bucket, prefix=None):
+        """
+        Reconciles the manifest with the objects in the bucket, listed with one
+        ListObjectsV2 sweep. URLs whose object exists, such as the uploads of a
+        batch lost in a crash, are marked as uploaded with the listed ETag and
+        size. Uploaded URLs get the listed ETag, and are marked as pending again
+        when their object is missing or its size isn't the uploaded size.
+
+        :param s3_client: A Boto3 S3 client.
+        :param s3_bucket: The name of the bucket.
+        :param prefix: The key prefix of the ingested objects, by default the
+                       common prefix of the keys of the manifest.
+        :return: The number of entries whose state changed.
+        """
+        with self._lock:
+            urls_of_keys = {}
+            for url, entry in self.entries.items():
+                urls_of_keys.setdefault(entry['key'], []).append(url)
+        if prefix is None:
+            prefix = os.path.commonprefix(list(urls_of_keys))
+
+        # Only the objects of the manifest are kept, so memory follows the
+        # manifest rather than the bucket.
+        objects = {}
+        listed = 0
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                listed += 1
+                if obj['Key'] in urls_of_keys:
+                    objects[obj['Key']] = (obj['ETag'], obj['Size'])
+        logger.info("Listed %s objects in %s/%s, %s of them in the manifest.",
+                    listed, s3_bucket, prefix, len(objects))
+
+        changed = 0
+        with self._lock:
+            for key, urls in urls_of_keys.items():
+                obj = objects.get(key)
+                for url in urls:
+                    entry = self.entries[url]
+                    if obj is None:
+                        if entry['state'] == UPLOADED:
+                            self._record(dict(entry, state=PENDING))
+                            changed += 1
+                        continue
+                    etag, size = obj
+                    if entry['state'] != UPLOADED:
+                        self._record(dict(entry, state=UPLOADED, etag=etag, size=size))
+                        changed += 1
+                    elif entry.get('size') not in (None, size):
+                        self._record(dict(entry, state=PENDING))
+                        changed += 1
+                    elif entry.get('etag') != etag:
+                        self._record(dict(entry, etag=etag, size=size))
+            self._flush_locked()
+        logger.info("Reconciled %s manifest entries: %s", changed, self.summary())
+        return changed
+
+    def summary(self):
+        """
+        Counts the entries of each state.
+
+        :return: A dict of state to number of URLs.
+        """
+        counts = {PENDING: 0, UPLOADED: 0, FAILED: 0}
+        for entry in self.entries.values():
+            counts[entry['state']] += 1
+        return counts
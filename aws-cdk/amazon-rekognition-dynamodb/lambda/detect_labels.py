@@ -2,13 +2,17 @@
 #PDX-License-Identifier: MIT-0 (For details, see https://github.com/awsdocs/amazon-rekognition-developer-guide/blob/master/LICENSE-SAMPLECODE.)
 # Ref: https://docs.aws.amazon.com/rekognition/latest/dg/labels-detect-labels-image.html
 
-import boto3
 from botocore.exceptions import ClientError
 from io import BytesIO
 import json
 import logging
 import os
 
+from label_cache import DynamoDBLabelCache, cached_detect_labels
+from label_schema import LABEL_SHARDS, make_label_item, write_label_items
+from lazy_clients import get_resource, lazy_client, lazy_resource
+from metrics import MetricsLogger
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -16,10 +20,78 @@ logger.setLevel(logging.DEBUG)
 # Environment variables
 TABLE_NAME = os.environ['TABLE_NAME']
 REKOGNITION_CONFIDENCE = os.environ['REKOGNITION_CONFIDENCE']
-
-# DynamoDB Resource
-dynamodb = boto3.resource('dynamodb')
-rekognition_client = boto3.client('rekognition')
+LABEL_CACHE_TABLE = os.environ.get('LABEL_CACHE_TABLE')
+LABEL_CACHE_TTL_DAYS = int(os.environ.get('LABEL_CACHE_TTL_DAYS', '30'))
+HASH_INDEX_TABLE = os.environ.get('HASH_INDEX_TABLE')
+HASH_RADIUS = int(os.environ.get('HASH_RADIUS', '4'))
+# Largest side of the images sent as Image.Bytes, 0 sends the S3 object reference instead
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '0'))
+MAX_LABELS = 20
+# Number of index partition keys per label of the Label_Confidence_Index
+LABEL_SHARDS = int(os.environ.get('LABEL_SHARDS', LABEL_SHARDS))
+# Where the results are written: dynamodb, or sqlite for a local database
+RESULTS_BACKEND = os.environ.get('RESULTS_BACKEND', 'dynamodb')
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', '/tmp/results.db')
+
+# Per-stage metrics, written as CloudWatch Embedded Metric Format at the end of each invocation
+metrics = MetricsLogger({'Function': 'detect_labels'})
+
+# DynamoDB Resource, Rekognition and S3 clients, created on first use
+dynamodb = lazy_resource('dynamodb')
+rekognition_client = lazy_client('rekognition')
+s3_client = lazy_client('s3')
+
+# SQLite results store, opened on first use when RESULTS_BACKEND is sqlite
+results_store = None
+
+
+def get_results_store():
+    """
+    Opens the SQLite results store on first use.
+
+    :return: The SQLiteResultsStore.
+    """
+    global results_store
+    if results_store is None:
+        from results_store import SQLiteResultsStore
+        results_store = SQLiteResultsStore(RESULTS_DB_PATH)
+    return results_store
+
+
+# Built on the first invocation by get_labels_client, kept while the container is warm
+label_cache = None
+labels_client = None
+
+
+def get_labels_client():
+    """
+    Builds the label cache and the DetectLabels client on first use. The image
+    libraries (NumPy, Pillow) are imported only when a feature that needs them is
+    enabled.
+
+    :return: The label cache, or None when it is disabled, and the client.
+    """
+    global label_cache, labels_client
+    if labels_client is None:
+        # Cache of DetectLabels responses keyed on the image ETag
+        if LABEL_CACHE_TABLE:
+            label_cache = DynamoDBLabelCache(dynamodb.Table(LABEL_CACHE_TABLE),
+                                             ttl_seconds=LABEL_CACHE_TTL_DAYS * 24 * 60 * 60)
+
+        # Reuse the labels of near-duplicate images, found by perceptual hash, on a cache miss
+        client = rekognition_client
+        if HASH_INDEX_TABLE:
+            from image_hash import DynamoDBHashIndex, NearDuplicateLabelClient
+            client = NearDuplicateLabelClient(client, s3_client,
+                                              DynamoDBHashIndex(dynamodb.Table(HASH_INDEX_TABLE),
+                                                                radius=HASH_RADIUS))
+
+        # Send downscaled image bytes instead of the S3 object reference
+        if IMAGE_MAX_DIMENSION:
+            from image_downscale import DownscalingLabelClient
+            client = DownscalingLabelClient(client, s3_client, IMAGE_MAX_DIMENSION)
+        labels_client = client
+    return label_cache, labels_client
 
 
 # A function called find_values is used to get just the labels from the response. 
@@ -38,59 +110,72 @@ def find_values(id, json_repr):
     return results
 
 
-#Load the images and labels into the DynamoDB table you created.
-def load_data(image_labels, dynamodb=None):
+#Load the label items of an image into the DynamoDB table you created, one item per label.
+def load_data(label_items, dynamodb=None):
+
+    if RESULTS_BACKEND == 'sqlite':
+        store = get_results_store()
+        for item in label_items:
+            store.put_label(item)
+        store.flush()
+        return len(label_items)
 
     if not dynamodb:
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = get_resource('dynamodb')
 
     table = dynamodb.Table(TABLE_NAME)
 
-    print("Adding image details:", image_labels)
+    logger.info("Adding {} label items".format(len(label_items)))
     try:
-        put_item_response = table.put_item(Item=image_labels)
-        return put_item_response
+        with metrics.timer('DynamoDBBatchWrite'):
+            written = write_label_items(table, label_items)
+        metrics.increment('ItemsWritten', written)
+        return written
 
     except ClientError as error:
-        return error.response
+        metrics.increment('DynamoDBBatchWriteErrors')
+        logger.error("Couldn't write the labels: {}".format(error.response['Error']))
+        return 0
     
 
 
 
-def detect_labels(bucket_name, file_name):
+def detect_labels(bucket_name, file_name, etag=None):
 
     logger.info("Detecting {}/{}".format(bucket_name, file_name))
-
-    # get the labels for the image by calling DetectLabels from Rekognition
-    response = rekognition_client.detect_labels(
-        Image={'S3Object': {'Bucket': bucket_name, 
-                            'Name': file_name}},
-                            MaxLabels=20
-                            # Uncomment to use image properties and filtration settings
-                            #Features=["GENERAL_LABELS", "IMAGE_PROPERTIES"],
-                            #Settings={"GeneralLabels": {"LabelInclusionFilters":["Person"]},
-                            # "ImageProperties": {"MaxDominantColors":10}}
-                            ,MinConfidence=int(REKOGNITION_CONFIDENCE))
+    label_cache, labels_client = get_labels_client()
+
+    if label_cache is not None and etag is None:
+        with metrics.timer('HeadObject'):
+            etag = s3_client.head_object(Bucket=bucket_name, Key=file_name)['ETag']
+
+    cache_hits = label_cache.stats.hits if label_cache is not None else 0
+    # get the labels for the image from the cache, or by calling DetectLabels from Rekognition
+    with metrics.timer('DetectLabels'):
+        labels = cached_detect_labels(
+            label_cache,
+            labels_client,
+            {'S3Object': {'Bucket': bucket_name,
+                          'Name': file_name}},
+            etag,
+            MAX_LABELS,
+            int(REKOGNITION_CONFIDENCE))
+            # Pass features and settings to use image properties and filtration settings
+            #features=["GENERAL_LABELS", "IMAGE_PROPERTIES"],
+            #settings={"GeneralLabels": {"LabelInclusionFilters":["Person"]},
+            # "ImageProperties": {"MaxDominantColors":10}}
+    metrics.put_metric('Labels', len(labels))
 
     print('Detected labels for ' + file_name)
+    if label_cache is not None:
+        metrics.increment('LabelCacheHits', label_cache.stats.hits - cache_hits)
+        logger.info("Label cache stats: {}".format(label_cache.stats.to_dict()))
     image_name = file_name
 
-    for label in response['Labels']:
-        for category in label['Categories']:
-            labels_dict = {}
-            labels_dict["Image"] = str(image_name)
-            labels_dict["Label_Name"] = str(label['Name'])
-            labels_dict["Label_Confidence"] = int(label['Confidence'])
-            labels_dict["Label_Category"] = str(category['Name'])
-            if len(label['Aliases']) >= 1:
-                 for alias in label['Aliases']:
-                    labels_dict["Label_Aliases"] = str(alias['Name'])
-                    load_data(labels_dict)
-            else:
-                labels_dict["Label_Aliases"] = ''
-                load_data(labels_dict)
+    # One item per label, carrying all of its categories, aliases, parents and instances
+    load_data([make_label_item(image_name, label, LABEL_SHARDS) for label in labels])
 
-    return len(response['Labels'])
+    return len(labels)
 
 
 def lambda_handler(event, context):
@@ -106,8 +191,14 @@ def lambda_handler(event, context):
 
     s3_bucket_name = message_body['s3']['bucket']['name']
     s3_object_key = message_body['s3']['object']['key']
+    s3_object_etag = message_body['s3']['object'].get('eTag')
+    if 'size' in message_body['s3']['object']:
+        metrics.put_metric('BytesProcessed', message_body['s3']['object']['size'], unit='Bytes')
 
     logger.info("Bucket = {}".format(s3_bucket_name))
     logger.info("Object Key = {}".format(s3_object_key))
 
-    return detect_labels(s3_bucket_name, s3_object_key)
\ No newline at end of file
+    try:
+        return detect_labels(s3_bucket_name, s3_object_key, s3_object_etag)
+    finally:
+        metrics.flush()
\ No newline at end of file
@@ -5,13 +5,15 @@ June 15th 2021
 
 import json
 import logging
-import boto3
 import os
 import re
 from botocore.exceptions import ClientError
 from time import sleep
 from random import randint
 
+from lazy_clients import lazy_client
+from metrics import MetricsLogger
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -23,10 +25,12 @@ REKOGNITION_CONFIDENCE = os.environ['REKOGNITION_CONFIDENCE']
 
 MAX_RETRIES = 3
 
-# Boto 3 Resources / Clients
-logger.info("BOTO_VERSION: {}".format(boto3.__version__))
-lambda_client = boto3.client('lambda')
-rekognition_client = boto3.client('rekognition', region_name='us-east-1')
+# Per-stage metrics, written as CloudWatch Embedded Metric Format at the end of each invocation
+metrics = MetricsLogger({'Function': 'detect_text'})
+
+# Boto 3 Resources / Clients, created on first use
+lambda_client = lazy_client('lambda')
+rekognition_client = lazy_client('rekognition', region_name='us-east-1')
 
 
 
@@ -48,7 +52,8 @@ def detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name):
             logger.info("SNS_TOPIC_ARN: {}".format(SNS_TOPIC_ARN))
             logger.info("AWS_LAMBDA_FUNCTION_NAME: {}".format(my_function_name))
 
-            response = lambda_client.get_function(FunctionName=my_function_name)
+            with metrics.timer('GetFunction'):
+                response = lambda_client.get_function(FunctionName=my_function_name)
             lambda_config= response['Configuration']
             lambda_config_role = lambda_config['Role']
             logger.info("LAMBDA_ROLE: {}".format(lambda_config_role))
@@ -60,24 +65,26 @@ def detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name):
 
             
             # Calling start_text_detection
-            job_id = rekognition_client.start_text_detection(
-                Video={
-                    'S3Object': {
-                        'Bucket': s3_bucket_name,
-                        'Name': s3_object_key
-                    }
-                }
-                 ,NotificationChannel={
-                    'SNSTopicArn': SNS_TOPIC_ARN,
-                    'RoleArn': lambda_config_role
+            with metrics.timer('StartTextDetection'):
+                job_id = rekognition_client.start_text_detection(
+                    Video={
+                        'S3Object': {
+                            'Bucket': s3_bucket_name,
+                            'Name': s3_object_key
+                        }
                     }
-                ,JobTag=job_tag
-                ,Filters={
-                    'WordFilter': {
-                        'MinConfidence': float(REKOGNITION_CONFIDENCE)
+                     ,NotificationChannel={
+                        'SNSTopicArn': SNS_TOPIC_ARN,
+                        'RoleArn': lambda_config_role
+                        }
+                    ,JobTag=job_tag
+                    ,Filters={
+                        'WordFilter': {
+                            'MinConfidence': float(REKOGNITION_CONFIDENCE)
+                        }
                     }
-                }
-            )
+                )
+            metrics.increment('JobsStarted')
 
             logger.info("Called start_text_detection for {}, got job_id: {}".format(job_tag, job_id))
             return job_id
@@ -85,6 +92,7 @@ def detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name):
 
         except ClientError as error:
 
+            metrics.increment('StartTextDetectionErrors')
             if num_retries == MAX_RETRIES:
                 raise error
 
@@ -92,6 +100,7 @@ def detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name):
                     error.__class__.__name__ == 'ProvisionedThroughputExceededException':
 
                 num_retries += 1
+                metrics.increment('StartTextDetectionRetries')
                 wait_time = 0.10 * (2 ** num_retries)
                 rand_jitter = randint(200, 1000) / 1000
                 sleep(wait_time + rand_jitter)
@@ -131,4 +140,7 @@ def lambda_handler(event, context):
     logger.info("Bucket = {}".format(s3_bucket_name))
     logger.info("Object Key = {}".format(s3_object_key))
 
-    return detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name)
+    try:
+        return detect_texts_rekognition(s3_bucket_name, s3_object_key, my_function_name)
+    finally:
+        metrics.flush()
@@ -0,0 +1,273 @@
+"""
+Purpose
+
+Read-through cache for Amazon Rekognition DetectLabels responses. Entries are
+keyed on the S3 object ETag together with the request parameters, so an image
+that was already labeled is not sent to Rekognition a second time, even when it
+was uploaded again under another key.
+
+Two backends are provided: a local-disk cache for command line runs and an
+Amazon DynamoDB cache for AWS Lambda. Both expire entries after a TTL, keep a
+size-bounded LRU and count hits and misses.
+
+Note that the ETag of a multipart upload depends on the part size, so the same
+image uploaded with different part sizes gets different cache entries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def make_cache_key(etag, max_labels, min_confidence, features=None, settings=None):
+    """
+    Builds the cache key of a DetectLabels request.
+
+    :param etag: The ETag of the S3 object, with or without surrounding quotes.
+    :param max_labels: The MaxLabels value of the request.
+    :param min_confidence: The MinConfidence value of the request.
+    :param features: The Features list of the request, if any.
+    :param settings: The Settings dict of the request, if any.
+    :return: A hex digest that identifies the request.
+    """
+    feature_set = ','.join(sorted(features)) if features else 'GENERAL_LABELS'
+    raw_key = '|'.join([
+        etag.strip('"'),
+        str(max_labels),
+        str(float(min_confidence)),
+        feature_set,
+        json.dumps(settings, sort_keys=True) if settings else ''])
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+
+class CacheStats:
+    """Counts the hits, misses and evictions of a cache."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def to_dict(self):
+        """
+        Renders the counters to a dict.
+
+        :return: A dict that contains the cache counters.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hit_ratio, 4)}
+
+
+class LocalDiskLabelCache:
+    """
+    Stores cached labels as one JSON file per entry in a local directory. The file
+    modification time records the last access, so the LRU order survives between
+    runs.
+    """
+    def __init__(self, directory, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initializes the cache and loads the LRU order of the existing entries.
+
+        :param directory: The directory that holds the cache files.
+        :param ttl_seconds: The number of seconds an entry stays valid.
+        :param max_entries: The maximum number of entries kept on disk.
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.json'):
+                path = os.path.join(directory, file_name)
+                entries.append((os.path.getmtime(path), file_name[:-len('.json')]))
+        self._lru = OrderedDict((key, None) for _, key in sorted(entries))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _remove(self, key):
+        self._lru.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """
+        Gets the cached labels of a key.
+
+        :param key: The cache key, as returned by make_cache_key.
+        :return: The cached list of labels, or None when there is no valid entry.
+        """
+        try:
+            with open(self._path(key)) as fp:
+                entry = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            self.stats.misses += 1
+            return None
+        if entry['created'] + self.ttl_seconds < time.time():
+            self._remove(key)
+            self.stats.expired += 1
+            self.stats.misses += 1
+            return None
+        os.utime(self._path(key))
+        self._lru[key] = None
+        self._lru.move_to_end(key)
+        self.stats.hits += 1
+        return entry['labels']
+
+    def put(self, key, labels):
+        """
+        Stores the labels of a key and evicts the least recently used entries when
+        the cache is full.
+
+        :param key: The cache key, as returned by make_cache_key.
+        :param labels: The Labels list of a DetectLabels response.
+        """
+        temp_path = self._path(key) + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump({'created': time.time(), 'labels': labels}, fp)
+        os.replace(temp_path, self._path(key))
+        self._lru[key] = None
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            oldest_key = next(iter(self._lru))
+            self._remove(oldest_key)
+            self.stats.evictions += 1
+
+
+class DynamoDBLabelCache:
+    """
+    Stores cached labels in an Amazon DynamoDB table whose partition key is
+    Cache_Key. Expired items are removed by the table TTL on Expires_At. A
+    size-bounded LRU in front of the table serves repeated lookups from a warm
+    Lambda container without calling DynamoDB.
+    """
+    def __init__(self, table, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initializes the cache.
+
+        :param table: A Boto3 DynamoDB Table resource.
+        :param ttl_seconds: The number of seconds an entry stays valid.
+        :param max_entries: The maximum number of entries kept in memory.
+        """
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._lru = OrderedDict()
+
+    def _remember(self, key, labels, expires_at):
+        self._lru[key] = (labels, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.stats.evictions += 1
+
+    def get(self, key):
+        """
+        Gets the cached labels of a key, from memory first and then from the table.
+
+        :param key: The cache key, as returned by make_cache_key.
+        :return: The cached list of labels, or None when there is no valid entry.
+        """
+        now = time.time()
+        cached = self._lru.get(key)
+        if cached is not None and cached[1] >= now:
+            self._lru.move_to_end(key)
+            self.stats.hits += 1
+            return cached[0]
+
+        try:
+            item = self.table.get_item(Key={'Cache_Key': key}).get('Item')
+        except ClientError:
+            logger.warning("Couldn't read label cache entry %s.", key, exc_info=True)
+            item = None
+        # DynamoDB deletes expired items lazily, so check the expiry here as well.
+        if item is None or item['Expires_At'] < now:
+            if item is not None:
+                self.stats.expired += 1
+            self.stats.misses += 1
+            return None
+        labels = json.loads(item['Labels'])
+        self._remember(key, labels, float(item['Expires_At']))
+        self.stats.hits += 1
+        return labels
+
+    def put(self, key, labels):
+        """
+        Stores the labels of a key in memory and in the table.
+
+        :param key: The cache key, as returned by make_cache_key.
+        :param labels: The Labels list of a DetectLabels response.
+        """
+        expires_at = int(time.time() + self.ttl_seconds)
+        self._remember(key, labels, expires_at)
+        try:
+            self.table.put_item(Item={
+                'Cache_Key': key,
+                'Labels': json.dumps(labels),
+                'Expires_At': Decimal(expires_at)})
+        except ClientError:
+            logger.warning("Couldn't write label cache entry %s.", key, exc_info=True)
+
+
+def cached_detect_labels(
+        cache, rekognition_client, image, etag, max_labels, min_confidence,
+        features=None, settings=None):
+    """
+    Gets the labels of an image from the cache, and calls DetectLabels only on a
+    cache miss.
+
+    :param cache: A LocalDiskLabelCache or DynamoDBLabelCache, or None to always
+                  call Rekognition.
+    :param rekognition_client: A Boto3 Rekognition client.
+    :param image: The Image parameter of the DetectLabels request.
+    :param etag: The ETag of the S3 object that contains the image.
+    :param max_labels: The MaxLabels value of the request.
+    :param min_confidence: The MinConfidence value of the request.
+    :param features: The Features list of the request, if any.
+    :param settings: The Settings dict of the request, if any.
+    :return: The Labels list of the DetectLabels response.
+    """
+    key = None
+    if cache is not None and etag:
+        key = make_cache_key(etag, max_labels, min_confidence, features, settings)
+        labels = cache.get(key)
+        if labels is not None:
+            logger.info("Label cache hit for %s.", etag)
+            return labels
+
+    request = {'Image': image, 'MaxLabels': max_labels, 'MinConfidence': min_confidence}
+    if features:
+        request['Features'] = features
+    if settings:
+        request['Settings'] = settings
+    labels = rekognition_client.detect_labels(**request)['Labels']
+    if key is not None:
+        cache.put(key, labels)
+    return labels
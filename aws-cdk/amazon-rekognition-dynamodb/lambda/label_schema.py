@@ -0,0 +1,134 @@
+"""
+Purpose
+
+Item schema of the image labels table. The table is keyed on (Image, Label_Name)
+and holds one item per label of an image, with the label confidence and its full
+sets of categories, aliases, parents and instance bounding boxes:
+
+    {'Image': 'reef.jpg', 'Label_Name': 'Fish', 'Label_Confidence': Decimal('97.31'),
+     'Label_Shard': 'Fish#5', 'Label_Categories': ['Animals and Pets'], 'Label_Aliases': [],
+     'Label_Parents': ['Animal'],
+     'Label_Instances': [{'BoundingBox': {...}, 'Confidence': Decimal('95.02')}]}
+
+Earlier versions wrote one item per (label, category, alias) with the single
+Label_Category and Label_Aliases strings. Those items shared the key of the label,
+so each write replaced the previous one. upgrade_item() converts such an item.
+
+Images are found by label through the Label_Confidence_Index global secondary
+index, keyed on Label_Shard and sorted by Label_Confidence. A popular label such
+as Person would make a single hot index partition, so the items of a label are
+spread over LABEL_SHARDS partition keys, Label_Name#n, picked from a hash of the
+image name. Queries read every shard and merge the results.
+"""
+
+import zlib
+from decimal import Decimal
+
+KEY_ATTRIBUTES = ['Image', 'Label_Name']
+LABEL_INDEX_NAME = 'Label_Confidence_Index'
+# Number of index partition keys per label, writers and readers must agree on it
+LABEL_SHARDS = 8
+# Digits kept of the confidences and of the bounding box ratios
+CONFIDENCE_DIGITS = 2
+BOX_DIGITS = 4
+
+
+def _decimal(value, digits):
+    return Decimal(str(round(float(value), digits)))
+
+
+def label_shard_key(label_name, image, shards=LABEL_SHARDS):
+    """
+    Gets the index partition key of a label of an image.
+
+    :param label_name: The label name.
+    :param image: The image name.
+    :param shards: The number of shards per label.
+    :return: The Label_Shard value.
+    """
+    return '{}#{}'.format(label_name, zlib.crc32(image.encode('utf-8')) % shards)
+
+
+def label_shard_keys(label_name, shards=LABEL_SHARDS):
+    """
+    Gets every index partition key of a label.
+
+    :param label_name: The label name.
+    :param shards: The number of shards per label.
+    :return: The list of Label_Shard values.
+    """
+    return ['{}#{}'.format(label_name, shard) for shard in range(shards)]
+
+
+def make_label_item(image, label, shards=LABEL_SHARDS):
+    """
+    Builds the item of a label of an image.
+
+    :param image: The image name.
+    :param label: A label of a DetectLabels response.
+    :param shards: The number of index shards per label.
+    :return: The item dict, ready for DynamoDB.
+    """
+    instances = []
+    for instance in label.get('Instances', []):
+        box = instance.get('BoundingBox')
+        if not box:
+            continue
+        rendering = {'BoundingBox': {
+            name: _decimal(box[name], BOX_DIGITS) for name in ('Width', 'Height', 'Left', 'Top')}}
+        if instance.get('Confidence') is not None:
+            rendering['Confidence'] = _decimal(instance['Confidence'], CONFIDENCE_DIGITS)
+        instances.append(rendering)
+    return {
+        'Image': str(image),
+        'Label_Name': str(label['Name']),
+        'Label_Confidence': _decimal(label['Confidence'], CONFIDENCE_DIGITS),
+        'Label_Shard': label_shard_key(str(label['Name']), str(image), shards),
+        'Label_Categories': [category['Name'] for category in label.get('Categories', [])],
+        'Label_Aliases': [alias['Name'] for alias in label.get('Aliases', [])],
+        'Label_Parents': [parent['Name'] for parent in label.get('Parents', [])],
+        'Label_Instances': instances,
+    }
+
+
+def upgrade_item(item, shards=LABEL_SHARDS):
+    """
+    Converts an item of the earlier one-item-per-alias schema, or an item without
+    the index key. Items that already have the current schema are returned
+    unchanged.
+
+    :param item: The item read from the table.
+    :param shards: The number of index shards per label.
+    :return: The item in the current schema.
+    """
+    if 'Label_Categories' in item:
+        if 'Label_Shard' in item:
+            return item
+        return dict(item, Label_Shard=label_shard_key(item['Label_Name'], item['Image'], shards))
+    upgraded = {key: value for key, value in item.items()
+                if key not in ('Label_Category', 'Label_Aliases')}
+    category = item.get('Label_Category')
+    alias = item.get('Label_Aliases')
+    upgraded['Label_Categories'] = [category] if category else []
+    upgraded['Label_Aliases'] = [alias] if alias else []
+    upgraded.setdefault('Label_Parents', [])
+    upgraded.setdefault('Label_Instances', [])
+    upgraded['Label_Shard'] = label_shard_key(item['Label_Name'], item['Image'], shards)
+    return upgraded
+
+
+def write_label_items(table, items):
+    """
+    Writes label items with a batch writer, which sends BatchWriteItem requests
+    of up to 25 items and resends unprocessed items.
+
+    :param table: A Boto3 DynamoDB Table.
+    :param items: An iterable of label items.
+    :return: The number of items written.
+    """
+    count = 0
+    with table.batch_writer(overwrite_by_pkeys=KEY_ATTRIBUTES) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+            count += 1
+    return count
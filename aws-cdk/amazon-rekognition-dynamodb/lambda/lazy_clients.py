@@ -0,0 +1,67 @@
+"""
+Purpose
+
+Lazy Boto3 clients and resources for the Lambda handlers. Creating a client loads
+its service model, which costs tens of milliseconds per client, and importing
+boto3 costs more than a hundred. The proxies below defer both until the first
+attribute access, so clients that an invocation does not use are never created
+and module import stays cheap during the Lambda init phase.
+
+A proxy forwards every attribute to the real client, so it is used the same way
+and can be replaced by a fake in tests.
+"""
+
+import functools
+
+
+class LazyProxy:
+    """Creates an object on first attribute access and forwards attributes to it."""
+    def __init__(self, factory):
+        """
+        :param factory: A function without arguments that creates the object.
+        """
+        self._factory = factory
+        self._target = None
+
+    def _get_target(self):
+        if self._target is None:
+            self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        # Only called for attributes the proxy itself does not have.
+        return getattr(self._get_target(), name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(service_name, region_name=None):
+    """
+    Gets a Boto3 client, created once per container.
+
+    :param service_name: The service name, such as rekognition.
+    :param region_name: The region, or None for the default region.
+    :return: The Boto3 client.
+    """
+    import boto3
+    return boto3.client(service_name, region_name=region_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_resource(service_name, region_name=None):
+    """
+    Gets a Boto3 resource, created once per container.
+
+    :param service_name: The service name, such as dynamodb.
+    :param region_name: The region, or None for the default region.
+    :return: The Boto3 resource.
+    """
+    import boto3
+    return boto3.resource(service_name, region_name=region_name)
+
+
+def lazy_client(service_name, region_name=None):
+    return LazyProxy(functools.partial(get_client, service_name, region_name))
+
+
+def lazy_resource(service_name, region_name=None):
+    return LazyProxy(functools.partial(get_resource, service_name, region_name))
@@ -0,0 +1,146 @@
+"""
+Purpose
+
+Lightweight per-stage metrics for the Lambda handlers, written as CloudWatch
+Embedded Metric Format (EMF) log lines. CloudWatch extracts the metrics from the
+function logs, so emitting them needs no extra API calls. Values are kept in
+memory during an invocation and written in one line by flush().
+
+Tests and local runs can replace the sink with a ListSink to inspect the values.
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+DEFAULT_NAMESPACE = 'RekognitionExperiment'
+# EMF accepts at most 100 metrics per line and 100 values per metric
+MAX_METRICS_PER_LINE = 100
+MAX_VALUES_PER_METRIC = 100
+
+
+class StdoutSink:
+    """Writes EMF lines to stdout, which Lambda sends to CloudWatch Logs."""
+    def write(self, line):
+        sys.stdout.write(line + '\n')
+
+
+class ListSink:
+    """Keeps the EMF documents in memory, for tests and local runs."""
+    def __init__(self):
+        self.documents = []
+
+    def write(self, line):
+        self.documents.append(json.loads(line))
+
+    def values(self, name):
+        """
+        Gets every value written for a metric.
+
+        :param name: The metric name.
+        :return: The list of values.
+        """
+        values = []
+        for document in self.documents:
+            value = document.get(name)
+            if isinstance(value, list):
+                values.extend(value)
+            elif value is not None:
+                values.append(value)
+        return values
+
+
+class MetricsLogger:
+    """Collects metrics during an invocation and writes them as EMF."""
+    def __init__(self, dimensions, namespace=None, sink=None):
+        """
+        Initializes the logger.
+
+        :param dimensions: A dict of the dimensions of every metric, such as the
+                           function name.
+        :param namespace: The CloudWatch namespace. Defaults to the
+                          METRICS_NAMESPACE environment variable.
+        :param sink: The sink of the EMF lines. Defaults to stdout.
+        """
+        self.dimensions = dimensions
+        self.namespace = namespace or os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+        self.sink = sink or StdoutSink()
+        self._values = {}
+        self._units = {}
+        self._properties = {}
+
+    def put_metric(self, name, value, unit='Count'):
+        """
+        Records one value of a metric.
+
+        :param name: The metric name.
+        :param value: The value.
+        :param unit: The CloudWatch unit, such as Count, Milliseconds or Bytes.
+        """
+        self._values.setdefault(name, []).append(value)
+        self._units[name] = unit
+
+    def increment(self, name, value=1):
+        """
+        Adds to a counter, which is written as a single summed value.
+
+        :param name: The metric name.
+        :param value: The amount to add.
+        """
+        values = self._values.setdefault(name, [0])
+        values[0] += value
+        self._units[name] = 'Count'
+
+    def set_property(self, name, value):
+        """
+        Adds a property that is logged with the metrics but is not a metric, such
+        as a job ID.
+        """
+        self._properties[name] = value
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Times a block and records its latency as the <stage>Latency metric.
+
+        :param stage: The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_metric(stage + 'Latency', (time.perf_counter() - start) * 1000,
+                            'Milliseconds')
+
+    def flush(self):
+        """Writes the collected metrics and clears them."""
+        names = list(self._values)
+        timestamp = int(time.time() * 1000)
+        for start in range(0, len(names), MAX_METRICS_PER_LINE):
+            batch = names[start:start + MAX_METRICS_PER_LINE]
+            offset = 0
+            while True:
+                document = {}
+                definitions = []
+                for name in batch:
+                    values = self._values[name][offset:offset + MAX_VALUES_PER_METRIC]
+                    if values:
+                        document[name] = values[0] if len(values) == 1 else values
+                        definitions.append({'Name': name, 'Unit': self._units[name]})
+                if not definitions:
+                    break
+                document.update(self.dimensions)
+                document.update(self._properties)
+                document['_aws'] = {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': definitions}]}
+                self.sink.write(json.dumps(document))
+                offset += MAX_VALUES_PER_METRIC
+        self._values = {}
+        self._units = {}
+        self._properties = {}
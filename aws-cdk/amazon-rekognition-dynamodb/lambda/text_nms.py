@@ -0,0 +1,173 @@
+"""
+Purpose
+
+Suppresses overlapping text detections of the same video frame. Text detection
+often returns several LINE detections of the same text on one frame, with
+slightly different geometry and confidence. Of every cluster of detections of a
+frame whose bounding boxes overlap by more than an IoU threshold, only the most
+confident one is kept (non-maximum suppression). Lines are only compared with
+lines and words with words, because a word overlaps its own line. Lines are
+suppressed first, and the words of a suppressed line go with it, so no word is
+left pointing at a line that isn't written; the words of the kept line stand for
+them.
+
+The IoU of all the boxes of a frame is computed at once with NumPy. Frames with
+a few boxes, the common case, are faster in plain Python, which is also used when
+NumPy isn't installed. Results arrive ordered by timestamp, so the detections are
+suppressed in a single pass as the pages stream in, holding back only the
+detections of the last frame of a page, which can go on in the next.
+"""
+
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IOU_THRESHOLD = 0.5
+# Boxes of one type on a frame from which the NumPy IoU matrix is faster
+NUMPY_MIN_BOXES = 8
+
+
+def text_box(text):
+    """
+    Gets the bounding box of a text detection.
+
+    :param text: A RekognitionText object.
+    :return: The (left, top, right, bottom) box, or None without geometry.
+    """
+    box = (text.geometry or {}).get('BoundingBox')
+    if not box:
+        return None
+    left, top = box.get('Left', 0.0), box.get('Top', 0.0)
+    return left, top, left + box.get('Width', 0.0), top + box.get('Height', 0.0)
+
+
+def _iou(box_a, box_b):
+    width = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    height = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = ((box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+             + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - intersection)
+    return intersection / union if union > 0 else 0.0
+
+
+def _keep_python(boxes, confidences, iou_threshold):
+    order = sorted(range(len(boxes)), key=lambda index: -confidences[index])
+    kept = []
+    for index in order:
+        if all(_iou(boxes[index], boxes[other]) <= iou_threshold for other in kept):
+            kept.append(index)
+    return kept
+
+
+def _keep_numpy(boxes, confidences, iou_threshold):
+    boxes = np.asarray(boxes, dtype=np.float64)
+    left = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    top = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    right = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    bottom = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas[:, None] + areas[None, :] - intersection
+    overlaps = np.divide(intersection, union, out=np.zeros_like(intersection),
+                         where=union > 0) > iou_threshold
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    kept = []
+    for index in np.argsort(-np.asarray(confidences, dtype=np.float64), kind='stable').tolist():
+        if suppressed[index]:
+            continue
+        kept.append(index)
+        suppressed |= overlaps[index]
+    return kept
+
+
+def suppress_frame(texts, iou_threshold=DEFAULT_IOU_THRESHOLD):
+    """
+    Suppresses the overlapping detections of one frame.
+
+    :param texts: The RekognitionText objects of the frame.
+    :param iou_threshold: The IoU above which two detections of the same type are
+                          the same text.
+    :return: The kept detections, in their original order. Detections without a
+             bounding box are kept, unless their parent line was suppressed.
+    """
+    groups = {}
+    kept = set()
+    for index, text in enumerate(texts):
+        box = text_box(text)
+        if box is None:
+            kept.add(index)
+        else:
+            groups.setdefault(text.kind, []).append((index, box))
+    # Ids of the suppressed lines, whose words are dropped with them
+    suppressed_lines = set()
+    for kind in sorted(groups, key=lambda kind: kind != 'LINE'):
+        members = groups[kind]
+        if suppressed_lines:
+            members = [member for member in members
+                       if texts[member[0]].parent_id not in suppressed_lines]
+        if len(members) <= 1:
+            kept.update(index for index, _ in members)
+            continue
+        keep = (_keep_numpy if np is not None and len(members) >= NUMPY_MIN_BOXES
+                else _keep_python)
+        indexes = [index for index, _ in members]
+        kept_indexes = {indexes[position] for position in keep(
+            [box for _, box in members],
+            [texts[index].confidence or 0.0 for index in indexes], iou_threshold)}
+        kept.update(kept_indexes)
+        if kind == 'LINE':
+            suppressed_lines = {texts[index].id for index in indexes
+                                if index not in kept_indexes and texts[index].id is not None}
+    return [text for index, text in enumerate(texts)
+            if index in kept and text.parent_id not in suppressed_lines]
+
+
+class TextSuppressor:
+    """Suppresses overlapping text detections page by page, in one pass."""
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD):
+        """
+        :param iou_threshold: The IoU above which two detections of the same type
+                              on the same frame are the same text.
+        """
+        self.iou_threshold = iou_threshold
+        self.suppressed = 0
+        self._frame = []
+
+    def _flush_frame(self):
+        kept = suppress_frame(self._frame, self.iou_threshold)
+        self.suppressed += len(self._frame) - len(kept)
+        self._frame = []
+        return kept
+
+    def process(self, texts):
+        """
+        Suppresses the detections of a page of results.
+
+        :param texts: The RekognitionText objects of the page, ordered by timestamp.
+        :return: The kept detections of the frames completed so far. The
+                 detections of the last frame are held until the next page or
+                 finish().
+        """
+        kept = []
+        for text in texts:
+            if self._frame and text.timestamp != self._frame[0].timestamp:
+                kept.extend(self._flush_frame())
+            self._frame.append(text)
+        return kept
+
+    def finish(self):
+        """
+        Suppresses the detections of the last frame.
+
+        :return: The kept detections of the last frame.
+        """
+        kept = self._flush_frame() if self._frame else []
+        logger.info("Suppressed %s overlapping text detections.", self.suppressed)
+        return kept
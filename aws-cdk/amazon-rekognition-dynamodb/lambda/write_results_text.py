@@ -4,13 +4,13 @@ June 29th 2021
 """
 
 import json
-import boto3
 from botocore.exceptions import ClientError
 import os
 import logging
-import sys
 from decimal import Decimal
-from rekognition_objects import (RekognitionText)
+from job_writers import DEFAULT_CHUNK_MAX_BYTES, JOB_WRITERS, TEXT_DETECTION, write_job_results
+from lazy_clients import lazy_client, lazy_resource
+from metrics import MetricsLogger
 
 
 logger = logging.getLogger(__name__)
@@ -19,10 +19,40 @@ logger.setLevel(logging.DEBUG)
 # Environ Variables
 TABLE_NAME = os.environ['TABLE_NAME']
 SQS_RESPONSE_QUEUE = os.environ['SQS_RESPONSE_QUEUE']
-# DynamoDB Resource
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-1')
-sqs_resource = boto3.resource('sqs')
-rekognition_client = boto3.client('rekognition', region_name='us-east-1')
+# Where the results are written: dynamodb, or sqlite for a local database
+RESULTS_BACKEND = os.environ.get('RESULTS_BACKEND', 'dynamodb')
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', '/tmp/results.db')
+# Fetch the next results page while the current one is converted and written
+PREFETCH_PAGES = os.environ.get('PREFETCH_PAGES', 'true').lower() == 'true'
+# Estimated item size at which the texts written so far are flushed as one item,
+# below the 400 KB item limit of DynamoDB
+CHUNK_MAX_BYTES = int(os.environ.get('CHUNK_MAX_BYTES', DEFAULT_CHUNK_MAX_BYTES))
+# IoU above which overlapping text detections of a frame are suppressed to the most
+# confident one, '0' writes every detection, see text_nms.py
+TEXT_NMS_IOU = float(os.environ.get('TEXT_NMS_IOU', '0'))
+# DynamoDB Resource and Rekognition client, created on first use
+dynamodb_resource = lazy_resource('dynamodb', region_name='us-east-1')
+rekognition_client = lazy_client('rekognition', region_name='us-east-1')
+
+# Per-stage metrics, written as CloudWatch Embedded Metric Format at the end of each invocation
+metrics = MetricsLogger({'Function': 'write_results_text'})
+
+
+# SQLite results store, opened on first use when RESULTS_BACKEND is sqlite
+results_store = None
+
+
+def get_results_store():
+    """
+    Opens the SQLite results store on first use.
+
+    :return: The SQLiteResultsStore.
+    """
+    global results_store
+    if results_store is None:
+        from results_store import SQLiteResultsStore
+        results_store = SQLiteResultsStore(RESULTS_DB_PATH)
+    return results_store
 
 
 
@@ -33,13 +63,19 @@ def put_item_dynamodb(item):
     :param item: Dictionary of id, FaceDetails and ResponseMetdata
     :return: DynamoDB PutItem response dict
     """
+    if RESULTS_BACKEND == 'sqlite':
+        return get_results_store().put_item(item)
+
     dynamodb_table = dynamodb_resource.Table(TABLE_NAME)
 
     try:
-        put_item_response = dynamodb_table.put_item(Item=item)
+        with metrics.timer('DynamoDBPutItem'):
+            put_item_response = dynamodb_table.put_item(Item=item)
+        metrics.increment('ItemsWritten')
         return put_item_response
 
     except ClientError as error:
+        metrics.increment('DynamoDBPutItemErrors')
         return error.response
 
 def poll_notification(message_body):
@@ -55,12 +91,15 @@ def poll_notification(message_body):
     job_id = message['JobId']
     status = message['Status']
     job_tag = message['JobTag']
-    logger.info("job_tag: {}, job_id: {}, and status is {}".format(
+    # The API that started the job, such as StartLabelDetection
+    api = message.get('API', 'StartTextDetection')
+    logger.info("job_tag: {}, job_id: {}, api: {}, and status is {}".format(
         job_tag,
         job_id,
+        api,
         status
     ))
-    return job_tag, job_id, status
+    return job_tag, job_id, status, api
 
 def _get_rekognition_job_results(job_id, get_results_func, result_extractor, next_token=None):
         """
@@ -76,10 +115,12 @@ def _get_rekognition_job_results(job_id, get_results_func, result_extractor, nex
         :return: The list of result objects.
         """
         try:
-            if next_token == None:
-                response = get_results_func(JobId=job_id)
-            else:
-                response = get_results_func(JobId=job_id, NextToken=next_token)
+            with metrics.timer('GetResultsPage'):
+                if next_token == None:
+                    response = get_results_func(JobId=job_id)
+                else:
+                    response = get_results_func(JobId=job_id, NextToken=next_token)
+            metrics.increment('Pages')
             received_next_token = response.get('NextToken', None)
             logger.info("Job {} has status: {} and next token {}".format(
                 job_id, 
@@ -87,6 +128,7 @@ def _get_rekognition_job_results(job_id, get_results_func, result_extractor, nex
                 received_next_token
                 ))
             results = result_extractor(response)
+            metrics.increment('Detections', len(results))
             logger.info("Found %s items in %s.", len(results), "test")
         except ClientError:
             logger.exception("Couldn't get items for %s.", job_id)
@@ -109,49 +151,47 @@ def parse_message_texts(message):
 
 def lambda_handler(event, context):
     """
-    This function is call on a SQS Queue event, takes the message of the queue, parses the message and inserts a item
-    into dynamoDB
+    This function is call on a SQS Queue event, takes the message of the queue, parses the message and inserts the
+    results of the job into dynamoDB. The API field of the message selects the job type in JOB_WRITERS.
     :param event: SQS Message dict
     :param context: Context dict
     :return: DynamoDB Response PutItem dict
     """
+    try:
+        return _write_job_results(event)
+    finally:
+        metrics.flush()
+
+
+def _write_job_results(event):
     message_body = json.loads(event['Records'][0]['body'])
     logger.info("message_body: {}".format(message_body))
-    job_tag, job_id, status = poll_notification(message_body)
-
-    text_message = {}
-    text_line_counter = 0
-    token_number = 0
-    next_token = None
-    if status == 'SUCCEEDED':
-        while (next_token != None)  or (token_number == 0):
-            token_number=token_number+1
-            logger.info("{} job_id: {}, status: {}, next_token: {}".format(token_number, job_id,status,next_token))
-            texts, next_token = _get_rekognition_job_results(job_id,
-                rekognition_client.get_text_detection, 
-                lambda response: [
-                    RekognitionText(text['TextDetection'], text['Timestamp']) 
-                    for text in response['TextDetections']]
-                ,next_token)        
-            logger.info(f"Detected {len(texts)} texts, here are the first twenty:")
-            for text in texts:
-                #print(text.to_dict_compact())
-                text_line_counter=text_line_counter+1
-                line_message = text.to_dict_compact()
-                #text_message[text_line_counter] = line_message
-                text_message[line_message['text']] = line_message
-            
-        text_message.update({'id': job_tag })
-        item_size = sys.getsizeof(text_message)
-        #logger.info("text_message size in Bytes is {}".format(item_size))
-        if item_size > 400000:
-            logger.error("Item is bigger than DynamoDB can support {} / {}".format(item_size,400000))
-        else:
-            logger.info("Item size in Bytes to be inserted in DynamoDB {}".format(item_size))
-            item = parse_message_texts(text_message)
-            put_item_dynamodb(item)
+    job_tag, job_id, status, api = poll_notification(message_body)
+    metrics.set_property('JobId', job_id)
+
+    job_writer = JOB_WRITERS.get(api)
+    if job_writer is None:
+        logger.error("Can't write the results of %s jobs, job_id is: %s", api, job_id)
+    elif status == 'SUCCEEDED':
+        metrics.set_property('JobType', job_writer.job_type)
+        get_results_func = getattr(rekognition_client, job_writer.get_results)
+        result_filter = None
+        if TEXT_NMS_IOU and job_writer.job_type == TEXT_DETECTION:
+            from text_nms import TextSuppressor
+            result_filter = TextSuppressor(TEXT_NMS_IOU)
+        writer = write_job_results(
+            job_writer, job_tag,
+            lambda next_token: _get_rekognition_job_results(
+                job_id, get_results_func,
+                lambda response: response[job_writer.response_key], next_token),
+            put_item_dynamodb, PREFETCH_PAGES, CHUNK_MAX_BYTES, metrics.timer, result_filter)
+        metrics.put_metric('Chunks', writer.chunks_written)
+        for size in writer.item_sizes:
+            metrics.put_metric('ItemBytes', size, unit='Bytes')
+        metrics.put_metric('BytesProcessed', writer.bytes_written, unit='Bytes')
+        if result_filter is not None:
+            metrics.put_metric('TextSuppressed', result_filter.suppressed)
     else:
         logger.info("Failure: job_id is: {}, and status is {}".format(job_id,status))
 
     return None
-
@@ -0,0 +1,246 @@
+"""
+Rewrites the items of an image labels table to the one-item-per-label schema of
+lambda/label_schema.py.
+
+The table is read with a parallel Scan, one worker per segment, and every item
+of the earlier schema is converted and written back with a batch writer. The
+earlier items only kept the last category and alias written for a label. With
+--redetect-bucket, the labels of every image are detected again (the images are
+read from the bucket under their Image name), so the items get their full
+category, alias, parent and instance sets, and the items of labels that are no
+longer detected are deleted from the target table, once the new items are
+written. Migrated items also get the Label_Shard key of the
+Label_Confidence_Index.
+
+The target defaults to the source table, which is then upgraded in place; items
+already in the current schema are skipped.
+
+    python migrate_label_items.py SOURCE_TABLE [--target-table TABLE] [--segments 16]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda'))
+from label_schema import (
+    KEY_ATTRIBUTES, LABEL_SHARDS, make_label_item, upgrade_item, write_label_items)
+
+logger = logging.getLogger(__name__)
+
+# Number of Scan segments, each one is read and written by its own worker
+DEFAULT_SEGMENTS = 8
+MAX_LABELS = 20
+MIN_CONFIDENCE = 50
+
+
+class MigrationStats:
+    """Thread-safe counters of the migration."""
+    def __init__(self):
+        self.scanned = 0
+        self.written = 0
+        self.skipped = 0
+        self.redetected = 0
+        self.deleted = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def to_dict(self):
+        return {
+            'scanned': self.scanned,
+            'written': self.written,
+            'skipped': self.skipped,
+            'redetected_images': self.redetected,
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'seconds': round(time.perf_counter() - self.start_time, 1)}
+
+
+def redetect_labels(rekognition_client, bucket, image, shards=LABEL_SHARDS):
+    """
+    Detects the labels of an image again.
+
+    :param rekognition_client: A Boto3 Rekognition client.
+    :param bucket: The bucket of the images.
+    :param image: The image name, its object key.
+    :param shards: The number of index shards per label.
+    :return: The label items of the image.
+    """
+    response = rekognition_client.detect_labels(
+        Image={'S3Object': {'Bucket': bucket, 'Name': image}},
+        MaxLabels=MAX_LABELS, MinConfidence=MIN_CONFIDENCE)
+    return [make_label_item(image, label, shards) for label in response['Labels']]
+
+
+def stale_label_keys(table, image, label_names):
+    """
+    Gets the keys of the label items of an image whose label isn't one of
+    label_names, such as the labels that weren't detected again.
+
+    :param table: A Boto3 DynamoDB Table.
+    :param image: The image name.
+    :param label_names: The names of the labels to keep.
+    :return: The list of keys.
+    """
+    kwargs = {'KeyConditionExpression': Key('Image').eq(image),
+              'ProjectionExpression': ', '.join(KEY_ATTRIBUTES)}
+    keys = []
+    while True:
+        response = table.query(**kwargs)
+        keys.extend({'Image': image, 'Label_Name': item['Label_Name']}
+                    for item in response['Items'] if item['Label_Name'] not in label_names)
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def delete_items(table, keys):
+    """
+    Deletes items with a batch writer.
+
+    :param table: A Boto3 DynamoDB Table.
+    :param keys: An iterable of item keys.
+    :return: The number of items deleted.
+    """
+    count = 0
+    with table.batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+            count += 1
+    return count
+
+
+def migrate_segment(segment, total_segments, source_name, target_name, stats,
+                    redetect_bucket=None, dry_run=False, shards=LABEL_SHARDS):
+    """
+    Migrates the items of one Scan segment.
+
+    :param segment: The segment number.
+    :param total_segments: The number of segments.
+    :param source_name: The name of the table that is read.
+    :param target_name: The name of the table that is written.
+    :param stats: The MigrationStats.
+    :param redetect_bucket: The bucket of the images to detect again, or None.
+    :param dry_run: Converts the items without writing them.
+    :param shards: The number of index shards per label.
+    """
+    # Boto3 resources are not thread safe, so every worker has its own session.
+    session = boto3.session.Session()
+    dynamodb = session.resource('dynamodb')
+    source = dynamodb.Table(source_name)
+    target = dynamodb.Table(target_name)
+    rekognition_client = session.client('rekognition') if redetect_bucket else None
+    in_place = source_name == target_name
+    # Images detected again, whose other items are skipped, and images whose
+    # detection failed, whose items are all upgraded instead
+    redetected = set()
+    redetect_failed = set()
+
+    kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+    while True:
+        response = source.scan(**kwargs)
+        items = response['Items']
+        upgraded = []
+        # Label names of every image detected again on this page
+        redetected_labels = {}
+        for item in items:
+            image = item['Image']
+            if redetect_bucket and image not in redetect_failed:
+                if image in redetected:
+                    continue
+                try:
+                    label_items = redetect_labels(
+                        rekognition_client, redetect_bucket, image, shards)
+                    redetected.add(image)
+                    upgraded.extend(label_items)
+                    redetected_labels[image] = {label['Label_Name'] for label in label_items}
+                    stats.add(redetected=1)
+                    continue
+                except ClientError as error:
+                    redetect_failed.add(image)
+                    logger.warning("Couldn't detect the labels of %s again: %s",
+                                   image, error.response['Error']['Code'])
+            new_item = upgrade_item(item, shards)
+            if in_place and new_item is item:
+                stats.add(skipped=1)
+            else:
+                upgraded.append(new_item)
+        if upgraded and not dry_run:
+            try:
+                stats.add(written=write_label_items(target, upgraded))
+            except ClientError:
+                logger.exception("Couldn't write %s items of segment %s.", len(upgraded), segment)
+                stats.add(failed=len(upgraded))
+                redetected_labels = {}
+        if redetected_labels and not dry_run:
+            # Deleted only once the new items are written, so an image never
+            # loses its labels.
+            try:
+                stats.add(deleted=delete_items(target, [
+                    key for image, label_names in redetected_labels.items()
+                    for key in stale_label_keys(target, image, label_names)]))
+            except ClientError:
+                logger.exception("Couldn't delete the stale labels of segment %s.", segment)
+        stats.add(scanned=len(items))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    logger.info("Segment %s done.", segment)
+
+
+def migrate(source_name, target_name=None, segments=DEFAULT_SEGMENTS, redetect_bucket=None,
+            dry_run=False, shards=LABEL_SHARDS):
+    """
+    Migrates a labels table with a parallel Scan.
+
+    :param source_name: The name of the table to read.
+    :param target_name: The name of the table to write, the source by default.
+    :param segments: The number of Scan segments and workers.
+    :param redetect_bucket: The bucket of the images to detect again, or None.
+    :param dry_run: Converts the items without writing them.
+    :param shards: The number of index shards per label.
+    :return: The MigrationStats.
+    """
+    stats = MigrationStats()
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(
+            migrate_segment, segment, segments, source_name, target_name or source_name,
+            stats, redetect_bucket, dry_run, shards) for segment in range(segments)]
+        for future in futures:
+            future.result()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source_table')
+    parser.add_argument('--target-table', help='defaults to the source table')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS)
+    parser.add_argument('--redetect-bucket', help='bucket of the images to detect again')
+    parser.add_argument('--shards', type=int, default=LABEL_SHARDS,
+                        help='index partition keys per label, as LABEL_SHARDS of the stack')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    stats = migrate(args.source_table, args.target_table, args.segments,
+                    args.redetect_bucket, args.dry_run, args.shards)
+    print(stats.to_dict())
+
+
+if __name__ == '__main__':
+    main()
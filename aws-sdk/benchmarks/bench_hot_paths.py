@@ -0,0 +1,241 @@
+"""
+Purpose
+
+Microbenchmarks of the per-detection hot paths: building RekognitionText,
+RekognitionLabel and RekognitionFace objects from response pages, rendering them
+with to_dict and to_dict_compact, convertMilliseconds, parse_message_texts, and
+the aggregation loop of write_results_text.lambda_handler.
+
+Inputs are the aws-sdk/json fixtures, scaled to synthetic sets of 10k to 1M
+detections. Results are compared with, or saved to, a JSON baseline that is
+committed next to this file so regressions show up in review.
+
+Run from the aws-sdk folder:
+
+    python benchmarks/bench_hot_paths.py                  # compare with baseline
+    python benchmarks/bench_hot_paths.py --save           # update the baseline
+    python benchmarks/bench_hot_paths.py --scales 1000000 # larger inputs
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SDK_DIR = os.path.dirname(BENCHMARK_DIR)
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(SDK_DIR), 'aws-cdk', 'amazon-rekognition-dynamodb', 'lambda')
+# The Lambda folder goes first, so the deployed copy of rekognition_objects is measured.
+sys.path[:0] = [LAMBDA_DIR, SDK_DIR]
+
+# The Lambda modules read their configuration from the environment at import.
+for name, value in {'TABLE_NAME': 'benchmark', 'SQS_RESPONSE_QUEUE': 'benchmark',
+                    'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+    os.environ.setdefault(name, value)
+
+import fake_aws
+import metrics
+from rekognition_objects import RekognitionFace, RekognitionLabel, RekognitionText
+import write_results_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baselines.json')
+DEFAULT_FIXTURE = os.path.join(SDK_DIR, 'json', 'rov_video_trim.json')
+DEFAULT_SCALES = [10000, 100000]
+# A benchmark that is this much slower than its baseline counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+LABEL_TEMPLATE = {
+    'Name': 'Person', 'Confidence': 98.5,
+    'Instances': [{'BoundingBox': {'Width': 0.1, 'Height': 0.3, 'Left': 0.4, 'Top': 0.2},
+                   'Confidence': 97.1}],
+    'Parents': [{'Name': 'Human'}]}
+FACE_TEMPLATE = {
+    'BoundingBox': {'Width': 0.1, 'Height': 0.15, 'Left': 0.4, 'Top': 0.2},
+    'AgeRange': {'Low': 25, 'High': 35}, 'Smile': {'Value': True, 'Confidence': 90.0},
+    'Eyeglasses': {'Value': False, 'Confidence': 95.0},
+    'Gender': {'Value': 'Female', 'Confidence': 99.0},
+    'Emotions': [{'Type': 'CALM', 'Confidence': 80.0}, {'Type': 'HAPPY', 'Confidence': 15.0}],
+    'Confidence': 99.9}
+
+
+def scale_text_entries(base_entries, count):
+    """
+    Repeats fixture entries up to a number of detections, varying the text and the
+    timestamps so the aggregation dict keeps growing.
+
+    :param base_entries: The TextDetections entries of the fixture.
+    :param count: The number of entries to build.
+    :return: The list of entries.
+    """
+    entries = []
+    span = base_entries[-1]['Timestamp'] + 1000
+    for index in range(count):
+        base = base_entries[index % len(base_entries)]
+        text = dict(base['TextDetection'],
+                    DetectedText='{}-{}'.format(base['TextDetection']['DetectedText'], index % 5000))
+        entries.append({'Timestamp': base['Timestamp'] + span * (index // len(base_entries)),
+                        'TextDetection': text})
+    return entries
+
+
+def make_label_entries(count):
+    return [{'Timestamp': index * 40, 'Label': LABEL_TEMPLATE} for index in range(count)]
+
+
+def make_face_entries(count):
+    return [{'Timestamp': index * 40, 'Face': FACE_TEMPLATE} for index in range(count)]
+
+
+def make_benchmarks(text_entries, count):
+    """
+    Builds the benchmark functions of one input scale.
+
+    :param text_entries: The scaled TextDetections entries.
+    :param count: The number of detections.
+    :return: A dict of benchmark name to a function without arguments.
+    """
+    label_entries = make_label_entries(count)
+    face_entries = make_face_entries(count)
+    texts = [RekognitionText(entry['TextDetection'], entry['Timestamp'])
+             for entry in text_entries]
+    aggregated = {}
+    for text in texts:
+        line_message = text.to_dict_compact()
+        aggregated[line_message['text']] = line_message
+    timestamps = [entry['Timestamp'] for entry in text_entries]
+    converter = texts[0]
+
+    broker = fake_aws.FakeBroker()
+    rekognition = fake_aws.FakeRekognitionClient(
+        broker, {'text_detection': fake_aws.Recording(text_entries)})
+    job_id = rekognition.start_text_detection(
+        Video={'S3Object': {'Bucket': 'benchmark', 'Name': 'benchmark.mp4'}})['JobId']
+    handler_event = fake_aws.sqs_event(json.dumps({'Message': json.dumps({
+        'JobId': job_id, 'Status': 'SUCCEEDED', 'JobTag': 'benchmark',
+        'API': 'StartTextDetection'})}))
+
+    def run_handler():
+        write_results_text.rekognition_client = rekognition
+        write_results_text.dynamodb_resource = fake_aws.FakeDynamoDBResource()
+        # Keep the EMF lines off stdout, they would mix with the results.
+        write_results_text.metrics.sink = metrics.ListSink()
+        write_results_text.lambda_handler(handler_event, None)
+
+    return {
+        'construct_text': lambda: [
+            RekognitionText(entry['TextDetection'], entry['Timestamp'])
+            for entry in text_entries],
+        'construct_label': lambda: [
+            RekognitionLabel(entry['Label'], entry['Timestamp']) for entry in label_entries],
+        'construct_face': lambda: [
+            RekognitionFace(entry['Face'], entry['Timestamp']) for entry in face_entries],
+        'text_to_dict': lambda: [text.to_dict() for text in texts],
+        'text_to_dict_compact': lambda: [text.to_dict_compact() for text in texts],
+        'convert_milliseconds': lambda: [
+            converter.convertMilliseconds(timestamp) for timestamp in timestamps],
+        'parse_message_texts': lambda: write_results_text.parse_message_texts(aggregated),
+        'write_results_lambda_handler': run_handler,
+    }
+
+
+def measure(func, repeat):
+    """
+    Times a function.
+
+    :param func: The function to time.
+    :param repeat: The number of timed runs.
+    :return: The median and minimum run time in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings)
+
+
+def run(scales, fixture, repeat, selected=None):
+    """
+    Runs every benchmark at every scale.
+
+    :param scales: The numbers of detections to benchmark.
+    :param fixture: The aws-sdk/json file the inputs are built from.
+    :param repeat: The number of timed runs per benchmark.
+    :param selected: The names of the benchmarks to run, or None for all.
+    :return: A dict of result name to timings.
+    """
+    base_entries = fake_aws.load_text_recording(fixture).entries
+    results = {}
+    for count in scales:
+        text_entries = scale_text_entries(base_entries, count)
+        for name, func in make_benchmarks(text_entries, count).items():
+            if selected and name not in selected:
+                continue
+            median, best = measure(func, repeat if count < 1000000 else 1)
+            key = '{}[{}]'.format(name, count)
+            results[key] = {
+                'median_s': round(median, 6),
+                'min_s': round(best, 6),
+                'per_item_ns': round(median / count * 1e9, 1)}
+            print('{:<45} {:>10.4f} s {:>10.1f} ns/item'.format(
+                key, median, results[key]['per_item_ns']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline.
+
+    :param results: The results of this run.
+    :param baseline: The results of the baseline.
+    :param tolerance: The relative slowdown that counts as a regression.
+    :return: The list of regressed result names.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['median_s'] / baseline[key]['median_s']
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            print('REGRESSION {:<40} {:.2f}x slower than baseline'.format(key, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    args = parser.parse_args()
+
+    # The handlers log every page at INFO, which would dominate the timings.
+    logging.disable(logging.INFO)
+    results = run(args.scales, args.fixture, args.repeat, args.only)
+
+    if args.save:
+        with open(args.baseline, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, fp, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
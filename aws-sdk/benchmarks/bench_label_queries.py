@@ -0,0 +1,131 @@
+"""
+Purpose
+
+Exercises LabelQuery.images_with_label of image/label_queries.py against the
+local DynamoDB stand-in of fake_aws.py, without DynamoDB Local: the fan-out of
+one Query per index shard, the merge of the shards in descending confidence, and
+the limit. The results are checked against a sort of all the loaded items, and
+the queries are timed with a simulated latency per request, with every shard
+read at once and with one shard at a time.
+
+Run from the aws-sdk folder:
+
+    python benchmarks/bench_label_queries.py
+    python benchmarks/bench_label_queries.py --images 200000 --latency 0.01
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SDK_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [os.path.join(SDK_DIR, 'image'), SDK_DIR]
+
+import fake_aws
+from label_queries import LabelQuery, create_local_table, load_sample
+from label_schema import LABEL_SHARDS
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'benchmark_labels'
+LABEL_NAME = 'Person'
+DEFAULT_IMAGES = 50000
+# Seconds every Query request takes, about a round trip within a region
+DEFAULT_LATENCY = 0.005
+DEFAULT_PAGE_SIZE = 1000
+# (min_confidence, limit) of the checked queries
+QUERIES = [(0, None), (90, None), (0, 10), (75, 100), (99.9, 5), (101, None)]
+
+
+def expected_images(items, min_confidence, limit):
+    """
+    Gets the result of a query by sorting all the items of the label.
+
+    :return: A list of (image, confidence) tuples, most confident first.
+    """
+    matching = sorted((item for item in items if item['Label_Confidence'] >= min_confidence),
+                      key=lambda item: -item['Label_Confidence'])
+    if limit is not None:
+        matching = matching[:limit]
+    return [(item['Image'], float(item['Label_Confidence'])) for item in matching]
+
+
+def check_query(query, client, items, min_confidence, limit, page_size):
+    """
+    Runs a query and checks its order, its limit and its confidences.
+
+    :return: The number of Query requests and the elapsed seconds.
+    """
+    before = client.calls.get('Query', 0)
+    start = time.perf_counter()
+    images = query.images_with_label(LABEL_NAME, min_confidence, limit, page_size)
+    elapsed = time.perf_counter() - start
+    requests = client.calls.get('Query', 0) - before
+
+    confidences = [confidence for _, confidence in images]
+    assert confidences == sorted(confidences, reverse=True), "Shards merged out of order."
+    expected = expected_images(items, min_confidence, limit)
+    if limit is not None:
+        assert len(images) == len(expected), "Got {} images instead of {}.".format(
+            len(images), len(expected))
+    # Images of equal confidence can come in any order.
+    assert confidences == [confidence for _, confidence in expected], "Wrong confidences."
+    assert {image for image, _ in images} <= {item['Image'] for item in items}
+    if limit is None:
+        assert sorted(images) == sorted(expected), "Wrong images."
+    assert requests >= query.shards, "Only {} of {} shards were read.".format(
+        requests, query.shards)
+    return requests, elapsed
+
+
+def run(images, latency, page_size, shards):
+    """
+    Loads the sample items and checks and times every query of QUERIES.
+
+    :return: True when every check passed.
+    """
+    resource = fake_aws.FakeDynamoDBResource()
+    client = fake_aws.FakeDynamoDBClient(resource)
+    create_local_table(client, TABLE_NAME)
+    load_sample(resource, TABLE_NAME, images, LABEL_NAME, shards)
+    items = resource.Table(TABLE_NAME).items
+    print("Loaded {} items of {} in {} shards.".format(len(items), LABEL_NAME, shards))
+
+    client.latency = latency
+    passed = True
+    for max_workers in (shards, 1):
+        query = LabelQuery(client, TABLE_NAME, shards, max_workers=max_workers)
+        for min_confidence, limit in QUERIES:
+            name = 'workers={} min_confidence={} limit={}'.format(
+                max_workers, min_confidence, limit)
+            try:
+                requests, elapsed = check_query(
+                    query, client, items, min_confidence, limit, page_size)
+            except AssertionError as error:
+                passed = False
+                print('FAILED {:<50} {}'.format(name, error))
+                continue
+            print('{:<57} {:>5} requests {:>8.3f} s'.format(name, requests, elapsed))
+        query.close()
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='seconds every Query request takes')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--shards', type=int, default=LABEL_SHARDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    if not run(args.images, args.latency, args.page_size, args.shards):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+"""
+Purpose
+
+Exports the results tables of the DynamoDB stack, detect_text_results and
+detect_label_results, to compressed shards, to back them up or to rebuild search
+indexes from them.
+
+A table is read with a parallel Scan: it is split into segments and every worker
+thread reads its own segments with the thread-safe low-level client. Items are
+converted from the DynamoDB wire format to native values in a single pass, so
+numbers become int or float without going through Decimal. Every segment writes
+its own shards, either gzip-compressed NDJSON with one item per line, or Parquet
+with one row per detection in the columns of parquet_export.py.
+
+A shard is written under a temporary name and renamed once complete, then the
+LastEvaluatedKey of the segment is saved in its checkpoint file. A run started
+again with --resume skips the finished segments and continues the others after
+their last complete shard, so no item is exported twice.
+
+    python export_tables.py --text-table TEXT --label-table LABELS --output backup/
+    python export_tables.py --label-table LABELS --output backup/ --format parquet --resume
+"""
+
+import argparse
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+NDJSON = 'ndjson'
+PARQUET = 'parquet'
+DEFAULT_SEGMENTS = 16
+# Items per shard, a segment starts a new shard beyond this
+DEFAULT_SHARD_ITEMS = 500000
+GZIP_LEVEL = 6
+# Rows of every row group of a Parquet shard, so a shard isn't held in memory whole
+PARQUET_ROW_GROUP_ROWS = 64 * 1024
+CHECKPOINT_DIR = '_checkpoints'
+
+
+def to_native(value):
+    """
+    Converts a DynamoDB attribute value of the low-level client to a native value.
+    Numbers become int, or float when they have a fraction or an exponent, and
+    binary values become base64 strings, so the result can be written as JSON.
+
+    :param value: The attribute value, such as {'N': '97.5'}.
+    :return: The native value.
+    """
+    (kind, data), = value.items()
+    if kind == 'S':
+        return data
+    if kind == 'N':
+        return float(data) if '.' in data or 'e' in data or 'E' in data else int(data)
+    if kind == 'M':
+        return {key: to_native(item) for key, item in data.items()}
+    if kind == 'L':
+        return [to_native(item) for item in data]
+    if kind == 'BOOL':
+        return data
+    if kind == 'NULL':
+        return None
+    if kind == 'SS':
+        return list(data)
+    if kind == 'NS':
+        return [to_native({'N': number}) for number in data]
+    if kind == 'B':
+        return base64.b64encode(data).decode('ascii')
+    if kind == 'BS':
+        return [base64.b64encode(item).decode('ascii') for item in data]
+    raise ValueError("Unknown attribute type {}.".format(kind))
+
+
+def item_to_native(item):
+    """Converts an item of the low-level client to a dict of native values."""
+    return {name: to_native(value) for name, value in item.items()}
+
+
+def _encode_key(key):
+    """Makes a LastEvaluatedKey JSON serializable, binary key values are base64."""
+    return {name: {kind: base64.b64encode(data).decode('ascii') if kind == 'B' else data
+                   for kind, data in value.items()}
+            for name, value in key.items()}
+
+
+def _decode_key(key):
+    return {name: {kind: base64.b64decode(data) if kind == 'B' else data
+                   for kind, data in value.items()}
+            for name, value in key.items()}
+
+
+class SegmentCheckpoint:
+    """Progress of one Scan segment, saved in a JSON file of the output folder."""
+    def __init__(self, path, segment, total_segments):
+        """
+        Initializes the checkpoint and loads its file, if it exists.
+
+        :param path: The path of the checkpoint file.
+        :param segment: The segment number.
+        :param total_segments: The number of segments of the Scan.
+        """
+        self.path = path
+        self.segment = segment
+        self.total_segments = total_segments
+        self.last_key = None
+        self.next_shard = 0
+        self.items = 0
+        self.done = False
+        if os.path.exists(path):
+            with open(path) as fp:
+                state = json.load(fp)
+            if state['total_segments'] != total_segments:
+                raise ValueError(
+                    "{} was written by a Scan of {} segments, not {}.".format(
+                        path, state['total_segments'], total_segments))
+            self.last_key = _decode_key(state['last_key']) if state['last_key'] else None
+            self.next_shard = state['next_shard']
+            self.items = state['items']
+            self.done = state['done']
+
+    def save(self, last_key, items, done):
+        """
+        Records a complete shard. The file is replaced atomically, so a crash
+        leaves either the previous checkpoint or the new one.
+
+        :param last_key: The LastEvaluatedKey after the last item of the shard.
+        :param items: The number of items the segment has exported.
+        :param done: Whether the segment is finished.
+        """
+        self.last_key = last_key
+        self.next_shard += 1
+        self.items = items
+        self.done = done
+        state = {
+            'segment': self.segment,
+            'total_segments': self.total_segments,
+            'last_key': _encode_key(last_key) if last_key else None,
+            'next_shard': self.next_shard,
+            'items': items,
+            'done': done}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, self.path)
+
+
+class NdjsonShardWriter:
+    """Writes items to a gzip-compressed NDJSON shard."""
+    extension = '.ndjson.gz'
+
+    def __init__(self, path, table_kind=None):
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=GZIP_LEVEL)
+        self._dumps = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+    def write_items(self, items):
+        self.file.write(''.join(self._dumps(item) + '\n' for item in items))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetShardWriter:
+    """
+    Writes the detections of items to a Parquet shard, one row per detection with
+    the video column and the COLUMNS of parquet_export.py. Rows are written as a
+    row group every row_group_rows rows.
+    """
+    extension = '.parquet'
+
+    def __init__(self, path, table_kind, row_group_rows=PARQUET_ROW_GROUP_ROWS):
+        from parquet_export import (
+            COLUMNS, _import_pyarrow, label_item_rows, make_schema, text_item_rows)
+
+        self.pa = _import_pyarrow()
+        self.schema = make_schema(self.pa).insert(
+            0, self.pa.field('video', self.pa.dictionary(self.pa.int32(), self.pa.string())))
+        self.item_rows = text_item_rows if table_kind == 'text' else label_item_rows
+        self.row_group_rows = row_group_rows
+        self.columns = tuple([] for _ in range(len(COLUMNS) + 1))
+        self.writer = self.pa.parquet.ParquetWriter(path, self.schema, compression='snappy')
+        self.path = path
+
+    def write_items(self, items):
+        appenders = [column.append for column in self.columns]
+        videos = self.columns[0]
+        for item in items:
+            for video, row in self.item_rows(item):
+                appenders[0](video)
+                for append, value in zip(appenders[1:], row):
+                    append(value)
+            if len(videos) >= self.row_group_rows:
+                self._write_row_group()
+
+    def _write_row_group(self):
+        arrays = [self.pa.array(column, type=field.type)
+                  for column, field in zip(self.columns, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        # Cleared in place, so the appenders of write_items stay valid.
+        for column in self.columns:
+            column.clear()
+
+    def close(self):
+        if self.columns[0]:
+            self._write_row_group()
+        self.writer.close()
+
+
+SHARD_WRITERS = {NDJSON: NdjsonShardWriter, PARQUET: ParquetShardWriter}
+
+
+class ExportStats:
+    """Thread-safe counters of an export."""
+    def __init__(self):
+        self.items = 0
+        self.pages = 0
+        self.shards = 0
+        self.segments_done = 0
+        self.segments_skipped = 0
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def to_dict(self):
+        seconds = time.perf_counter() - self.start_time
+        return {
+            'items': self.items,
+            'pages': self.pages,
+            'shards': self.shards,
+            'segments_done': self.segments_done,
+            'segments_skipped': self.segments_skipped,
+            'seconds': round(seconds, 1),
+            'items_per_second': round(self.items / seconds) if seconds else 0}
+
+
+class TableExporter:
+    """Exports a DynamoDB table with a parallel Scan, one shard series per segment."""
+    def __init__(self, dynamodb_client, table_name, output_dir, table_kind='text',
+                 output_format=NDJSON, segments=DEFAULT_SEGMENTS, max_workers=None,
+                 shard_items=DEFAULT_SHARD_ITEMS, page_size=None):
+        """
+        Initializes the exporter.
+
+        :param dynamodb_client: A Boto3 DynamoDB client, shared by the workers.
+        :param table_name: The name of the table.
+        :param output_dir: The folder of the shards and checkpoints of the table.
+        :param table_kind: text or labels, the results table the items come from.
+                           Only the Parquet format uses it.
+        :param output_format: ndjson or parquet.
+        :param segments: The TotalSegments of the Scan.
+        :param max_workers: The number of segments read at the same time, all of
+                            them by default.
+        :param shard_items: The number of items after which a segment starts a
+                            new shard.
+        :param page_size: The Limit of every Scan request, or None for 1 MB pages.
+        """
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.output_dir = output_dir
+        self.table_kind = table_kind
+        self.shard_writer = SHARD_WRITERS[output_format]
+        self.segments = segments
+        self.max_workers = max_workers or segments
+        self.shard_items = shard_items
+        self.page_size = page_size
+        self.stats = ExportStats()
+
+    def _shard_path(self, segment, shard):
+        return os.path.join(self.output_dir, 'segment-{:05d}-part-{:05d}{}'.format(
+            segment, shard, self.shard_writer.extension))
+
+    def export_segment(self, segment, resume=False):
+        """
+        Exports one Scan segment, continuing after its checkpoint when resuming.
+
+        :param segment: The segment number.
+        :param resume: Continues from the checkpoint instead of starting over.
+        """
+        checkpoint_path = os.path.join(
+            self.output_dir, CHECKPOINT_DIR, 'segment-{:05d}.json'.format(segment))
+        if not resume and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        checkpoint = SegmentCheckpoint(checkpoint_path, segment, self.segments)
+        if checkpoint.done:
+            self.stats.add(segments_skipped=1)
+            return
+        # Shards that were not complete when an earlier run stopped are written again.
+        for path in glob.glob(os.path.join(self.output_dir, 'segment-{:05d}-part-*{}.tmp'.format(
+                segment, self.shard_writer.extension))):
+            os.remove(path)
+
+        kwargs = {'TableName': self.table_name, 'Segment': segment,
+                  'TotalSegments': self.segments}
+        if self.page_size:
+            kwargs['Limit'] = self.page_size
+        if checkpoint.last_key:
+            kwargs['ExclusiveStartKey'] = checkpoint.last_key
+        exported = checkpoint.items
+        writer = None
+        shard_items = 0
+        while True:
+            try:
+                response = self.client.scan(**kwargs)
+            except ClientError:
+                logger.exception("Couldn't scan segment %s of %s.", segment, self.table_name)
+                if writer is not None:
+                    writer.close()
+                raise
+            items = response['Items']
+            last_key = response.get('LastEvaluatedKey')
+            if items:
+                if writer is None:
+                    writer = self.shard_writer(
+                        self._shard_path(segment, checkpoint.next_shard) + '.tmp',
+                        self.table_kind)
+                writer.write_items(item_to_native(item) for item in items)
+                shard_items += len(items)
+                exported += len(items)
+            self.stats.add(items=len(items), pages=1)
+            if writer is not None and (shard_items >= self.shard_items or last_key is None):
+                writer.close()
+                os.replace(writer.path, writer.path[:-len('.tmp')])
+                self.stats.add(shards=1)
+                checkpoint.save(last_key, exported, last_key is None)
+                writer = None
+                shard_items = 0
+            if last_key is None:
+                break
+            kwargs['ExclusiveStartKey'] = last_key
+        if not checkpoint.done:
+            # An empty segment, or one whose last page was empty.
+            checkpoint.save(None, exported, True)
+        self.stats.add(segments_done=1)
+        logger.info("Segment %s of %s done, %s items.", segment, self.table_name, exported)
+
+    def export(self, resume=False):
+        """
+        Exports the table.
+
+        :param resume: Continues from the checkpoints of an earlier run.
+        :return: The ExportStats.
+        """
+        os.makedirs(os.path.join(self.output_dir, CHECKPOINT_DIR), exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.export_segment, segment, resume)
+                       for segment in range(self.segments)]
+            for future in futures:
+                future.result()
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--text-table')
+    parser.add_argument('--label-table')
+    parser.add_argument('--output', required=True, help='folder of the exports')
+    parser.add_argument('--format', choices=(NDJSON, PARQUET), default=NDJSON)
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS)
+    parser.add_argument('--workers', type=int, help='segments read at the same time')
+    parser.add_argument('--shard-items', type=int, default=DEFAULT_SHARD_ITEMS)
+    parser.add_argument('--page-size', type=int, help='Limit of every Scan request')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoints of an earlier run')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    workers = args.workers or args.segments
+    # A client is thread safe; its connection pool must fit every worker.
+    client = boto3.client('dynamodb', config=Config(
+        max_pool_connections=workers, retries={'max_attempts': 10, 'mode': 'adaptive'}))
+    for table_name, table_kind in ((args.text_table, 'text'), (args.label_table, 'labels')):
+        if not table_name:
+            continue
+        exporter = TableExporter(
+            client, table_name, os.path.join(args.output, table_name), table_kind,
+            args.format, args.segments, workers, args.shard_items, args.page_size)
+        stats = exporter.export(args.resume)
+        print(table_name, stats.to_dict())
+
+
+if __name__ == '__main__':
+    main()
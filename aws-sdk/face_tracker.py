@@ -0,0 +1,257 @@
+"""
+Purpose
+
+Links the faces of RekognitionVideo.do_face_detection() from frame to frame into
+face tracks. Face detection returns every face of every sampled frame on its own,
+without an identity, so the faces of a frame are matched to the open tracks by
+the overlap (IoU) of their bounding boxes with the last box of every track.
+
+The IoU matrix of a frame is computed with NumPy for all track and face pairs at
+once. Pairs are assigned greedily, highest IoU first, or with the Hungarian
+algorithm of SciPy, which is imported only when it is used. A face that matches
+no track starts a new one, and a track that matches no face for max_gap_ms is
+closed.
+
+Every track aggregates the attributes of its faces, such as the most frequent
+emotions and the median age range, and keeps its most confident face, so the
+face search APIs can be called once per track instead of once per face.
+"""
+
+import logging
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GREEDY = 'greedy'
+HUNGARIAN = 'hungarian'
+DEFAULT_IOU_THRESHOLD = 0.3
+DEFAULT_MAX_GAP_MS = 1000
+
+
+def _import_linear_sum_assignment():
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError as error:
+        raise RuntimeError("Hungarian assignment needs SciPy, install scipy.") from error
+    return linear_sum_assignment
+
+
+def to_corners(bounding_boxes):
+    """
+    Converts Rekognition bounding boxes to an array of corners.
+
+    :param bounding_boxes: Dicts with Left, Top, Width and Height.
+    :return: An array of (left, top, right, bottom) rows.
+    """
+    boxes = np.array([(box.get('Left', 0.0), box.get('Top', 0.0),
+                       box.get('Width', 0.0), box.get('Height', 0.0))
+                      for box in bounding_boxes], dtype=np.float64).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Computes the intersection over union of every pair of boxes.
+
+    :param boxes_a: An array of (left, top, right, bottom) rows.
+    :param boxes_b: An array of (left, top, right, bottom) rows.
+    :return: A len(boxes_a) x len(boxes_b) matrix.
+    """
+    left = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    top = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    right = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    bottom = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def greedy_assignment(iou, threshold):
+    """
+    Assigns pairs highest IoU first, each row and column at most once.
+
+    :param iou: The IoU matrix of tracks and faces.
+    :param threshold: The smallest IoU of an assigned pair.
+    :return: The row and column indexes of the assigned pairs.
+    """
+    rows, columns = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, columns], kind='stable')
+    used_rows, used_columns = set(), set()
+    assigned_rows, assigned_columns = [], []
+    for row, column in zip(rows[order].tolist(), columns[order].tolist()):
+        if row in used_rows or column in used_columns:
+            continue
+        used_rows.add(row)
+        used_columns.add(column)
+        assigned_rows.append(row)
+        assigned_columns.append(column)
+    return np.array(assigned_rows, dtype=np.intp), np.array(assigned_columns, dtype=np.intp)
+
+
+def hungarian_assignment(iou, threshold):
+    """
+    Assigns pairs to maximize the total IoU, with SciPy.
+
+    :param iou: The IoU matrix of tracks and faces.
+    :param threshold: The smallest IoU of an assigned pair.
+    :return: The row and column indexes of the assigned pairs.
+    """
+    rows, columns = _import_linear_sum_assignment()(iou, maximize=True)
+    keep = iou[rows, columns] >= threshold
+    return rows[keep], columns[keep]
+
+
+class FaceTrack:
+    """The faces of one person, linked across the frames of a video."""
+    def __init__(self, track_id, faces):
+        """
+        :param track_id: The number of the track in the video.
+        :param faces: The RekognitionFace objects of the track, in time order.
+        """
+        self.track_id = track_id
+        self.faces = faces
+
+    @property
+    def first_ms(self):
+        return self.faces[0].timestamp
+
+    @property
+    def last_ms(self):
+        return self.faces[-1].timestamp
+
+    def best_face(self):
+        """The most confident face of the track, to search for once per track."""
+        return max(self.faces, key=lambda face: face.confidence or 0.0)
+
+    def emotions(self, count=3):
+        """
+        Gets the emotions found most often on the faces of the track.
+
+        :param count: The number of emotions.
+        :return: A list of (emotion, share of the faces) tuples.
+        """
+        counter = Counter(emotion for face in self.faces for emotion in face.emotions)
+        return [(emotion, round(found / len(self.faces), 3))
+                for emotion, found in counter.most_common(count)]
+
+    def age_range(self):
+        """The median of the low and high ages of the faces, or None."""
+        ages = np.array([face.age_range for face in self.faces
+                         if face.age_range is not None], dtype=np.float64)
+        if not len(ages):
+            return None
+        low, high = np.median(ages, axis=0)
+        return int(low), int(high)
+
+    def gender(self):
+        """The gender found most often on the faces of the track, or None."""
+        genders = Counter(face.gender for face in self.faces if face.gender is not None)
+        return genders.most_common(1)[0][0] if genders else None
+
+    def to_dict(self):
+        """
+        Renders the track to a dict.
+
+        :return: A dict that contains the track data.
+        """
+        best_face = self.best_face()
+        rendering = {
+            'track_id': self.track_id,
+            'first_ms': self.first_ms,
+            'last_ms': self.last_ms,
+            'faces': len(self.faces),
+            'best_face': {'timestamp': best_face.timestamp,
+                          'bounding_box': best_face.bounding_box,
+                          'confidence': best_face.confidence},
+        }
+        emotions = self.emotions()
+        if emotions:
+            rendering['emotions'] = emotions
+        age_range = self.age_range()
+        if age_range is not None:
+            rendering['age'] = f'{age_range[0]} - {age_range[1]}'
+        gender = self.gender()
+        if gender is not None:
+            rendering['gender'] = gender
+        return rendering
+
+
+class FaceTracker:
+    """Links face detections across video frames by bounding box overlap."""
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD, max_gap_ms=DEFAULT_MAX_GAP_MS,
+                 method=GREEDY):
+        """
+        :param iou_threshold: The smallest IoU of a face and the last box of a track
+                              for the face to continue the track.
+        :param max_gap_ms: The time after its last face at which a track is closed.
+        :param method: greedy, or hungarian for the optimal assignment with SciPy.
+        """
+        if method not in (GREEDY, HUNGARIAN):
+            raise ValueError("Unknown assignment method {}.".format(method))
+        self.iou_threshold = iou_threshold
+        self.max_gap_ms = max_gap_ms
+        self.assign = greedy_assignment if method == GREEDY else hungarian_assignment
+        if method == HUNGARIAN:
+            _import_linear_sum_assignment()
+
+    def track(self, faces):
+        """
+        Links faces into tracks.
+
+        :param faces: The RekognitionFace objects returned by do_face_detection().
+                      Faces without a bounding box are left out.
+        :return: The list of FaceTrack objects, ordered by their first face.
+        """
+        faces = [face for face in faces if face.bounding_box]
+        if not faces:
+            return []
+        timestamps = np.array([face.timestamp or 0 for face in faces], dtype=np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        boxes = to_corners([faces[index].bounding_box for index in order])
+        frame_starts = np.flatnonzero(np.r_[True, timestamps[1:] != timestamps[:-1]])
+        frame_ends = np.append(frame_starts[1:], len(timestamps))
+
+        # Track number of every face, in time order
+        face_tracks = np.empty(len(timestamps), dtype=np.int64)
+        # Open tracks: their numbers, last boxes and last timestamps
+        open_ids = np.zeros(0, dtype=np.int64)
+        open_boxes = np.zeros((0, 4))
+        open_times = np.zeros(0, dtype=np.int64)
+        track_count = 0
+        for start, end in zip(frame_starts.tolist(), frame_ends.tolist()):
+            time_ms = timestamps[start]
+            alive = time_ms - open_times <= self.max_gap_ms
+            open_ids, open_boxes, open_times = open_ids[alive], open_boxes[alive], open_times[alive]
+            frame_boxes = boxes[start:end]
+            frame_tracks = np.full(end - start, -1, dtype=np.int64)
+            if len(open_ids):
+                rows, columns = self.assign(iou_matrix(open_boxes, frame_boxes),
+                                            self.iou_threshold)
+                frame_tracks[columns] = open_ids[rows]
+                open_boxes[rows] = frame_boxes[columns]
+                open_times[rows] = time_ms
+            new = np.flatnonzero(frame_tracks < 0)
+            if len(new):
+                new_ids = np.arange(track_count, track_count + len(new))
+                track_count += len(new)
+                frame_tracks[new] = new_ids
+                open_ids = np.append(open_ids, new_ids)
+                open_boxes = np.vstack((open_boxes, frame_boxes[new]))
+                open_times = np.append(open_times, np.full(len(new), time_ms))
+            face_tracks[start:end] = frame_tracks
+
+        # Group the faces by track, keeping time order within every track.
+        by_track = np.argsort(face_tracks, kind='stable')
+        bounds = np.searchsorted(face_tracks[by_track], np.arange(track_count + 1))
+        original = order[by_track]
+        tracks = [FaceTrack(track_id, [faces[index] for index in
+                                       original[bounds[track_id]:bounds[track_id + 1]]])
+                  for track_id in range(track_count)]
+        logger.info("Linked %s faces into %s tracks.", len(faces), len(tracks))
+        return tracks
@@ -0,0 +1,774 @@
+"""
+Purpose
+
+Local record/replay stand-ins for the Amazon Rekognition, Amazon SNS, Amazon SQS,
+Amazon DynamoDB, AWS Lambda and IAM calls made by RekognitionVideo and by the
+detect_text and write_results_text Lambda handlers, so throughput and failure
+modes can be exercised offline and reproducibly.
+
+FakeRekognitionClient replays recorded get_*_detection results page by page with
+NextToken, and publishes the SNS completion message of every started job to the
+subscribed FakeQueue after a configurable job latency. Start calls can fail with
+ThrottlingException or LimitExceededException at configurable rates, drawn from
+a seeded random generator.
+
+The Lambda modules create their clients at import, so assign the fakes to the
+module attributes, for example:
+
+    write_results_text.rekognition_client = FakeRekognitionClient(...)
+
+Recordings are either the raw pages saved with record_job_results(), or the
+concatenated to_dict() output in the aws-sdk/json folder, loaded with
+load_text_recording().
+
+FakeTable keeps items by key once create_table() has given it a key schema, and
+answers Query requests on the table and its secondary indexes, with the key
+conditions, ordering, Limit and ExclusiveStartKey paging of DynamoDB.
+FakeDynamoDBClient is the low-level client of the same tables, with values in
+the DynamoDB wire format, as used by image/label_queries.py.
+"""
+
+import bisect
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Job type: (API name in the SNS message, key of the results in the get response)
+JOB_TYPES = {
+    'text_detection': ('StartTextDetection', 'TextDetections'),
+    'label_detection': ('StartLabelDetection', 'Labels'),
+    'face_detection': ('StartFaceDetection', 'Faces'),
+    'person_tracking': ('StartPersonTracking', 'Persons'),
+    'celebrity_recognition': ('StartCelebrityRecognition', 'Celebrities'),
+    'content_moderation': ('StartContentModeration', 'ModerationLabels'),
+}
+
+DEFAULT_VIDEO_METADATA = {
+    'Codec': 'h264', 'DurationMillis': 0, 'Format': 'QuickTime / MOV',
+    'FrameRate': 25.0, 'FrameHeight': 1080, 'FrameWidth': 1920}
+
+
+def _client_error(code, operation_name, message):
+    # Boto3 raises modeled errors as ClientError subclasses named after the code,
+    # and the handlers check error.__class__.__name__.
+    error_class = type(code, (ClientError,), {})
+    return error_class({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+
+class _Exceptions:
+    """Mimics the client.exceptions attribute of a Boto3 client."""
+    ClientError = ClientError
+
+
+class Recording:
+    """The recorded results of one job, replayed by FakeRekognitionClient."""
+    def __init__(self, entries, video_metadata=None):
+        """
+        :param entries: The list of result entries, in the format of one element of
+                        the results list of a get_*_detection response.
+        :param video_metadata: The VideoMetadata of the get response.
+        """
+        self.entries = entries
+        self.video_metadata = video_metadata or DEFAULT_VIDEO_METADATA
+
+
+def _parse_timestamp(timestamp):
+    """Parses the 0h:0m:0s timestamps written by RekognitionText.to_dict()."""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    hours, minutes, seconds = (int(part[:-1]) for part in timestamp.split(':'))
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000
+
+
+def iter_json_objects(path):
+    """
+    Reads a file of concatenated JSON objects, as written by usage_demo().
+
+    :param path: The path of the file.
+    :return: A generator of the decoded objects.
+    """
+    with open(path) as fp:
+        data = fp.read()
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(data) and data[position].isspace():
+            position += 1
+        if position == len(data):
+            return
+        obj, position = decoder.raw_decode(data, position)
+        yield obj
+
+
+def load_text_recording(path):
+    """
+    Loads an aws-sdk/json text detection file as a text_detection recording.
+
+    :param path: The path of the file.
+    :return: The Recording.
+    """
+    entries = []
+    for text_id, text in enumerate(iter_json_objects(path)):
+        geometry = {}
+        if text.get('boundingbox') is not None:
+            geometry['BoundingBox'] = text['boundingbox']
+        if text.get('polygon') is not None:
+            geometry['Polygon'] = text['polygon']
+        entries.append({
+            'Timestamp': _parse_timestamp(text.get('timestamp', 0)),
+            'TextDetection': {
+                'DetectedText': text.get('text'),
+                'Type': text.get('kind', 'LINE'),
+                'Id': text_id,
+                'Confidence': text.get('Confidence'),
+                'Geometry': geometry}})
+    duration = entries[-1]['Timestamp'] if entries else 0
+    return Recording(entries, dict(DEFAULT_VIDEO_METADATA, DurationMillis=duration))
+
+
+def record_job_results(get_results_func, job_id, path):
+    """
+    Records every page of the results of a completed job, from a live client.
+
+    :param get_results_func: The Boto3 get job results function, such as
+                             get_text_detection.
+    :param job_id: The ID of the job.
+    :param path: The path of the JSON file to write.
+    """
+    pages = []
+    kwargs = {'JobId': job_id}
+    while True:
+        response = get_results_func(**kwargs)
+        response.pop('ResponseMetadata', None)
+        pages.append(response)
+        if 'NextToken' not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    with open(path, 'w') as fp:
+        json.dump({'pages': pages}, fp)
+
+
+def load_job_recording(path, job_type):
+    """
+    Loads a recording written by record_job_results().
+
+    :param path: The path of the JSON file.
+    :param job_type: The job type, a key of JOB_TYPES.
+    :return: The Recording.
+    """
+    with open(path) as fp:
+        pages = json.load(fp)['pages']
+    results_key = JOB_TYPES[job_type][1]
+    entries = [entry for page in pages for entry in page.get(results_key, [])]
+    return Recording(entries, pages[0].get('VideoMetadata') if pages else None)
+
+
+class FakeBroker:
+    """Routes messages from fake SNS topics to the subscribed fake SQS queues."""
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.topics = {}
+        self.queues = {}
+
+    def publish(self, topic_arn, message, deliver_at=None):
+        """
+        Publishes a message to the queues subscribed to a topic.
+
+        :param topic_arn: The ARN of the topic.
+        :param message: The message string.
+        :param deliver_at: The clock time when the message becomes visible.
+        """
+        body = json.dumps({
+            'Type': 'Notification', 'MessageId': str(uuid.uuid4()),
+            'TopicArn': topic_arn, 'Message': message})
+        topic = self.topics.get(topic_arn)
+        if topic is None:
+            logger.warning("No fake topic %s, dropping message.", topic_arn)
+            return
+        for queue_arn in topic.subscriptions:
+            self.queues[queue_arn].put(body, deliver_at or self.clock())
+
+
+class FakeTopic:
+    def __init__(self, broker, name):
+        self.broker = broker
+        self.arn = 'arn:aws:sns:local:000000000000:' + name
+        self.subscriptions = []
+
+    def subscribe(self, Protocol, Endpoint):
+        self.subscriptions.append(Endpoint)
+
+    def publish(self, Message):
+        self.broker.publish(self.arn, Message)
+
+    def delete(self):
+        self.broker.topics.pop(self.arn, None)
+
+
+class FakeMessage:
+    def __init__(self, queue, body):
+        self.queue = queue
+        self.body = body
+
+    def delete(self):
+        self.queue.in_flight.remove(self)
+
+
+class FakeQueue:
+    def __init__(self, broker, name, attributes=None):
+        self.broker = broker
+        self.url = 'https://sqs.local/000000000000/' + name
+        self.attributes = dict(attributes or {},
+                               QueueArn='arn:aws:sqs:local:000000000000:' + name)
+        self.pending = []
+        self.in_flight = []
+
+    def set_attributes(self, Attributes):
+        self.attributes.update(Attributes)
+
+    def put(self, body, deliver_at):
+        self.pending.append((deliver_at, body))
+        self.pending.sort(key=lambda message: message[0])
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0):
+        """Returns the visible messages, waiting up to WaitTimeSeconds for one."""
+        deadline = self.broker.clock() + WaitTimeSeconds
+        while True:
+            now = self.broker.clock()
+            if self.pending and self.pending[0][0] <= now:
+                break
+            if now >= deadline:
+                return []
+            next_due = self.pending[0][0] if self.pending else deadline
+            self.broker.sleep(max(0.0, min(next_due, deadline) - now))
+        messages = []
+        while (self.pending and self.pending[0][0] <= now
+               and len(messages) < MaxNumberOfMessages):
+            messages.append(FakeMessage(self, self.pending.pop(0)[1]))
+        self.in_flight.extend(messages)
+        return messages
+
+    def delete(self):
+        self.broker.queues.pop(self.attributes['QueueArn'], None)
+
+
+class FakeSnsResource:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def create_topic(self, Name):
+        topic = FakeTopic(self.broker, Name)
+        self.broker.topics[topic.arn] = topic
+        return topic
+
+
+class FakeSqsResource:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def create_queue(self, QueueName, Attributes=None):
+        queue = FakeQueue(self.broker, QueueName, Attributes)
+        self.broker.queues[queue.attributes['QueueArn']] = queue
+        return queue
+
+    def get_queue_by_name(self, QueueName):
+        return self.broker.queues['arn:aws:sqs:local:000000000000:' + QueueName]
+
+
+class FakeRekognitionClient:
+    """Replays recorded video job results and simulates job completion."""
+    exceptions = _Exceptions
+
+    def __init__(self, broker, recordings, job_latency=0.0, page_size=1000,
+                 throttle_rate=0.0, limit_exceeded_rate=0.0, seed=0):
+        """
+        Initializes the client.
+
+        :param broker: The FakeBroker that delivers completion messages.
+        :param recordings: A dict of Recording objects, keyed by job type or by
+                           (job type, video object name).
+        :param job_latency: The seconds between the start of a job and its
+                            completion message.
+        :param page_size: The default MaxResults of the get calls.
+        :param throttle_rate: The probability that a start call raises
+                              ThrottlingException.
+        :param limit_exceeded_rate: The probability that a start call raises
+                                    LimitExceededException.
+        :param seed: The seed of the random generator of the error rates.
+        """
+        self.broker = broker
+        self.recordings = recordings
+        self.job_latency = job_latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.limit_exceeded_rate = limit_exceeded_rate
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.calls = {}
+        for job_type in JOB_TYPES:
+            setattr(self, 'start_' + job_type, self._make_start(job_type))
+            setattr(self, 'get_' + job_type, self._make_get(job_type))
+
+    def _count(self, operation_name):
+        self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+
+    def _make_start(self, job_type):
+        def start_job(Video, NotificationChannel=None, JobTag=None, **kwargs):
+            return self._start_job(job_type, Video, NotificationChannel, JobTag, kwargs)
+        return start_job
+
+    def _make_get(self, job_type):
+        def get_results(JobId, MaxResults=None, NextToken=None, **kwargs):
+            return self._get_results(job_type, JobId, MaxResults, NextToken)
+        return get_results
+
+    def _start_job(self, job_type, video, channel, job_tag, options):
+        api_name = JOB_TYPES[job_type][0]
+        self._count(api_name)
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            raise _client_error('ThrottlingException', api_name, 'Rate exceeded')
+        if draw < self.throttle_rate + self.limit_exceeded_rate:
+            raise _client_error(
+                'LimitExceededException', api_name, 'Concurrent job limit exceeded')
+
+        video_name = video['S3Object']['Name']
+        recording = self.recordings.get((job_type, video_name), self.recordings.get(job_type))
+        job_id = uuid.uuid4().hex
+        completes_at = self.broker.clock() + self.job_latency
+        self.jobs[job_id] = {
+            'type': job_type, 'recording': recording, 'completes_at': completes_at,
+            'options': options}
+        if channel is not None:
+            self.broker.publish(channel['SNSTopicArn'], json.dumps({
+                'JobId': job_id,
+                'Status': 'SUCCEEDED' if recording is not None else 'FAILED',
+                'API': api_name,
+                'JobTag': job_tag,
+                'Timestamp': int(time.time() * 1000),
+                'Video': {'S3ObjectName': video_name,
+                          'S3Bucket': video['S3Object']['Bucket']}}), completes_at)
+        return {'JobId': job_id}
+
+    def _get_results(self, job_type, job_id, max_results, next_token):
+        operation_name = 'Get' + JOB_TYPES[job_type][0][len('Start'):]
+        self._count(operation_name)
+        job = self.jobs.get(job_id)
+        if job is None or job['type'] != job_type:
+            raise _client_error('ResourceNotFoundException', operation_name, job_id)
+        results_key = JOB_TYPES[job_type][1]
+        if self.broker.clock() < job['completes_at']:
+            return {'JobStatus': 'IN_PROGRESS', results_key: []}
+        if job['recording'] is None:
+            return {'JobStatus': 'FAILED', 'StatusMessage': 'No recording', results_key: []}
+
+        start = int(next_token) if next_token else 0
+        end = start + (max_results or self.page_size)
+        entries = job['recording'].entries
+        response = {
+            'JobStatus': 'SUCCEEDED',
+            'VideoMetadata': job['recording'].video_metadata,
+            results_key: entries[start:end]}
+        if end < len(entries):
+            response['NextToken'] = str(end)
+        return response
+
+
+class FakeLambdaClient:
+    """Answers the get_function call the detect_text handler makes for its role."""
+    def __init__(self, role_arn='arn:aws:iam::000000000000:role/fake-rekognition-role'):
+        self.role_arn = role_arn
+
+    def get_function(self, FunctionName):
+        return {'Configuration': {'FunctionName': FunctionName, 'Role': self.role_arn}}
+
+
+# Key condition of a Query: the partition key and an optional sort key condition
+_KEY_CONDITION = re.compile(r'^\s*([#\w]+)\s*=\s*(:\w+)(?:\s+AND\s+(.+?))?\s*$', re.I)
+_SORT_COMPARISON = re.compile(r'^([#\w]+)\s*(=|<=|<|>=|>)\s*(:\w+)$')
+_SORT_BETWEEN = re.compile(r'^([#\w]+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)$', re.I)
+_SORT_BEGINS_WITH = re.compile(r'^begins_with\s*\(\s*([#\w]+)\s*,\s*(:\w+)\s*\)$', re.I)
+
+
+def _sort_condition(expression, names, values):
+    """
+    Parses a sort key condition.
+
+    :return: The sort key name, the operator and the bound values.
+    """
+    match = _SORT_COMPARISON.match(expression)
+    if match:
+        name, operator, placeholder = match.groups()
+        return names.get(name, name), operator, (values[placeholder],)
+    match = _SORT_BETWEEN.match(expression)
+    if match:
+        name, low, high = match.groups()
+        return names.get(name, name), 'BETWEEN', (values[low], values[high])
+    match = _SORT_BEGINS_WITH.match(expression)
+    if match:
+        name, placeholder = match.groups()
+        return names.get(name, name), 'begins_with', (values[placeholder],)
+    raise _client_error('ValidationException', 'Query',
+                        'Unsupported key condition: {}'.format(expression))
+
+
+def _sort_range(values, operator, bounds):
+    """Gets the slice of the sorted sort key values that meets a condition."""
+    bound = bounds[0]
+    if operator == '=':
+        return bisect.bisect_left(values, bound), bisect.bisect_right(values, bound)
+    if operator == '<':
+        return 0, bisect.bisect_left(values, bound)
+    if operator == '<=':
+        return 0, bisect.bisect_right(values, bound)
+    if operator == '>':
+        return bisect.bisect_right(values, bound), len(values)
+    if operator == '>=':
+        return bisect.bisect_left(values, bound), len(values)
+    if operator == 'BETWEEN':
+        return bisect.bisect_left(values, bound), bisect.bisect_right(values, bounds[1])
+    # begins_with: the values with a prefix are contiguous.
+    low = high = bisect.bisect_left(values, bound)
+    while high < len(values) and values[high].startswith(bound):
+        high += 1
+    return low, high
+
+
+class FakeTable:
+    def __init__(self, name):
+        self.name = name
+        self.items = []
+        # Key attribute names of the table, and of every index with its
+        # projection type, set by FakeDynamoDBClient.create_table
+        self.key_attributes = None
+        self.indexes = {}
+        self._positions = {}
+        # Items of every index and partition key, sorted by sort key
+        self._partitions = {}
+        self._partitions_lock = threading.Lock()
+
+    def put_item(self, Item):
+        self._partitions = {}
+        if self.key_attributes:
+            key = tuple(Item.get(name) for name in self.key_attributes)
+            position = self._positions.get(key)
+            if position is not None:
+                self.items[position] = Item
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+            self._positions[key] = len(self.items)
+        self.items.append(Item)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def _index_keys(self, index_name):
+        if index_name is None:
+            return self.key_attributes, 'ALL'
+        if index_name not in self.indexes:
+            raise _client_error('ValidationException', 'Query',
+                                'The table has no index {}'.format(index_name))
+        return self.indexes[index_name]
+
+    def _sort_key(self, item, sort_name):
+        # Items with the same sort key are ordered by their table key.
+        table_key = tuple(item[name] for name in self.key_attributes)
+        return (item[sort_name], table_key) if sort_name else table_key
+
+    def _partition(self, index_name, partition_value):
+        """
+        Gets the items of a partition of the table or of an index.
+
+        :return: The sort keys, the items and the sort key values, in sort order.
+        """
+        with self._partitions_lock:
+            partitions = self._partitions.get(index_name)
+            if partitions is None:
+                partitions = self._partitions[index_name] = self._build_partitions(index_name)
+        return partitions.get(partition_value, ([], [], []))
+
+    def _build_partitions(self, index_name):
+        key_names = self._index_keys(index_name)[0]
+        sort_name = key_names[1] if len(key_names) > 1 else None
+        entries = {}
+        # An index only holds the items that have its key attributes.
+        for item in self.items:
+            if all(name in item for name in key_names):
+                entries.setdefault(item[key_names[0]], []).append(
+                    (self._sort_key(item, sort_name), item))
+        partitions = {}
+        for partition_value, partition in entries.items():
+            partition.sort(key=lambda entry: entry[0])
+            partitions[partition_value] = (
+                [sort_key for sort_key, _ in partition], [item for _, item in partition],
+                [item[sort_name] for _, item in partition] if sort_name else [])
+        return partitions
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, IndexName=None,
+              ExpressionAttributeNames=None, ProjectionExpression=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, **kwargs):
+        """
+        Answers a Query request with a string key condition, as the Table of the
+        Boto3 resource API does.
+
+        :return: The Query response, with Items, Count and LastEvaluatedKey.
+        """
+        if not self.key_attributes:
+            raise _client_error('ValidationException', 'Query', 'The table has no key schema')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        match = _KEY_CONDITION.match(KeyConditionExpression)
+        if match is None:
+            raise _client_error('ValidationException', 'Query',
+                                'Unsupported key condition: {}'.format(KeyConditionExpression))
+        partition_name, placeholder, sort_expression = match.groups()
+        key_names, projection = self._index_keys(IndexName)
+        if names.get(partition_name, partition_name) != key_names[0]:
+            raise _client_error('ValidationException', 'Query',
+                                'The key condition must use {}'.format(key_names[0]))
+        sort_name = key_names[1] if len(key_names) > 1 else None
+        sort_keys, partition, sort_values = self._partition(IndexName, values[placeholder])
+        low, high = 0, len(partition)
+        if sort_expression:
+            condition_name, operator, bounds = _sort_condition(sort_expression, names, values)
+            if condition_name != sort_name:
+                raise _client_error('ValidationException', 'Query',
+                                    'The key condition must use {}'.format(sort_name))
+            low, high = _sort_range(sort_values, operator, bounds)
+
+        limit = Limit or len(partition)
+        if ScanIndexForward:
+            begin = low
+            if ExclusiveStartKey:
+                begin = bisect.bisect_right(
+                    sort_keys, self._sort_key(ExclusiveStartKey, sort_name), low, max(low, high))
+            items = partition[begin:min(begin + limit, high)]
+            more = begin + limit < high
+        else:
+            end = high
+            if ExclusiveStartKey:
+                end = bisect.bisect_left(
+                    sort_keys, self._sort_key(ExclusiveStartKey, sort_name), low, max(low, high))
+            items = partition[max(low, end - limit):end][::-1]
+            more = end - limit > low
+
+        if ProjectionExpression:
+            attributes = [names.get(name.strip(), name.strip())
+                          for name in ProjectionExpression.split(',')]
+        elif projection == 'KEYS_ONLY':
+            attributes = list(dict.fromkeys(list(self.key_attributes) + list(key_names)))
+        else:
+            attributes = None
+        response = {'Count': len(items), 'ScannedCount': len(items)}
+        if more and items:
+            last = items[-1]
+            response['LastEvaluatedKey'] = {
+                name: last[name] for name in dict.fromkeys(list(self.key_attributes) + key_names)}
+        if attributes is not None:
+            items = [{name: item[name] for name in attributes if name in item} for item in items]
+        response['Items'] = items
+        return response
+
+    def batch_writer(self, **kwargs):
+        return _FakeBatchWriter(self)
+
+
+class _FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item)
+
+
+class FakeDynamoDBResource:
+    """Keeps the items written by the handlers in memory, per table name."""
+    def __init__(self):
+        self.tables = {}
+
+    def Table(self, name):
+        return self.tables.setdefault(name, FakeTable(name))
+
+
+class _FakeWaiter:
+    def wait(self, **kwargs):
+        pass
+
+
+class FakeDynamoDBClient:
+    """
+    The low-level client of the tables of a FakeDynamoDBResource, with the
+    create_table and query calls, values in the wire format and an optional
+    latency per request. It is thread safe, as the Boto3 client.
+    """
+    def __init__(self, resource=None, latency=0.0, sleep=time.sleep):
+        """
+        :param resource: The FakeDynamoDBResource that holds the tables.
+        :param latency: The seconds every request takes.
+        :param sleep: The function used to wait out the latency.
+        """
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+        self.resource = resource if resource is not None else FakeDynamoDBResource()
+        self.latency = latency
+        self.sleep = sleep
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._serialize = TypeSerializer().serialize
+        self._deserialize = TypeDeserializer().deserialize
+
+    def _count(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.latency:
+            self.sleep(self.latency)
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(),
+                     LocalSecondaryIndexes=(), **kwargs):
+        self._count('CreateTable')
+
+        def key_names(schema):
+            return [key['AttributeName'] for key in sorted(
+                schema, key=lambda key: key['KeyType'] != 'HASH')]
+
+        table = self.resource.Table(TableName)
+        table.key_attributes = key_names(KeySchema)
+        for index in list(GlobalSecondaryIndexes) + list(LocalSecondaryIndexes):
+            table.indexes[index['IndexName']] = (
+                key_names(index['KeySchema']),
+                index.get('Projection', {}).get('ProjectionType', 'ALL'))
+        return {'TableDescription': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    def get_waiter(self, waiter_name):
+        return _FakeWaiter()
+
+    def query(self, TableName, ExpressionAttributeValues, ExclusiveStartKey=None, **kwargs):
+        self._count('Query')
+        deserialize, serialize = self._deserialize, self._serialize
+        if ExclusiveStartKey:
+            kwargs['ExclusiveStartKey'] = {
+                name: deserialize(value) for name, value in ExclusiveStartKey.items()}
+        response = self.resource.Table(TableName).query(
+            ExpressionAttributeValues={
+                name: deserialize(value) for name, value in ExpressionAttributeValues.items()},
+            **kwargs)
+        response['Items'] = [{name: serialize(value) for name, value in item.items()}
+                             for item in response['Items']]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = {
+                name: serialize(value) for name, value in response['LastEvaluatedKey'].items()}
+        return response
+
+
+class _FakeRole:
+    def __init__(self, name):
+        self.role_name = name
+        self.arn = 'arn:aws:iam::000000000000:role/' + name
+        self.policies = []
+
+    @property
+    def attached_policies(self):
+        role = self
+
+        class _Collection:
+            def all(self):
+                return list(role.policies)
+        return _Collection()
+
+    def attach_policy(self, PolicyArn):
+        self.policies.append(_FakePolicy(PolicyArn.split('/')[-1]))
+
+    def detach_policy(self, PolicyArn):
+        self.policies = [policy for policy in self.policies if policy.arn != PolicyArn]
+
+    def delete(self):
+        pass
+
+
+class _FakePolicy:
+    def __init__(self, name):
+        self.arn = 'arn:aws:iam::000000000000:policy/' + name
+
+    def delete(self):
+        pass
+
+
+class FakeIam:
+    """Minimal IAM client and resource for create_notification_channel()."""
+    def list_roles(self, **kwargs):
+        return {'Roles': []}
+
+    def list_policies(self, **kwargs):
+        return {'Policies': []}
+
+    def create_role(self, RoleName, AssumeRolePolicyDocument):
+        return _FakeRole(RoleName)
+
+    def Role(self, name):
+        return _FakeRole(name)
+
+    def create_policy(self, PolicyName, PolicyDocument):
+        return _FakePolicy(PolicyName)
+
+    def Policy(self, name):
+        return _FakePolicy(name)
+
+
+class FakeAws:
+    """Bundles a set of fakes that share one broker."""
+    def __init__(self, recordings, clock=time.monotonic, sleep=time.sleep, **rekognition_options):
+        """
+        :param recordings: The recordings replayed by the Rekognition client.
+        :param clock: The clock of the simulated job latency.
+        :param sleep: The function used to wait for messages.
+        :param rekognition_options: Options of FakeRekognitionClient.
+        """
+        self.broker = FakeBroker(clock, sleep)
+        self.rekognition = FakeRekognitionClient(self.broker, recordings, **rekognition_options)
+        self.sns = FakeSnsResource(self.broker)
+        self.sqs = FakeSqsResource(self.broker)
+        self.dynamodb = FakeDynamoDBResource()
+        self.dynamodb_client = FakeDynamoDBClient(self.dynamodb)
+        self.lambda_client = FakeLambdaClient()
+        self.iam = FakeIam()
+
+
+def sqs_event(*bodies):
+    """
+    Builds the SQS event a Lambda function receives for some message bodies.
+
+    :param bodies: The message bodies, as strings.
+    :return: The event dict.
+    """
+    return {'Records': [{'messageId': str(uuid.uuid4()), 'body': body,
+                         'eventSource': 'aws:sqs'} for body in bodies]}
+
+
+def s3_put_event(bucket, key):
+    """
+    Builds the SQS message body of an S3 PutObject notification.
+
+    :param bucket: The bucket name.
+    :param key: The object key.
+    :return: The message body, as a string.
+    """
+    return json.dumps({'Records': [{
+        'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+        's3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]})
+
+
+class FakeLambdaContext:
+    def __init__(self, function_name='fake-function'):
+        self.function_name = function_name
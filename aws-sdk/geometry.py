@@ -0,0 +1,275 @@
+"""
+Purpose
+
+Vectorized geometry of the polygons that Amazon Rekognition returns, such as the
+Geometry of RekognitionText. The polygons, lists of dicts with X and Y, are
+packed once into one NumPy array of vertices and the offset of every polygon in
+it, so that area, centroid, bounds, point-in-polygon tests, clipping and
+intersection with a region are computed for all the polygons at once.
+
+Coordinates are the ratios of the frame size that Rekognition uses, with Y
+pointing down. Rekognition sometimes returns vertices slightly outside the frame,
+such as negative Top values; clip() cuts the polygons to the frame.
+
+Regions are convex polygons: a (left, top, right, bottom) box, or a list of
+vertices as dicts with X and Y or as (x, y) pairs, in either orientation.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The whole frame, as a (left, top, right, bottom) region
+FRAME = (0.0, 0.0, 1.0, 1.0)
+
+
+def region_vertices(region):
+    """
+    Gets the vertices of a region.
+
+    :param region: A (left, top, right, bottom) box, or a list of vertices as
+                   dicts with X and Y or as (x, y) pairs.
+    :return: An array of (x, y) rows.
+    """
+    if len(region) == 4 and all(isinstance(value, (int, float)) for value in region):
+        left, top, right, bottom = region
+        return np.array([(left, top), (right, top), (right, bottom), (left, bottom)],
+                        dtype=np.float64)
+    return np.array([(vertex['X'], vertex['Y']) if isinstance(vertex, dict) else vertex
+                     for vertex in region], dtype=np.float64).reshape(-1, 2)
+
+
+def text_polygon(text):
+    """
+    Gets the polygon of a text detection, or its bounding box as a polygon.
+
+    :param text: A RekognitionText object.
+    :return: The list of vertices, empty without geometry.
+    """
+    geometry = text.geometry or {}
+    if geometry.get('Polygon'):
+        return geometry['Polygon']
+    box = geometry.get('BoundingBox')
+    if not box:
+        return []
+    left, top = box.get('Left', 0.0), box.get('Top', 0.0)
+    return region_vertices((left, top, left + box.get('Width', 0.0),
+                            top + box.get('Height', 0.0)))
+
+
+class PolygonSet:
+    """Polygons packed as one array of vertices and the offset of every polygon."""
+    def __init__(self, vertices, offsets):
+        """
+        Initializes the set. Use from_polygons(), from_boxes() or from_texts() to
+        build one.
+
+        :param vertices: The (x, y) vertices of all the polygons, one after another.
+        :param offsets: The index of the first vertex of every polygon, followed by
+                        the number of vertices.
+        """
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        sizes = np.diff(self.offsets)
+        # Polygon of every vertex, and the vertex after it in its polygon
+        self.vertex_polygons = np.repeat(np.arange(len(sizes)), sizes)
+        self.next_vertices = np.arange(1, len(self.vertices) + 1)
+        nonempty = sizes > 0
+        self.next_vertices[self.offsets[1:][nonempty] - 1] = self.offsets[:-1][nonempty]
+
+    @classmethod
+    def from_polygons(cls, polygons):
+        """
+        Packs polygons.
+
+        :param polygons: The polygons, each a list of vertices as dicts with X and
+                         Y, such as Geometry['Polygon'], or as (x, y) pairs.
+        :return: The PolygonSet.
+        """
+        sizes = [len(polygon) for polygon in polygons]
+        vertices = [(vertex['X'], vertex['Y']) if isinstance(vertex, dict) else vertex
+                    for polygon in polygons for vertex in polygon]
+        return cls(np.array(vertices, dtype=np.float64).reshape(-1, 2),
+                   np.concatenate(([0], np.cumsum(sizes, dtype=np.int64))))
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        """
+        Packs bounding boxes as four-vertex polygons.
+
+        :param boxes: The bounding boxes, dicts with Left, Top, Width and Height.
+        :return: The PolygonSet.
+        """
+        corners = np.array([(box.get('Left', 0.0), box.get('Top', 0.0),
+                             box.get('Width', 0.0), box.get('Height', 0.0))
+                            for box in boxes], dtype=np.float64).reshape(-1, 4)
+        corners[:, 2:] += corners[:, :2]
+        vertices = corners[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 2)
+        return cls(vertices, np.arange(0, 4 * len(corners) + 1, 4))
+
+    @classmethod
+    def from_texts(cls, texts):
+        """
+        Packs the polygons of text detections, in their order. A text without a
+        polygon gets its bounding box, and one without geometry an empty polygon.
+
+        :param texts: The RekognitionText objects.
+        :return: The PolygonSet.
+        """
+        return cls.from_polygons([text_polygon(text) for text in texts])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def polygon(self, index):
+        """
+        Gets the vertices of a polygon.
+
+        :param index: The position of the polygon in the set.
+        :return: An array of (x, y) rows, a view of the set.
+        """
+        return self.vertices[self.offsets[index]:self.offsets[index + 1]]
+
+    def _sum(self, values):
+        # Sums values per polygon; bincount, unlike reduceat, handles empty ones.
+        return np.bincount(self.vertex_polygons, weights=values, minlength=len(self))
+
+    def _cross(self):
+        x, y = self.vertices[:, 0], self.vertices[:, 1]
+        return x * y[self.next_vertices] - x[self.next_vertices] * y
+
+    def signed_areas(self):
+        """The signed area of every polygon, positive when clockwise on the frame."""
+        return self._sum(self._cross()) / 2
+
+    def areas(self):
+        """The area of every polygon, in squared frame ratios."""
+        return np.abs(self.signed_areas())
+
+    def centroids(self):
+        """
+        Gets the centroid of every polygon. Degenerate polygons get the mean of
+        their vertices, and empty ones NaN.
+
+        :return: An array of (x, y) rows.
+        """
+        cross = self._cross()
+        signed = self._sum(cross) / 2
+        x, y = self.vertices[:, 0], self.vertices[:, 1]
+        sizes = np.diff(self.offsets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centroids = np.column_stack((
+                self._sum((x + x[self.next_vertices]) * cross) / (6 * signed),
+                self._sum((y + y[self.next_vertices]) * cross) / (6 * signed)))
+            degenerate = np.abs(signed) < 1e-12
+            centroids[degenerate] = np.column_stack((
+                self._sum(x) / sizes, self._sum(y) / sizes))[degenerate]
+        return centroids
+
+    def bounds(self):
+        """
+        Gets the bounding box of every polygon.
+
+        :return: An array of (left, top, right, bottom) rows, NaN for empty polygons.
+        """
+        bounds = np.full((len(self), 4), np.nan)
+        nonempty = np.diff(self.offsets) > 0
+        if nonempty.any():
+            starts = self.offsets[:-1][nonempty]
+            bounds[nonempty, :2] = np.minimum.reduceat(self.vertices, starts)
+            bounds[nonempty, 2:] = np.maximum.reduceat(self.vertices, starts)
+        return bounds
+
+    def contains(self, points):
+        """
+        Tests which points are inside which polygons, by counting the crossings
+        of a ray from every point with the edges of the polygons.
+
+        :param points: The (x, y) points, an array or a list of pairs.
+        :return: A boolean matrix with a row per polygon and a column per point.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x1, y1 = self.vertices[:, 0, None], self.vertices[:, 1, None]
+        x2 = self.vertices[self.next_vertices, 0, None]
+        y2 = self.vertices[self.next_vertices, 1, None]
+        px, py = points[None, :, 0], points[None, :, 1]
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        crossings = (straddles & (px < crossing_x)).astype(np.int32)
+        inside = np.zeros((len(self), len(points)), dtype=bool)
+        nonempty = np.diff(self.offsets) > 0
+        if nonempty.any():
+            inside[nonempty] = np.add.reduceat(
+                crossings, self.offsets[:-1][nonempty], axis=0) % 2 == 1
+        return inside
+
+    def clip(self, region=FRAME):
+        """
+        Clips every polygon to a convex region, one region edge at a time
+        (Sutherland-Hodgman), all the polygons at once.
+
+        :param region: The convex region, the whole frame by default.
+        :return: A new PolygonSet, in which polygons outside the region are empty.
+        """
+        region = region_vertices(region)
+        # Inside is to the right of the edges for a clockwise region on the frame.
+        signed = np.sum(region[:, 0] * np.roll(region[:, 1], -1)
+                        - np.roll(region[:, 0], -1) * region[:, 1])
+        orientation = 1.0 if signed >= 0 else -1.0
+        vertices, offsets = self.vertices, self.offsets
+        for start, end in zip(region, np.roll(region, -1, axis=0)):
+            clipped = PolygonSet(vertices, offsets)
+            following = clipped.next_vertices
+            edge = end - start
+            side = orientation * (edge[0] * (vertices[:, 1] - start[1])
+                                  - edge[1] * (vertices[:, 0] - start[0]))
+            inside = side >= 0
+            crosses = inside != inside[following]
+            # Every vertex is followed by the crossing of its edge, if any.
+            counts = inside.astype(np.int64) + crosses
+            positions = np.cumsum(counts) - counts
+            output = np.empty((int(counts.sum()), 2))
+            output[positions[inside]] = vertices[inside]
+            ratio = side[crosses] / (side[crosses] - side[following][crosses])
+            output[(positions + inside)[crosses]] = (
+                vertices[crosses]
+                + ratio[:, None] * (vertices[following][crosses] - vertices[crosses]))
+            offsets = np.concatenate(([0], np.cumsum(
+                np.bincount(clipped.vertex_polygons, weights=counts,
+                            minlength=len(self)).astype(np.int64))))
+            vertices = output
+        return PolygonSet(vertices, offsets)
+
+    def intersection_areas(self, region):
+        """
+        Gets the area of every polygon inside a convex region.
+
+        :param region: The convex region.
+        :return: The areas, in squared frame ratios.
+        """
+        return self.clip(region).areas()
+
+    def in_region(self, region, min_overlap=0.5):
+        """
+        Finds the polygons that are inside a convex region, such as the texts in
+        an area of the frame.
+
+        :param region: The convex region.
+        :param min_overlap: The smallest share of the area of a polygon that is
+                            inside the region; 0 selects every polygon that
+                            intersects it.
+        :return: A boolean mask of the polygons.
+        """
+        inside = self.intersection_areas(region)
+        if not min_overlap:
+            return inside > 0
+        areas = self.areas()
+        return np.divide(inside, areas, out=np.zeros_like(inside), where=areas > 0) >= min_overlap
+
+    def nbytes(self):
+        """The memory used by the arrays of the set, in bytes."""
+        return sum(array.nbytes for array in (
+            self.vertices, self.offsets, self.vertex_polygons, self.next_vertices))
@@ -6,11 +6,29 @@ import boto3
 from botocore.exceptions import ClientError
 from io import BytesIO
 import json
+import os
+
+from image_downscale import DownscalingLabelClient
+from image_hash import MultiIndexHashTable, NearDuplicateLabelClient
+from label_cache import LocalDiskLabelCache, cached_detect_labels
+from label_schema import make_label_item, write_label_items
 
 # Environment variables
 TABLE_NAME = 'Images2'
 REKOGNITION_CONFIDENCE='50'
 MAX_LABELS=49
+# Directory of the local DetectLabels cache, set to None to always call Rekognition
+LABEL_CACHE_DIR='.label_cache'
+LABEL_CACHE_TTL_DAYS=30
+LABEL_CACHE_MAX_ENTRIES=10000
+# File of the perceptual hash index of near-duplicate images, set to None to disable
+HASH_INDEX_FILE='.label_hash_index.json'
+HASH_RADIUS=4
+# Largest side of the images sent as Image.Bytes, set to None to send the S3 object reference
+IMAGE_MAX_DIMENSION=None
+# Where the results are written: dynamodb, or sqlite for a local database
+RESULTS_BACKEND = os.environ.get('RESULTS_BACKEND', 'dynamodb')
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', 'results.db')
 
 
 
@@ -66,59 +84,78 @@ def find_values(id, json_repr):
     return results
 
 
-#Load the images and labels into the DynamoDB table you created.
-def load_data(image_labels, dynamodb=None):
+# SQLite results store, opened on first use when RESULTS_BACKEND is sqlite
+results_store = None
+
+
+def get_results_store():
+    """
+    Opens the SQLite results store on first use.
+
+    :return: The SQLiteResultsStore.
+    """
+    global results_store
+    if results_store is None:
+        from results_store import SQLiteResultsStore
+        results_store = SQLiteResultsStore(RESULTS_DB_PATH)
+    return results_store
+
+
+#Load the label items of an image into the DynamoDB table you created, one item per label.
+def load_data(label_items, dynamodb=None):
+
+    if RESULTS_BACKEND == 'sqlite':
+        store = get_results_store()
+        for item in label_items:
+            store.put_label(item)
+        return len(label_items)
 
     if not dynamodb:
         dynamodb = boto3.resource('dynamodb')
 
     table = dynamodb.Table(TABLE_NAME)
 
-    print("Adding image details:", image_labels)
+    print("Adding {} label items".format(len(label_items)))
     try:
-        put_item_response = table.put_item(Item=image_labels)
-        return put_item_response
+        return write_label_items(table, label_items)
 
     except ClientError as error:
-        return error.response
+        print(error.response['Error'])
+        return 0
     
 
 
 
-def detect_labels(bucket_name, file_name):
+def detect_labels(bucket_name, file_name, label_cache=None, hash_index=None):
 
-    # get the labels for the image by calling DetectLabels from Rekognition
+    # get the labels for the image from the cache, from a near-duplicate image,
+    # or by calling DetectLabels from Rekognition
     client = boto3.client('rekognition')
-    response = client.detect_labels(
-        Image={'S3Object': {'Bucket': bucket_name, 
-                            'Name': file_name}},
-                            MaxLabels=MAX_LABELS
-                            # Uncomment to use image properties and filtration settings
-                            #Features=["GENERAL_LABELS", "IMAGE_PROPERTIES"],
-                            #Settings={"GeneralLabels": {"LabelInclusionFilters":["Person"]},
-                            # "ImageProperties": {"MaxDominantColors":10}}
-                            ,MinConfidence=int(REKOGNITION_CONFIDENCE))
+    if hash_index is not None:
+        client = NearDuplicateLabelClient(client, boto3.client('s3'), hash_index)
+    if IMAGE_MAX_DIMENSION:
+        client = DownscalingLabelClient(client, boto3.client('s3'), IMAGE_MAX_DIMENSION)
+    etag = None
+    if label_cache is not None:
+        etag = boto3.client('s3').head_object(Bucket=bucket_name, Key=file_name)['ETag']
+    labels = cached_detect_labels(
+        label_cache,
+        client,
+        {'S3Object': {'Bucket': bucket_name, 
+                      'Name': file_name}},
+        etag,
+        MAX_LABELS,
+        int(REKOGNITION_CONFIDENCE))
+        # Pass features and settings to use image properties and filtration settings
+        #features=["GENERAL_LABELS", "IMAGE_PROPERTIES"],
+        #settings={"GeneralLabels": {"LabelInclusionFilters":["Person"]},
+        # "ImageProperties": {"MaxDominantColors":10}}
 
     print('Detected labels for ' + file_name)
     
     image_name = file_name
-    for label in response['Labels']:
-        for category in label['Categories']:
-                labels_dict = {}
-                labels_dict["Image"] = str(image_name)
-                labels_dict["Label_Name"] = str(label['Name'])
-                labels_dict["Label_Confidence"] = int(label['Confidence'])
-                labels_dict["Label_Category"] = str(category['Name'])
-                if len(label['Aliases']) >= 1:
-                    for alias in label['Aliases']:
-                        labels_dict["Label_Aliases"] = str(alias['Name'])
-                        load_data(labels_dict)
-                else:
-                    labels_dict["Label_Aliases"] = ''
-                    load_data(labels_dict)
-
-                #print(labels_dict)
-                #load_data(labels_dict)
+    # One item per label, carrying all of its categories, aliases, parents and instances
+    load_data([make_label_item(image_name, label) for label in labels])
 
 
 
@@ -163,7 +200,7 @@ def detect_labels(bucket_name, file_name):
         print()
         '''
     
-    return len(response['Labels'])
+    return len(labels)
 
 
 
@@ -179,8 +216,25 @@ def main():
     #bucket = sys.argv[2]
     #bucket = 'rov-rekogntion-dev-inboundvideos3bucketb6f542e1-u2putp35h3or'
     bucket = 'detectlabels-rekogntion-inboundimagess3bucket406-1i19ijeeaczd0'
-    label_count = detect_labels(bucket, photo)
+    label_cache = None
+    if LABEL_CACHE_DIR:
+        label_cache = LocalDiskLabelCache(LABEL_CACHE_DIR,
+                                          ttl_seconds=LABEL_CACHE_TTL_DAYS * 24 * 60 * 60,
+                                          max_entries=LABEL_CACHE_MAX_ENTRIES)
+    hash_index = None
+    if HASH_INDEX_FILE:
+        if os.path.exists(HASH_INDEX_FILE):
+            hash_index = MultiIndexHashTable.load(HASH_INDEX_FILE)
+        else:
+            hash_index = MultiIndexHashTable(HASH_RADIUS)
+    label_count = detect_labels(bucket, photo, label_cache, hash_index)
     print("Labels detected: " + str(label_count))
+    if hash_index is not None:
+        hash_index.save(HASH_INDEX_FILE)
+    if label_cache is not None:
+        print("Label cache stats: " + str(label_cache.stats.to_dict()))
+    if results_store is not None:
+        results_store.close()
     
 
     
@@ -0,0 +1,136 @@
+"""
+Purpose
+
+Client-side downscaling of images before they are sent to Amazon Rekognition
+DetectLabels as Image.Bytes. Large photos are fetched from Amazon S3, decoded at
+a reduced scale (JPEG draft mode) and re-encoded to fit a maximum dimension and
+the 5 MB limit of Image.Bytes, which lowers the API latency and avoids failures
+on oversized images.
+
+Rekognition returns bounding boxes as ratios of the image size, and the image is
+resized proportionally, so the boxes are mapped back to pixel coordinates of the
+original image.
+
+Images that Pillow can't decode, such as formats it doesn't support or images
+above its decompression bomb limit, are sent as before, as the S3 object
+reference or the original bytes, and Rekognition decides whether it can read
+them.
+"""
+
+import io
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Errors of images that can't be decoded or re-encoded, UnidentifiedImageError
+# among them
+DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+# Largest Image.Bytes payload accepted by Rekognition
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_DIMENSION = 1920
+DEFAULT_QUALITY = 90
+
+
+def downscale_image(image_bytes, max_dimension=DEFAULT_MAX_DIMENSION, quality=DEFAULT_QUALITY):
+    """
+    Downscales an image so that its largest side is at most max_dimension and its
+    encoded size fits Image.Bytes. Images that already fit are returned unchanged.
+
+    :param image_bytes: The encoded image.
+    :param max_dimension: The maximum width and height of the result, in pixels.
+    :param quality: The JPEG quality of the re-encoded image.
+    :return: The image bytes to send and the (width, height) of the original image.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    original_size = image.size
+    if (max(original_size) <= max_dimension and len(image_bytes) <= MAX_IMAGE_BYTES
+            and image.format in ('JPEG', 'PNG')):
+        return image_bytes, original_size
+
+    exif = image.info.get('exif')
+    # thumbnail() decodes JPEG images in draft mode, at the smallest scale that
+    # is still larger than the requested size.
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    while True:
+        output = io.BytesIO()
+        save_kwargs = {'format': 'JPEG', 'quality': quality}
+        if exif:
+            # Keep the orientation tag, so Rekognition sees the image as before.
+            save_kwargs['exif'] = exif
+        image.save(output, **save_kwargs)
+        if output.tell() <= MAX_IMAGE_BYTES or quality <= 50:
+            break
+        quality -= 10
+    logger.info("Downscaled image from %s (%s bytes) to %s (%s bytes).",
+                original_size, len(image_bytes), image.size, output.tell())
+    return output.getvalue(), original_size
+
+
+def to_pixel_box(bounding_box, image_size):
+    """
+    Maps a Rekognition bounding box to pixel coordinates of an image.
+
+    :param bounding_box: A BoundingBox dict with Left, Top, Width and Height ratios.
+    :param image_size: The (width, height) of the image.
+    :return: A dict with Left, Top, Width and Height in pixels.
+    """
+    width, height = image_size
+    return {
+        'Left': round(bounding_box['Left'] * width),
+        'Top': round(bounding_box['Top'] * height),
+        'Width': round(bounding_box['Width'] * width),
+        'Height': round(bounding_box['Height'] * height)}
+
+
+class DownscalingLabelClient:
+    """
+    Wraps a Rekognition client so that detect_labels fetches S3 images, sends
+    them downscaled as Image.Bytes, and adds a PixelBoundingBox in original image
+    coordinates to every label instance.
+    """
+    def __init__(self, rekognition_client, s3_client, max_dimension=DEFAULT_MAX_DIMENSION):
+        """
+        Initializes the client.
+
+        :param rekognition_client: A Boto3 Rekognition client, or a client wrapper
+                                   with the same detect_labels function.
+        :param s3_client: A Boto3 S3 client.
+        :param max_dimension: The maximum width and height of the sent image.
+        """
+        self.rekognition_client = rekognition_client
+        self.s3_client = s3_client
+        self.max_dimension = max_dimension
+
+    def detect_labels(self, **request):
+        """
+        Gets the labels of an image, with the same parameters as the Boto3
+        Rekognition detect_labels function. An image that can't be decoded is
+        sent unchanged, without PixelBoundingBox.
+
+        :return: The DetectLabels response.
+        """
+        image = request['Image']
+        if 'S3Object' in image:
+            s3_object = image['S3Object']
+            image_bytes = self.s3_client.get_object(
+                Bucket=s3_object['Bucket'], Key=s3_object['Name'])['Body'].read()
+        else:
+            image_bytes = image['Bytes']
+        try:
+            image_bytes, original_size = downscale_image(image_bytes, self.max_dimension)
+        except DECODE_ERRORS as error:
+            logger.warning("Couldn't downscale the image, sending it unchanged: %s", error)
+            return self.rekognition_client.detect_labels(**request)
+
+        response = self.rekognition_client.detect_labels(
+            **dict(request, Image={'Bytes': image_bytes}))
+        for label in response['Labels']:
+            for instance in label.get('Instances', []):
+                instance['PixelBoundingBox'] = to_pixel_box(
+                    instance['BoundingBox'], original_size)
+        return response
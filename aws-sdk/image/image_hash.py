@@ -0,0 +1,315 @@
+"""
+Purpose
+
+Perceptual hashing of images and near-duplicate lookup, so that burst shots and
+re-exported copies of an image reuse the labels of the first copy instead of
+calling Amazon Rekognition DetectLabels again.
+
+Images are hashed with a 64-bit difference hash (dHash). Near matches within a
+Hamming radius r are found with a multi-index hash table: the hash is split into
+r + 1 chunks, and by the pigeonhole principle any hash within distance r shares at
+least one chunk exactly with the query. Candidates are then checked with a
+vectorized Hamming distance.
+"""
+
+import hashlib
+import io
+import json
+import logging
+
+import numpy as np
+from PIL import Image
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+DEFAULT_RADIUS = 4
+
+# Number of set bits of every byte value, used to count the bits of uint64 arrays
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def image_to_pixels(image_bytes):
+    """
+    Decodes an image into the small grayscale thumbnail used by dHash.
+
+    :param image_bytes: The encoded image.
+    :return: An int16 array of shape (HASH_SIZE, HASH_SIZE + 1).
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG images are decoded at a reduced scale, which is much faster than a full decode.
+    image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+    image = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    return np.asarray(image, dtype=np.int16)
+
+
+def dhash_pixels(pixels):
+    """
+    Computes the dHash of one or more thumbnails. Each bit tells whether a pixel
+    is brighter than its left neighbour.
+
+    :param pixels: An array of shape (..., HASH_SIZE, HASH_SIZE + 1).
+    :return: A uint64 array of shape (...) with the hashes.
+    """
+    bits = pixels[..., :, 1:] > pixels[..., :, :-1]
+    packed = np.packbits(bits.reshape(bits.shape[:-2] + (HASH_SIZE * HASH_SIZE,)), axis=-1)
+    return packed.view('>u8')[..., 0].astype(np.uint64)
+
+
+def dhash(image_bytes):
+    """
+    Computes the dHash of an encoded image.
+
+    :param image_bytes: The encoded image.
+    :return: The 64-bit hash, as an int.
+    """
+    return int(dhash_pixels(image_to_pixels(image_bytes)))
+
+
+def hamming_distances(hash_value, hashes):
+    """
+    Computes the Hamming distance between a hash and an array of hashes.
+
+    :param hash_value: The hash to compare.
+    :param hashes: A uint64 array of hashes.
+    :return: An int array with the number of differing bits of each hash.
+    """
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(hash_value))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def split_chunks(hash_value, num_chunks):
+    """
+    Splits a 64-bit hash into contiguous bit chunks of nearly equal width.
+
+    :param hash_value: The hash to split.
+    :param num_chunks: The number of chunks.
+    :return: The list of chunk values.
+    """
+    width, remainder = divmod(HASH_SIZE * HASH_SIZE, num_chunks)
+    chunks = []
+    shift = 0
+    for index in range(num_chunks):
+        chunk_width = width + (1 if index < remainder else 0)
+        chunks.append((hash_value >> shift) & ((1 << chunk_width) - 1))
+        shift += chunk_width
+    return chunks
+
+
+class MultiIndexHashTable:
+    """In-memory multi-index hash table of image hashes and their labels."""
+    def __init__(self, radius=DEFAULT_RADIUS):
+        """
+        Initializes an empty table.
+
+        :param radius: The largest Hamming distance that counts as a near duplicate.
+        """
+        self.radius = radius
+        self.num_chunks = radius + 1
+        self._tables = [{} for _ in range(self.num_chunks)]
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._labels = []
+
+    def __len__(self):
+        return len(self._labels)
+
+    def add(self, hash_value, labels, namespace=''):
+        """
+        Adds the labels of a hash.
+
+        :param hash_value: The image hash.
+        :param labels: The Labels list of a DetectLabels response.
+        :param namespace: Separates the entries of different request parameters.
+        """
+        entry_id = len(self._labels)
+        if entry_id == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[entry_id] = hash_value
+        self._labels.append(labels)
+        for table, chunk in zip(self._tables, split_chunks(hash_value, self.num_chunks)):
+            table.setdefault((namespace, chunk), []).append(entry_id)
+
+    def query(self, hash_value, namespace=''):
+        """
+        Finds the closest stored hash within the radius.
+
+        :param hash_value: The image hash.
+        :param namespace: Separates the entries of different request parameters.
+        :return: The distance and labels of the closest match, or None.
+        """
+        candidates = set()
+        for table, chunk in zip(self._tables, split_chunks(hash_value, self.num_chunks)):
+            candidates.update(table.get((namespace, chunk), ()))
+        if not candidates:
+            return None
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        distances = hamming_distances(hash_value, self._hashes[ids])
+        best = int(distances.argmin())
+        if distances[best] > self.radius:
+            return None
+        return int(distances[best]), self._labels[ids[best]]
+
+    def save(self, path):
+        """
+        Saves the table to a JSON file.
+
+        :param path: The path of the file.
+        """
+        namespaces = {}
+        for (namespace, _), entry_ids in self._tables[0].items():
+            for entry_id in entry_ids:
+                namespaces[entry_id] = namespace
+        with open(path, 'w') as fp:
+            json.dump({
+                'radius': self.radius,
+                'entries': [
+                    {'hash': format(int(self._hashes[entry_id]), '016x'),
+                     'namespace': namespaces[entry_id],
+                     'labels': labels}
+                    for entry_id, labels in enumerate(self._labels)]}, fp)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a table saved with save().
+
+        :param path: The path of the file.
+        :return: The MultiIndexHashTable.
+        """
+        with open(path) as fp:
+            data = json.load(fp)
+        table = cls(data['radius'])
+        for entry in data['entries']:
+            table.add(int(entry['hash'], 16), entry['labels'], entry['namespace'])
+        return table
+
+
+class DynamoDBHashIndex:
+    """
+    Multi-index hash table stored in an Amazon DynamoDB table whose partition key
+    is Chunk and whose sort key is Image_Hash. Every hash is written once per
+    chunk, so a lookup is one Query per chunk.
+    """
+    def __init__(self, table, radius=DEFAULT_RADIUS):
+        """
+        Initializes the index.
+
+        :param table: A Boto3 DynamoDB Table resource.
+        :param radius: The largest Hamming distance that counts as a near duplicate.
+        """
+        self.table = table
+        self.radius = radius
+        self.num_chunks = radius + 1
+
+    def _chunk_keys(self, hash_value, namespace):
+        return ['{}#{}:{:x}'.format(namespace, index, chunk)
+                for index, chunk in enumerate(split_chunks(hash_value, self.num_chunks))]
+
+    def add(self, hash_value, labels, namespace=''):
+        """
+        Adds the labels of a hash.
+
+        :param hash_value: The image hash.
+        :param labels: The Labels list of a DetectLabels response.
+        :param namespace: Separates the entries of different request parameters.
+        """
+        labels_json = json.dumps(labels)
+        try:
+            with self.table.batch_writer() as batch:
+                for chunk_key in self._chunk_keys(hash_value, namespace):
+                    batch.put_item(Item={
+                        'Chunk': chunk_key,
+                        'Image_Hash': format(hash_value, '016x'),
+                        'Labels': labels_json})
+        except ClientError:
+            logger.warning("Couldn't add hash %016x to the index.", hash_value, exc_info=True)
+
+    def query(self, hash_value, namespace=''):
+        """
+        Finds the closest stored hash within the radius.
+
+        :param hash_value: The image hash.
+        :param namespace: Separates the entries of different request parameters.
+        :return: The distance and labels of the closest match, or None.
+        """
+        candidates = {}
+        try:
+            for chunk_key in self._chunk_keys(hash_value, namespace):
+                query_kwargs = {'KeyConditionExpression': Key('Chunk').eq(chunk_key)}
+                while True:
+                    response = self.table.query(**query_kwargs)
+                    for item in response['Items']:
+                        candidates[int(item['Image_Hash'], 16)] = item['Labels']
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except ClientError:
+            logger.warning("Couldn't query the index for %016x.", hash_value, exc_info=True)
+            return None
+        if not candidates:
+            return None
+        hashes = list(candidates)
+        distances = hamming_distances(hash_value, np.array(hashes, dtype=np.uint64))
+        best = int(distances.argmin())
+        if distances[best] > self.radius:
+            return None
+        return int(distances[best]), json.loads(candidates[hashes[best]])
+
+
+class NearDuplicateLabelClient:
+    """
+    Wraps a Rekognition client so that detect_labels reuses the labels of a near
+    duplicate image when the index has one, and calls Rekognition otherwise.
+    """
+    def __init__(self, rekognition_client, s3_client, index):
+        """
+        Initializes the client.
+
+        :param rekognition_client: A Boto3 Rekognition client.
+        :param s3_client: A Boto3 S3 client, used to fetch images to hash.
+        :param index: A MultiIndexHashTable or DynamoDBHashIndex.
+        """
+        self.rekognition_client = rekognition_client
+        self.s3_client = s3_client
+        self.index = index
+        self.reused = 0
+        self.called = 0
+
+    def _image_bytes(self, image):
+        if 'Bytes' in image:
+            return image['Bytes']
+        s3_object = image['S3Object']
+        response = self.s3_client.get_object(Bucket=s3_object['Bucket'], Key=s3_object['Name'])
+        return response['Body'].read()
+
+    def detect_labels(self, **request):
+        """
+        Gets the labels of an image, with the same parameters as the Boto3
+        Rekognition detect_labels function.
+
+        :return: A dict with the Labels list.
+        """
+        # Labels are only reused between requests with the same parameters.
+        parameters = {name: value for name, value in request.items() if name != 'Image'}
+        namespace = hashlib.md5(
+            json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        hash_value = None
+        try:
+            hash_value = dhash(self._image_bytes(request['Image']))
+        except (OSError, ClientError):
+            logger.warning("Couldn't hash image, calling Rekognition.", exc_info=True)
+        if hash_value is not None:
+            match = self.index.query(hash_value, namespace)
+            if match is not None:
+                distance, labels = match
+                self.reused += 1
+                logger.info("Reusing labels of a near duplicate at distance %s.", distance)
+                return {'Labels': labels}
+
+        self.called += 1
+        response = self.rekognition_client.detect_labels(**request)
+        if hash_value is not None:
+            self.index.add(hash_value, response['Labels'], namespace)
+        return response
@@ -0,0 +1,337 @@
+"""
+Purpose
+
+Writes the results of the Amazon Rekognition Video jobs to the results table.
+JOB_WRITERS maps the API field of the SNS completion message, such as
+StartLabelDetection, to the get function, the key of the results in its
+response, the extractor that wraps a result in its rekognition_objects class and
+the item builder that renders it as an attribute. Every job type shares the same
+path: pages are fetched ahead while the current one is converted, and results are
+collected into items of bounded size.
+
+Items are keyed on the job tag. A text detection item has the job tag as id and
+the items of the other job types job_tag#job_type. A job whose results don't fit
+in one item gets more items, with #1, #2 and so on appended. A job tag can't
+contain #, so the job tag of an item is the part of its id before the first #.
+
+Every result is an attribute of an item. Texts are keyed on the detected text, so
+a text has one attribute per job, as before chunking. The results of the other
+job types are keyed on their timestamp, and on the name, index or position that
+tells apart the results of one timestamp, so every detection is kept.
+"""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from decimal import Decimal
+from operator import attrgetter
+
+from rekognition_objects import (
+    RekognitionCelebrity, RekognitionFace, RekognitionLabel, RekognitionModerationLabel,
+    RekognitionPerson, RekognitionText)
+
+logger = logging.getLogger(__name__)
+
+TEXT_DETECTION = 'text_detection'
+# Estimated item size at which a chunk is written, below the 400 KB item limit
+DEFAULT_CHUNK_MAX_BYTES = 350000
+# Bytes DynamoDB adds for a map attribute
+MAP_OVERHEAD_BYTES = 3
+# Values that to_item_value returns unchanged
+_ITEM_SCALARS = (str, int, bool, Decimal, type(None))
+
+# result_key gets the attribute key of a result for job types whose results
+# share keys, so a result is only rendered when its key is new or when its item is
+# written.
+JobWriter = namedtuple(
+    'JobWriter',
+    ['job_type', 'get_results', 'response_key', 'extractor', 'item_builder', 'result_key'],
+    defaults=[None])
+
+
+def text_attribute(text):
+    return text.text, text.to_dict_compact()
+
+
+def label_attribute(label):
+    rendering = label.to_dict()
+    rendering['confidence'] = label.confidence
+    if label.parents:
+        rendering['parents'] = [parent['Name'] for parent in label.parents]
+    return '{}#{}'.format(label.name, label.timestamp), rendering
+
+
+def face_attribute(face):
+    # Faces of a video have no identity, so they are keyed on time and position.
+    box = face.bounding_box or {}
+    rendering = face.to_dict()
+    rendering['confidence'] = face.confidence
+    return '{}#{:.4f}#{:.4f}'.format(
+        face.timestamp, box.get('Left', 0), box.get('Top', 0)), rendering
+
+
+def person_attribute(person):
+    return '{}#{}'.format(person.index, person.timestamp), person.to_dict()
+
+
+def celebrity_attribute(celebrity):
+    rendering = celebrity.to_dict()
+    rendering['confidence'] = celebrity.confidence
+    return '{}#{}'.format(celebrity.name, celebrity.timestamp), rendering
+
+
+def moderation_attribute(label):
+    rendering = label.to_dict()
+    rendering['confidence'] = label.confidence
+    return '{}#{}'.format(label.name, label.timestamp), rendering
+
+
+# API of the SNS completion message: how the results of the job are written
+JOB_WRITERS = {
+    'StartTextDetection': JobWriter(
+        TEXT_DETECTION, 'get_text_detection', 'TextDetections',
+        lambda result: RekognitionText(result['TextDetection'], result['Timestamp']),
+        text_attribute, attrgetter('text')),
+    'StartLabelDetection': JobWriter(
+        'label_detection', 'get_label_detection', 'Labels',
+        lambda result: RekognitionLabel(result['Label'], result['Timestamp']),
+        label_attribute),
+    'StartFaceDetection': JobWriter(
+        'face_detection', 'get_face_detection', 'Faces',
+        lambda result: RekognitionFace(result['Face'], result['Timestamp']),
+        face_attribute),
+    'StartPersonTracking': JobWriter(
+        'person_tracking', 'get_person_tracking', 'Persons',
+        lambda result: RekognitionPerson(result['Person'], result['Timestamp']),
+        person_attribute),
+    'StartCelebrityRecognition': JobWriter(
+        'celebrity_recognition', 'get_celebrity_recognition', 'Celebrities',
+        lambda result: RekognitionCelebrity(result['Celebrity'], result['Timestamp']),
+        celebrity_attribute),
+    'StartContentModeration': JobWriter(
+        'content_moderation', 'get_content_moderation', 'ModerationLabels',
+        lambda result: RekognitionModerationLabel(result['ModerationLabel'], result['Timestamp']),
+        moderation_attribute),
+}
+
+
+def to_item_value(value):
+    """Converts the floats of a value, also nested ones, to Decimals for DynamoDB."""
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    # Strings and numbers are kept without a call per value.
+    if isinstance(value, dict):
+        return {name: item if isinstance(item, _ITEM_SCALARS) else to_item_value(item)
+                for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [item if isinstance(item, _ITEM_SCALARS) else to_item_value(item)
+                for item in value]
+    return value
+
+
+def item_id(job_tag, job_type, chunk=0):
+    """
+    Gets the id of an item of a job.
+
+    :param job_tag: The job tag.
+    :param job_type: The job type, such as label_detection.
+    :param chunk: The number of the item among the items of the job.
+    :return: The id.
+    """
+    parts = [job_tag]
+    if job_type != TEXT_DETECTION:
+        parts.append(job_type)
+    if chunk:
+        parts.append(str(chunk))
+    return '#'.join(parts)
+
+
+def iter_result_pages(get_page, prefetch=True):
+    """
+    Gets the pages of results of a completed job. The first page is fetched on
+    the calling thread. With prefetch, and only when there is a next page, the
+    request of the next page is sent in a background thread as soon as the
+    NextToken of the current page is known, so it is in flight while the current
+    page is processed. At most two pages are held at a time.
+
+    :param get_page: A function that takes a NextToken, None for the first page,
+                     and returns the results of the page and the next NextToken.
+    :param prefetch: Whether to fetch the next page in a background thread.
+    :return: A generator of the results of every page.
+    """
+    results, next_token = get_page(None)
+    if not prefetch or next_token is None:
+        yield results
+        while next_token is not None:
+            results, next_token = get_page(next_token)
+            yield results
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while next_token is not None:
+            future = executor.submit(get_page, next_token)
+            yield results
+            results, next_token = future.result()
+        yield results
+
+
+def attribute_size(key, attribute):
+    """
+    Estimates the size of an attribute from its key and value rendered once as a
+    string, which holds the names and values DynamoDB counts plus some
+    punctuation, so the estimate errs on the large side.
+
+    :param key: The attribute name.
+    :param attribute: The dict rendering of the result.
+    :return: The estimated size in bytes.
+    """
+    rendered = key + str(attribute)
+    size = len(rendered) if rendered.isascii() else len(rendered.encode('utf-8'))
+    return size + MAP_OVERHEAD_BYTES
+
+
+class ChunkWriter:
+    """
+    Collects the attributes of a job into items of bounded size. An attribute key
+    is written once per job: a repeated key replaces the attribute while its item
+    is still being collected, and is skipped once its item has been written.
+    """
+    def __init__(self, job_tag, job_type, put_item, max_bytes=DEFAULT_CHUNK_MAX_BYTES,
+                 item_builder=None, result_key=None):
+        """
+        :param job_tag: The job tag.
+        :param job_type: The job type, such as text_detection.
+        :param put_item: The function that writes an item.
+        :param max_bytes: The estimated item size at which a chunk is written.
+        :param item_builder: The function that renders a result object as a key
+                             and an attribute, used by add_results().
+        :param result_key: The function that gets the key of a result object
+                           without rendering it, or None.
+        """
+        self.job_tag = job_tag
+        self.job_type = job_type
+        self.put_item = put_item
+        self.max_bytes = max_bytes
+        self.item_builder = item_builder
+        self.result_key = result_key
+        self.chunks_written = 0
+        # Estimated size of every item written, and their sum
+        self.item_sizes = []
+        self.bytes_written = 0
+        self._chunk = {}
+        self._size = 0
+        # Latest result of every key of the current chunk replaced since its
+        # attribute was rendered
+        self._latest = {}
+        # Keys of the attributes of the chunks already written
+        self._written = set()
+
+    def add(self, key, attribute):
+        """
+        Adds an attribute. Its size is estimated once, when its key is first
+        added. A replacement, such as a text seen on many frames, keeps that
+        estimate: the renderings of one key differ by a few bytes, well within
+        the margin between DEFAULT_CHUNK_MAX_BYTES and the item limit.
+
+        :param key: The attribute name, such as the detected text.
+        :param attribute: The dict rendering of the result.
+        """
+        chunk = self._chunk
+        if key in chunk:
+            chunk[key] = attribute
+            return
+        if key in self._written:
+            return
+        size = attribute_size(key, attribute)
+        if chunk and self._size + size > self.max_bytes:
+            self.flush()
+            chunk = self._chunk
+        chunk[key] = attribute
+        self._size += size
+
+    def add_results(self, results):
+        """
+        Adds result objects, rendered with item_builder. With result_key, a
+        result whose key is in the current chunk is only kept, and the last one
+        of every key is rendered when the chunk is written.
+
+        :param results: An iterable of result objects.
+        """
+        if self.result_key is None:
+            for key, attribute in map(self.item_builder, results):
+                self.add(key, attribute)
+            return
+        result_key = self.result_key
+        item_builder = self.item_builder
+        latest = self._latest
+        written = self._written
+        for result in results:
+            key = result_key(result)
+            if key in self._chunk:
+                latest[key] = result
+            elif key not in written:
+                self.add(*item_builder(result))
+
+    def flush(self):
+        """Writes the attributes of the current chunk as one item."""
+        chunk = self._chunk
+        if not chunk and self.chunks_written:
+            return
+        if self._latest:
+            for key, result in self._latest.items():
+                chunk[key] = self.item_builder(result)[1]
+            self._latest = {}
+        # Floats become Decimals only now, once per attribute that is written.
+        item = to_item_value(chunk)
+        item['id'] = item_id(self.job_tag, self.job_type, self.chunks_written)
+        item['job_type'] = self.job_type
+        logger.info("Writing item %s of %s results, about %s bytes.",
+                    item['id'], len(chunk), self._size)
+        self.put_item(item)
+        self.chunks_written += 1
+        self.item_sizes.append(self._size)
+        self.bytes_written += self._size
+        self._written.update(chunk)
+        self._chunk = {}
+        self._size = 0
+
+
+def write_job_results(job_writer, job_tag, get_page, put_item, prefetch=True,
+                      max_bytes=DEFAULT_CHUNK_MAX_BYTES, stage_timer=None, result_filter=None):
+    """
+    Writes the results of a completed job.
+
+    :param job_writer: The JobWriter of the job type.
+    :param job_tag: The job tag.
+    :param get_page: A function that takes a NextToken and returns the raw results
+                     of the page, the list under the response key, and the next
+                     NextToken.
+    :param put_item: The function that writes an item.
+    :param prefetch: Whether to fetch the next page while the current one is
+                     converted.
+    :param max_bytes: The estimated item size at which a chunk is written.
+    :param stage_timer: A function that takes a stage name and returns a context
+                        manager that times it, such as MetricsLogger.timer.
+    :param result_filter: An optional filter of the result objects, such as
+                          text_nms.TextSuppressor, with process(), which takes
+                          the results of a page and returns the ones to write,
+                          and finish(), which returns the results it still holds.
+    :return: The ChunkWriter, with the number of items written and their
+             estimated sizes.
+    """
+    writer = ChunkWriter(job_tag, job_writer.job_type, put_item, max_bytes,
+                         job_writer.item_builder, job_writer.result_key)
+    extractor = job_writer.extractor
+    # The fetch thread only returns the raw results, so it holds the GIL as
+    # little as possible; they are converted here, while the next page loads.
+    for results in iter_result_pages(get_page, prefetch):
+        with stage_timer('ParseMessage') if stage_timer else nullcontext():
+            converted = map(extractor, results)
+            if result_filter is not None:
+                converted = result_filter.process(list(converted))
+            writer.add_results(converted)
+    if result_filter is not None:
+        writer.add_results(result_filter.finish())
+    writer.flush()
+    return writer
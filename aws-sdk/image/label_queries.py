@@ -0,0 +1,192 @@
+"""
+Purpose
+
+Finds the images that have a label, most confident first, through the
+Label_Confidence_Index of the image labels table (see label_schema.py). The
+items of a label are spread over LABEL_SHARDS index partitions, so a query reads
+every shard in parallel, pages through each one in descending confidence, and
+merges the shards in confidence order.
+
+The low-level DynamoDB client is used, which is thread safe and avoids the
+deserialization cost of the resource API. Pass an endpoint URL to run against
+DynamoDB Local; create_local_table() creates a table with the key schema and the
+index of the stack there:
+
+    python label_queries.py TABLE Person --min-confidence 90
+    python label_queries.py TABLE Person --endpoint-url http://localhost:8000 \\
+        --create-local-table --load-sample 100000
+"""
+
+import argparse
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+from botocore.exceptions import ClientError
+
+from label_schema import LABEL_INDEX_NAME, LABEL_SHARDS, label_shard_key, label_shard_keys
+
+logger = logging.getLogger(__name__)
+
+# Items per Query page, each page of the keys-only index is well below 1 MB
+DEFAULT_PAGE_SIZE = 1000
+
+
+class LabelQuery:
+    """Queries the images of a label through the sharded confidence index."""
+    def __init__(self, dynamodb_client, table_name, shards=LABEL_SHARDS,
+                 index_name=LABEL_INDEX_NAME, max_workers=None):
+        """
+        Initializes the query API.
+
+        :param dynamodb_client: A Boto3 DynamoDB client.
+        :param table_name: The name of the image labels table.
+        :param shards: The number of index shards per label, as LABEL_SHARDS of
+                       the writers.
+        :param index_name: The name of the global secondary index.
+        :param max_workers: The number of shards read at the same time, all of
+                            them by default.
+        """
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.shards = shards
+        self.index_name = index_name
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or shards)
+
+    def _query_shard(self, shard_key, min_confidence, limit, page_size):
+        """
+        Reads one shard in descending confidence.
+
+        :return: A list of (-confidence, image) tuples, ready to be merged.
+        """
+        results = []
+        kwargs = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': 'Label_Shard = :shard AND Label_Confidence >= :min',
+            'ExpressionAttributeValues': {
+                ':shard': {'S': shard_key},
+                ':min': {'N': str(min_confidence)}},
+            'ProjectionExpression': 'Image, Label_Confidence',
+            'ScanIndexForward': False,
+            'Limit': page_size if limit is None else min(page_size, limit)}
+        while True:
+            response = self.client.query(**kwargs)
+            for item in response['Items']:
+                results.append((-float(item['Label_Confidence']['N']), item['Image']['S']))
+            if 'LastEvaluatedKey' not in response or (limit is not None and len(results) >= limit):
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return results
+
+    def images_with_label(self, label_name, min_confidence=0, limit=None,
+                          page_size=DEFAULT_PAGE_SIZE):
+        """
+        Gets the images that have a label.
+
+        :param label_name: The label name, such as Person.
+        :param min_confidence: The minimum confidence of the label.
+        :param limit: The number of images to return, or None for all of them.
+                      Every shard stops reading after this many images.
+        :param page_size: The number of items per Query request.
+        :return: A list of (image, confidence) tuples, most confident first.
+        """
+        futures = [
+            self.executor.submit(self._query_shard, shard_key, min_confidence, limit, page_size)
+            for shard_key in label_shard_keys(label_name, self.shards)]
+        try:
+            shard_results = [future.result() for future in futures]
+        except ClientError:
+            logger.exception("Couldn't query the images of %s.", label_name)
+            raise
+        merged = heapq.merge(*shard_results)
+        if limit is not None:
+            merged = (result for _, result in zip(range(limit), merged))
+        return [(image, -negative_confidence) for negative_confidence, image in merged]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def create_local_table(dynamodb_client, table_name):
+    """
+    Creates an image labels table with the key schema and the index of the stack,
+    for DynamoDB Local.
+
+    :param dynamodb_client: A Boto3 DynamoDB client.
+    :param table_name: The table name.
+    """
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'Image', 'KeyType': 'HASH'},
+                   {'AttributeName': 'Label_Name', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'Image', 'AttributeType': 'S'},
+            {'AttributeName': 'Label_Name', 'AttributeType': 'S'},
+            {'AttributeName': 'Label_Shard', 'AttributeType': 'S'},
+            {'AttributeName': 'Label_Confidence', 'AttributeType': 'N'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': LABEL_INDEX_NAME,
+            'KeySchema': [{'AttributeName': 'Label_Shard', 'KeyType': 'HASH'},
+                          {'AttributeName': 'Label_Confidence', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'}}],
+        BillingMode='PAY_PER_REQUEST')
+    dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def load_sample(dynamodb_resource, table_name, count, label_name, shards=LABEL_SHARDS):
+    """
+    Writes synthetic label items, to time queries against DynamoDB Local.
+
+    :param dynamodb_resource: A Boto3 DynamoDB resource.
+    :param table_name: The table name.
+    :param count: The number of images.
+    :param label_name: The label every image gets.
+    :param shards: The number of index shards per label.
+    """
+    table = dynamodb_resource.Table(table_name)
+    with table.batch_writer() as batch:
+        for index in range(count):
+            image = 'sample/{:08d}.jpg'.format(index)
+            batch.put_item(Item={
+                'Image': image,
+                'Label_Name': label_name,
+                'Label_Confidence': Decimal(str(round(50 + (index * 7919 % 5000) / 100, 2))),
+                'Label_Shard': label_shard_key(label_name, image, shards)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('table')
+    parser.add_argument('label')
+    parser.add_argument('--min-confidence', type=float, default=0)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--shards', type=int, default=LABEL_SHARDS)
+    parser.add_argument('--endpoint-url', help='for example http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--create-local-table', action='store_true')
+    parser.add_argument('--load-sample', type=int, metavar='IMAGES')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    client = boto3.client('dynamodb', endpoint_url=args.endpoint_url)
+    if args.create_local_table:
+        create_local_table(client, args.table)
+    if args.load_sample:
+        load_sample(boto3.resource('dynamodb', endpoint_url=args.endpoint_url),
+                    args.table, args.load_sample, args.label, args.shards)
+
+    query = LabelQuery(client, args.table, args.shards)
+    start = time.perf_counter()
+    images = query.images_with_label(args.label, args.min_confidence, args.limit)
+    elapsed = time.perf_counter() - start
+    query.close()
+    for image, confidence in images[:20]:
+        print('{:>7.2f}  {}'.format(confidence, image))
+    print("Found {} images with {} in {:.3f} s.".format(len(images), args.label, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""
+Purpose
+
+Local SQLite backend for the detection results, for offline review without
+access to Amazon DynamoDB. It takes the same items as the DynamoDB writers,
+the text item of write_results_text and the label item of detect_labels, and
+stores them as one row per detection.
+
+Rows have the keys of the DynamoDB items they come from: a text once per video,
+as the text attribute of the item of its job, and a label once per image, as
+the item keyed on Image and Label_Name. Video labels are stored as labels of the
+video, with their parent labels but without categories or aliases. Storing an
+item again replaces its rows, as PutItem does, instead of adding duplicates.
+
+The database runs in WAL mode, so queries can read while results are written.
+Rows are buffered and inserted with executemany in one transaction per batch.
+Unique indexes on (video, text) and (image, label) hold the keys, and indexes on
+(video, timestamp), (label, confidence) and image back the query helpers.
+
+Set the RESULTS_BACKEND environment variable to sqlite to use it from the
+handlers, and RESULTS_DB_PATH to choose the database file.
+"""
+
+import logging
+import sqlite3
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Page cache of the connection, negative values are in KiB
+CACHE_SIZE_KIB = 32 * 1024
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS text_detections (
+    video TEXT NOT NULL,
+    timestamp_ms INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    kind TEXT,
+    confidence REAL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    image TEXT NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL,
+    category TEXT,
+    alias TEXT,
+    parents TEXT
+);
+"""
+# Unique keys of the rows, kept while bulk loading so rows stay replaced
+KEYS = """
+CREATE UNIQUE INDEX IF NOT EXISTS text_detections_key ON text_detections (video, text);
+CREATE UNIQUE INDEX IF NOT EXISTS labels_key ON labels (image, label);
+"""
+# Keeps the last row of every key of a database created before the keys
+DEDUPLICATE = """
+DELETE FROM text_detections WHERE rowid NOT IN (
+    SELECT MAX(rowid) FROM text_detections GROUP BY video, text);
+DELETE FROM labels WHERE rowid NOT IN (SELECT MAX(rowid) FROM labels GROUP BY image, label);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS text_detections_video_timestamp
+    ON text_detections (video, timestamp_ms);
+CREATE INDEX IF NOT EXISTS labels_label_confidence ON labels (label, confidence);
+CREATE INDEX IF NOT EXISTS labels_image ON labels (image);
+"""
+DROP_INDEXES = """
+DROP INDEX IF EXISTS text_detections_video_timestamp;
+DROP INDEX IF EXISTS labels_label_confidence;
+DROP INDEX IF EXISTS labels_image;
+"""
+INSERT_TEXT = ("INSERT OR REPLACE INTO text_detections "
+               "(video, timestamp_ms, text, kind, confidence) VALUES (?, ?, ?, ?, ?)")
+INSERT_LABEL = ("INSERT OR REPLACE INTO labels "
+                "(image, label, confidence, category, alias, parents) VALUES (?, ?, ?, ?, ?, ?)")
+# Response returned by the put functions, shaped like a successful PutItem response
+PUT_RESPONSE = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+def parse_timestamp(timestamp):
+    """Parses the 0h:0m:0s timestamps written by RekognitionText.to_dict_compact()."""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    hours, minutes, seconds = (int(part[:-1]) for part in str(timestamp).split(':'))
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000
+
+
+def _number(value):
+    return float(value) if value is not None else None
+
+
+class SQLiteResultsStore:
+    """Stores detection results in a local SQLite database."""
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Opens the database and creates its tables and indexes.
+
+        :param path: The path of the database file.
+        :param batch_size: The number of buffered rows inserted per transaction.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, NORMAL only syncs at checkpoints and stays durable against
+        # application crashes.
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA cache_size=-{}'.format(CACHE_SIZE_KIB))
+        self.connection.executescript(TABLES)
+        self._add_parents_column()
+        self._create_keys()
+        self.connection.executescript(INDEXES)
+        self._texts = []
+        self._labels = []
+
+    def _add_parents_column(self):
+        # Databases created before the parents column get it, empty for their rows.
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(labels)')]
+        if 'parents' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE labels ADD COLUMN parents TEXT')
+
+    def _create_keys(self):
+        existing = self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' "
+            "AND name IN ('text_detections_key', 'labels_key')").fetchone()[0]
+        if existing < 2:
+            self.connection.executescript(DEDUPLICATE + KEYS)
+
+    def put_item(self, item):
+        """
+        Stores a results item, as written by write_results_text. Text detections
+        are stored as texts of the video and video label detections as labels of
+        the video, one row per label with its most confident detection of the
+        item; the items of the other job types are not stored.
+
+        :param item: A dict with the job tag as id, or job_tag#... for the items
+                     of other job types and the later chunks of a job, the
+                     job_type, and one dict per result.
+        :return: A PutItem shaped response dict.
+        """
+        video = item['id'].split('#', 1)[0]
+        job_type = item.get('job_type', 'text_detection')
+        results = ((key, value) for key, value in item.items() if isinstance(value, dict))
+        if job_type == 'text_detection':
+            self.add_texts(
+                (video, parse_timestamp(value['timestamp']), value.get('text', key),
+                 value.get('kind'), _number(value.get('Confidence', value.get('confidence'))))
+                for key, value in results)
+        elif job_type == 'label_detection':
+            # Labels are keyed on name#timestamp in the item, and on the name here.
+            labels = {}
+            for key, value in results:
+                row = (video, value.get('name', key.split('#', 1)[0]),
+                       _number(value.get('confidence')), '', '',
+                       ','.join(value.get('parents', [])))
+                if row[1] not in labels or (row[2] or 0) > (labels[row[1]][2] or 0):
+                    labels[row[1]] = row
+            self.add_labels(labels.values())
+        else:
+            logger.warning("Not storing the %s item %s.", job_type, item['id'])
+        self.flush()
+        return PUT_RESPONSE
+
+    def put_label(self, image_labels):
+        """
+        Stores a label item, as written by detect_labels. The categories,
+        aliases and parents of the label are stored comma-separated.
+
+        :param image_labels: A dict with Image, Label_Name, Label_Confidence,
+                             Label_Categories, Label_Aliases and Label_Parents
+                             lists, or the Label_Category and Label_Aliases
+                             strings of the earlier schema.
+        :return: A PutItem shaped response dict.
+        """
+        categories = image_labels.get('Label_Categories')
+        if categories is None:
+            categories = [image_labels.get('Label_Category') or '']
+        aliases = image_labels.get('Label_Aliases') or ''
+        if not isinstance(aliases, str):
+            aliases = ','.join(aliases)
+        self.add_labels([(
+            image_labels['Image'], image_labels['Label_Name'],
+            _number(image_labels.get('Label_Confidence')),
+            ','.join(categories), aliases, ','.join(image_labels.get('Label_Parents') or []))])
+        return PUT_RESPONSE
+
+    def add_texts(self, rows):
+        """
+        Buffers text detection rows, inserting them once a batch is full.
+
+        :param rows: An iterable of (video, timestamp_ms, text, kind, confidence).
+        """
+        self._add(self._texts, INSERT_TEXT, rows)
+
+    def add_labels(self, rows):
+        """
+        Buffers label rows, inserting them once a batch is full.
+
+        :param rows: An iterable of (image, label, confidence, category, alias,
+                     parents).
+        """
+        self._add(self._labels, INSERT_LABEL, rows)
+
+    def _add(self, buffer, statement, rows):
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= self.batch_size:
+                self._insert(statement, buffer)
+
+    def _insert(self, statement, buffer):
+        if buffer:
+            with self.connection:
+                self.connection.executemany(statement, buffer)
+            del buffer[:]
+
+    def flush(self):
+        """Inserts the buffered rows."""
+        self._insert(INSERT_TEXT, self._texts)
+        self._insert(INSERT_LABEL, self._labels)
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Drops the indexes while many rows are loaded and builds them again at the
+        end, which is several times faster than updating them on every insert.
+        """
+        self.flush()
+        self.connection.executescript(DROP_INDEXES)
+        try:
+            yield self
+        finally:
+            self.flush()
+            self.connection.executescript(INDEXES)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def texts_in_video(self, video, start_ms=None, end_ms=None):
+        """
+        Gets the texts of a video, optionally within a time range.
+
+        :param video: The video, the job tag of the text item.
+        :param start_ms: The start of the range, inclusive.
+        :param end_ms: The end of the range, exclusive.
+        :return: A list of (timestamp_ms, text) tuples, ordered by timestamp.
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT timestamp_ms, text FROM text_detections "
+            "WHERE video = ? AND timestamp_ms >= ? AND timestamp_ms < ? "
+            "ORDER BY timestamp_ms",
+            (video, start_ms if start_ms is not None else -1,
+             end_ms if end_ms is not None else 2 ** 62)).fetchall()
+
+    def videos_with_text(self, text):
+        """
+        Gets the videos in which a text was detected.
+
+        :param text: The exact text.
+        :return: A list of (video, first timestamp_ms) tuples.
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT video, MIN(timestamp_ms) FROM text_detections WHERE text = ? "
+            "GROUP BY video ORDER BY video", (text,)).fetchall()
+
+    def images_with_label(self, label, min_confidence=0):
+        """
+        Gets the images that have a label, most confident first.
+
+        :param label: The label name.
+        :param min_confidence: The minimum confidence of the label.
+        :return: A list of (image, confidence) tuples.
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT DISTINCT image, confidence FROM labels "
+            "WHERE label = ? AND confidence >= ? ORDER BY confidence DESC",
+            (label, min_confidence)).fetchall()
+
+    def labels_of_image(self, image):
+        """
+        Gets the labels of an image.
+
+        :param image: The image name.
+        :return: A list of (label, confidence, category, alias, parents) tuples,
+                 most confident first.
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT label, confidence, category, alias, parents FROM labels WHERE image = ? "
+            "ORDER BY confidence DESC", (image,)).fetchall()
+
+    def label_counts(self, limit=20):
+        """
+        Gets the labels found on the most images.
+
+        :param limit: The number of labels to return.
+        :return: A list of (label, image count) tuples.
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT label, COUNT(DISTINCT image) AS images FROM labels "
+            "GROUP BY label ORDER BY images DESC LIMIT ?", (limit,)).fetchall()
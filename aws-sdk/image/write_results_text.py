@@ -8,9 +8,8 @@ import boto3
 from botocore.exceptions import ClientError
 import os
 import logging
-import sys
 from decimal import Decimal
-from rekognition_objects import (RekognitionText, RekognitionLabel)
+from job_writers import DEFAULT_CHUNK_MAX_BYTES, JOB_WRITERS, TEXT_DETECTION, write_job_results
 
 
 logger = logging.getLogger(__name__)
@@ -19,12 +18,39 @@ logger.setLevel(logging.DEBUG)
 # Environ Variables
 TABLE_NAME = os.environ['TABLE_NAME']
 SQS_RESPONSE_QUEUE = os.environ['SQS_RESPONSE_QUEUE']
+# Where the results are written: dynamodb, or sqlite for a local database
+RESULTS_BACKEND = os.environ.get('RESULTS_BACKEND', 'dynamodb')
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', 'results.db')
+# Fetch the next results page while the current one is converted and written
+PREFETCH_PAGES = os.environ.get('PREFETCH_PAGES', 'true').lower() == 'true'
+# Estimated item size at which the results written so far are flushed as one item
+CHUNK_MAX_BYTES = int(os.environ.get('CHUNK_MAX_BYTES', DEFAULT_CHUNK_MAX_BYTES))
+# IoU above which overlapping text detections of a frame are suppressed to the most
+# confident one, '0' writes every detection, see text_nms.py
+TEXT_NMS_IOU = float(os.environ.get('TEXT_NMS_IOU', '0'))
 # DynamoDB Resource
 dynamodb_resource = boto3.resource('dynamodb') #, region_name='us-east-1')
 sqs_resource = boto3.resource('sqs')
 rekognition_client = boto3.client('rekognition') #, region_name='us-east-1')
 
 
+# SQLite results store, opened on first use when RESULTS_BACKEND is sqlite
+results_store = None
+
+
+def get_results_store():
+    """
+    Opens the SQLite results store on first use.
+
+    :return: The SQLiteResultsStore.
+    """
+    global results_store
+    if results_store is None:
+        from results_store import SQLiteResultsStore
+        results_store = SQLiteResultsStore(RESULTS_DB_PATH)
+    return results_store
+
+
 
 
 def put_item_dynamodb(item):
@@ -33,6 +59,9 @@ def put_item_dynamodb(item):
     :param item: Dictionary of id, FaceDetails and ResponseMetdata
     :return: DynamoDB PutItem response dict
     """
+    if RESULTS_BACKEND == 'sqlite':
+        return get_results_store().put_item(item)
+
     dynamodb_table = dynamodb_resource.Table(TABLE_NAME)
 
     try:
@@ -42,7 +71,7 @@ def put_item_dynamodb(item):
     except ClientError as error:
         return error.response
 
-def poll_notification(message_body):
+def poll_notification(message_body, default_api='StartTextDetection'):
     # Get the queue
     #queue = sqs_resource.get_queue_by_name(QueueName=SQS_RESPONSE_QUEUE)
     #messages = queue.receive_messages(
@@ -55,12 +84,15 @@ def poll_notification(message_body):
     job_id = message['JobId']
     status = message['Status']
     job_tag = message['JobTag']
-    logger.info("job_tag: {}, job_id: {}, and status is {}".format(
+    # The API that started the job, such as StartLabelDetection
+    api = message.get('API', default_api)
+    logger.info("job_tag: {}, job_id: {}, api: {}, and status is {}".format(
         job_tag,
         job_id,
+        api,
         status
     ))
-    return job_tag, job_id, status
+    return job_tag, job_id, status, api
 
 def _get_rekognition_job_results(job_id, get_results_func, result_extractor, next_token=None):
         """
@@ -109,97 +141,44 @@ def parse_message_texts(message):
 
 def lambda_handler(event, context):
     """
-    This function is call on a SQS Queue event, takes the message of the queue, parses the message and inserts a item
-    into dynamoDB
+    This function is call on a SQS Queue event, takes the message of the queue, parses the message and inserts the
+    results of the job into dynamoDB. The API field of the message selects the job type in JOB_WRITERS.
     :param event: SQS Message dict
     :param context: Context dict
-    :return: DynamoDB Response PutItem dict
+    :return: None
     """
-    message_body = json.loads(event['Records'][0]['body'])
-    logger.info("message_body: {}".format(message_body))
-    job_tag, job_id, status = poll_notification(message_body)
-
-    text_message = {}
-    text_line_counter = 0
-    token_number = 0
-    next_token = None
-    if status == 'SUCCEEDED':
-        while (next_token != None)  or (token_number == 0):
-            token_number=token_number+1
-            logger.info("{} job_id: {}, status: {}, next_token: {}".format(token_number, job_id,status,next_token))
-            texts, next_token = _get_rekognition_job_results(job_id,
-                rekognition_client.get_text_detection, 
-                lambda response: [
-                    RekognitionText(text['TextDetection'], text['Timestamp']) 
-                    for text in response['TextDetections']]
-                ,next_token)        
-            logger.info(f"Detected {len(texts)} texts, here are the first twenty:")
-            for text in texts:
-                #print(text.to_dict_compact())
-                text_line_counter=text_line_counter+1
-                line_message = text.to_dict_compact()
-                #text_message[text_line_counter] = line_message
-                text_message[line_message['text']] = line_message
-            
-        text_message.update({'id': job_tag })
-        item_size = sys.getsizeof(text_message)
-        #logger.info("text_message size in Bytes is {}".format(item_size))
-        if item_size > 400000:
-            logger.error("Item is bigger than DynamoDB can support {} / {}".format(item_size,400000))
-        else:
-            logger.info("Item size in Bytes to be inserted in DynamoDB {}".format(item_size))
-            item = parse_message_texts(text_message)
-            put_item_dynamodb(item)
-    else:
-        logger.info("Failure: job_id is: {}, and status is {}".format(job_id,status))
-
-    return None
+    return _write_job_results(event)
 
 def lambda_handler_detectlabel(event, context):
     """
-    This function is call on a SQS Queue event, takes the message of the queue, parses the message and inserts a item
-    into dynamoDB
+    Writes the results of a label detection job, for messages without an API field.
     :param event: SQS Message dict
     :param context: Context dict
-    :return: DynamoDB Response PutItem dict
+    :return: None
     """
+    return _write_job_results(event, 'StartLabelDetection')
+
+def _write_job_results(event, default_api='StartTextDetection'):
     message_body = json.loads(event['Records'][0]['body'])
     logger.info("message_body: {}".format(message_body))
-    job_tag, job_id, status = poll_notification(message_body)
-
-    text_message = {}
-    text_line_counter = 0
-    token_number = 0
-    next_token = None
-    if status == 'SUCCEEDED':
-        while (next_token != None)  or (token_number == 0):
-            token_number=token_number+1
-            logger.info("{} job_id: {}, status: {}, next_token: {}".format(token_number, job_id,status,next_token))
-            texts, next_token = _get_rekognition_job_results(job_id,
-                rekognition_client.get_label_detection,
-                lambda response: [
-                    RekognitionLabel(text['Label'], text['Confidence'], text['Timestamp'])
-                    for text in response['Labels']]
-                ,next_token)        
-            logger.info(f"Detected {len(texts)} labels, here are the first twenty:")
-            for text in texts:
-                #print(text.to_dict_compact())
-                text_line_counter=text_line_counter+1
-                line_message = text.to_dict_compact()
-                #text_message[text_line_counter] = line_message
-                text_message[line_message['text']] = line_message
-            
-        text_message.update({'id': job_tag })
-        item_size = sys.getsizeof(text_message)
-        #logger.info("text_message size in Bytes is {}".format(item_size))
-        if item_size > 400000:
-            logger.error("Item is bigger than DynamoDB can support {} / {}".format(item_size,400000))
-        else:
-            logger.info("Item size in Bytes to be inserted in DynamoDB {}".format(item_size))
-            item = parse_message_texts(text_message)
-            put_item_dynamodb(item)
+    job_tag, job_id, status, api = poll_notification(message_body, default_api)
+
+    job_writer = JOB_WRITERS.get(api)
+    if job_writer is None:
+        logger.error("Can't write the results of %s jobs, job_id is: %s", api, job_id)
+    elif status == 'SUCCEEDED':
+        get_results_func = getattr(rekognition_client, job_writer.get_results)
+        result_filter = None
+        if TEXT_NMS_IOU and job_writer.job_type == TEXT_DETECTION:
+            from text_nms import TextSuppressor
+            result_filter = TextSuppressor(TEXT_NMS_IOU)
+        write_job_results(
+            job_writer, job_tag,
+            lambda next_token: _get_rekognition_job_results(
+                job_id, get_results_func,
+                lambda response: response[job_writer.response_key], next_token),
+            put_item_dynamodb, PREFETCH_PAGES, CHUNK_MAX_BYTES, result_filter=result_filter)
     else:
         logger.info("Failure: job_id is: {}, and status is {}".format(job_id,status))
 
     return None
-
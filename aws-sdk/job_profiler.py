@@ -0,0 +1,297 @@
+"""
+Purpose
+
+Stage-level profiling of Amazon Rekognition video jobs. A job goes through three
+stages with very different latencies: starting the job, waiting for its
+completion notification, and getting the results. The profiler times each stage
+per job type and keeps the timings in HDR-style histograms, so percentiles can be
+read or exported as JSON or Prometheus text without keeping every sample.
+
+Callers can attach hooks to run their own timers or tracing spans around every
+stage, and listeners that receive every timing.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+# Number of bits of every recorded value that are kept exactly, 7 bits keep the
+# relative error of a percentile below 1%.
+DEFAULT_PRECISION_BITS = 7
+# Number of per-job timing records kept for inspection
+DEFAULT_MAX_JOBS = 1000
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies with log-linear buckets, in the manner of
+    HdrHistogram: values are recorded in microseconds and bucketed by their most
+    significant bits, so the memory use does not depend on the number of samples
+    and every percentile has a bounded relative error.
+    """
+    def __init__(self, precision_bits=DEFAULT_PRECISION_BITS):
+        """
+        Initializes the histogram.
+
+        :param precision_bits: The number of most significant bits of a value that
+                               select its bucket.
+        """
+        self.precision_bits = precision_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, micros):
+        shift = max(0, micros.bit_length() - self.precision_bits)
+        return shift, micros >> shift
+
+    def record(self, seconds):
+        """
+        Records a latency.
+
+        :param seconds: The latency in seconds.
+        """
+        micros = max(0, int(seconds * 1000000))
+        bucket = self._bucket(micros)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        Adds the samples of another histogram with the same precision.
+
+        :param other: The histogram to merge into this one.
+        """
+        if other.precision_bits != self.precision_bits:
+            raise ValueError("Can't merge histograms of different precision.")
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percent):
+        """
+        Gets a percentile of the recorded latencies.
+
+        :param percent: The percentile, between 0 and 100.
+        :return: The latency in seconds, or None when nothing was recorded. The
+                 value is the upper bound of the bucket of the percentile, capped
+                 at the largest recorded latency.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(percent / 100 * self.count)))
+        seen = 0
+        for shift, mantissa in sorted(self.counts, key=lambda bucket: bucket[1] << bucket[0]):
+            seen += self.counts[(shift, mantissa)]
+            if seen >= rank:
+                upper = (((mantissa + 1) << shift) - 1) / 1000000
+                return min(upper, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Gets a summary of the histogram.
+
+        :param percentiles: The percentiles to include.
+        :return: A dict with the count, sum, min, max, mean and percentiles, in
+                 seconds.
+        """
+        summary = {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean()}
+        for percent in percentiles:
+            summary['p{}'.format(percent)] = self.percentile(percent)
+        return summary
+
+
+class StageProfiler:
+    """
+    Times the stages of Rekognition jobs. Timings are kept in one histogram per
+    job type and stage, and the stage timings of the latest jobs are kept as
+    records that include the video name.
+    """
+    def __init__(self, precision_bits=DEFAULT_PRECISION_BITS, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        Initializes the profiler.
+
+        :param precision_bits: The precision of the histograms.
+        :param max_jobs: The number of per-job records to keep.
+        """
+        self.precision_bits = precision_bits
+        self.histograms = {}
+        self.jobs = deque(maxlen=max_jobs)
+        self.hooks = []
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Adds a hook that runs around every stage, for example to start a tracing
+        span or a timer of another metrics library.
+
+        :param hook: A function that takes the stage name and a dict of labels
+                     (job_type and video) and returns a context manager, or None.
+        """
+        self.hooks.append(hook)
+
+    def add_listener(self, listener):
+        """
+        Adds a listener that receives every stage timing.
+
+        :param listener: A function that takes the stage name, a dict of labels and
+                         the latency in seconds.
+        """
+        self.listeners.append(listener)
+
+    def record(self, stage, seconds, job_type, video=None):
+        """
+        Records the latency of a stage.
+
+        :param stage: The stage name, such as start, wait or get_results.
+        :param seconds: The latency in seconds.
+        :param job_type: The job type, such as text_detection.
+        :param video: The name of the video.
+        """
+        with self._lock:
+            histogram = self.histograms.get((job_type, stage))
+            if histogram is None:
+                histogram = self.histograms[(job_type, stage)] = LatencyHistogram(
+                    self.precision_bits)
+            histogram.record(seconds)
+        labels = {'job_type': job_type, 'video': video}
+        for listener in self.listeners:
+            try:
+                listener(stage, labels, seconds)
+            except Exception:
+                logger.exception("Profiler listener failed on stage %s.", stage)
+
+    @contextmanager
+    def stage(self, stage, job_type, video=None, timings=None):
+        """
+        Times a block as a stage of a job and runs the hooks around it.
+
+        :param stage: The stage name.
+        :param job_type: The job type.
+        :param video: The name of the video.
+        :param timings: A dict of the job record, which receives the stage latency.
+        """
+        labels = {'job_type': job_type, 'video': video}
+        with ExitStack() as stack:
+            for hook in self.hooks:
+                context = hook(stage, labels)
+                if context is not None:
+                    stack.enter_context(context)
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                seconds = time.perf_counter() - start
+                self.record(stage, seconds, job_type, video)
+                if timings is not None:
+                    timings[stage] = seconds
+
+    @contextmanager
+    def job(self, job_type, video=None):
+        """
+        Keeps a record of the stage timings of one job.
+
+        :param job_type: The job type.
+        :param video: The name of the video.
+        :return: The record dict, pass it as the timings of the stages.
+        """
+        record = {'job_type': job_type, 'video': video}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['total'] = time.perf_counter() - start
+            with self._lock:
+                self.jobs.append(record)
+
+    def histogram(self, job_type, stage):
+        """
+        Gets the histogram of a stage, merged over job types when job_type is None.
+
+        :param job_type: The job type, or None for all job types.
+        :param stage: The stage name.
+        :return: The histogram, empty when the stage was never recorded.
+        """
+        merged = LatencyHistogram(self.precision_bits)
+        with self._lock:
+            for (histogram_job_type, histogram_stage), histogram in self.histograms.items():
+                if histogram_stage == stage and job_type in (None, histogram_job_type):
+                    merged.merge(histogram)
+        return merged
+
+    def to_dict(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Gets a summary of every histogram.
+
+        :param percentiles: The percentiles to include.
+        :return: A dict of job type to a dict of stage to the histogram summary.
+        """
+        summary = {}
+        with self._lock:
+            for (job_type, stage), histogram in sorted(self.histograms.items()):
+                summary.setdefault(job_type, {})[stage] = histogram.to_dict(percentiles)
+        return summary
+
+    def to_json(self, percentiles=DEFAULT_PERCENTILES, **kwargs):
+        return json.dumps(self.to_dict(percentiles), **kwargs)
+
+    def to_prometheus(self, name='rekognition_job_stage_seconds',
+                      percentiles=DEFAULT_PERCENTILES):
+        """
+        Renders the histograms in the Prometheus text exposition format, as a
+        summary with one quantile series per percentile.
+
+        :param name: The metric name.
+        :param percentiles: The percentiles to export as quantiles.
+        :return: The exposition text.
+        """
+        lines = [
+            '# HELP {} Latency of the stages of Amazon Rekognition video jobs.'.format(name),
+            '# TYPE {} summary'.format(name)]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for (job_type, stage), histogram in histograms:
+            labels = 'job_type="{}",stage="{}"'.format(job_type, stage)
+            for percent in percentiles:
+                lines.append('{}{{{},quantile="{}"}} {}'.format(
+                    name, labels, percent / 100, histogram.percentile(percent)))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, histogram.total))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.jobs.clear()
+
+
+# Profiler shared by the RekognitionVideo objects that are not given their own
+default_profiler = StageProfiler()
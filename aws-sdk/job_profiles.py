@@ -0,0 +1,169 @@
+"""
+Purpose
+
+Reusable options of Amazon Rekognition Video jobs, so that detections are
+filtered and aggregated by Rekognition instead of after every detection has been
+downloaded. A JobProfile holds the extra parameters of the start call of a job,
+such as the word filter of text detection or the label inclusion filters of label
+detection, and of its get calls, such as AggregateBy and SortBy. Filtering at the
+source shrinks the result pages and the number of pages to fetch.
+
+    video.do_label_detection(profile=label_profile(min_confidence=80,
+                                                   include=['Person', 'Car'],
+                                                   aggregate_by=SEGMENTS))
+    video.do_text_detection(profile=PROFILES['overlay_text'])
+
+Regions of interest are (left, top, right, bottom) boxes in the ratios of the
+frame size, as in geometry.py.
+"""
+
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# AggregateBy values of GetLabelDetection and GetContentModeration
+TIMESTAMPS = 'TIMESTAMPS'
+SEGMENTS = 'SEGMENTS'
+
+JobProfile = namedtuple('JobProfile', ['start_options', 'get_options'])
+
+# Passes every detection, as a job without a profile
+DEFAULT_PROFILE = JobProfile({}, {})
+
+
+def _region_of_interest(region):
+    left, top, right, bottom = region
+    return {'BoundingBox': {'Left': left, 'Top': top, 'Width': right - left,
+                            'Height': bottom - top}}
+
+
+def _get_options(sort_by=None, aggregate_by=None):
+    options = {}
+    if sort_by is not None:
+        options['SortBy'] = sort_by
+    if aggregate_by is not None:
+        options['AggregateBy'] = aggregate_by
+    return options
+
+
+def text_profile(min_confidence=None, min_box_height=None, min_box_width=None,
+                 regions=None):
+    """
+    Builds a text detection profile.
+
+    :param min_confidence: The smallest confidence of the detected words.
+    :param min_box_height: The smallest height of the word boxes, a ratio of the
+                           frame height.
+    :param min_box_width: The smallest width of the word boxes, a ratio of the
+                          frame width.
+    :param regions: The regions of interest in which text is detected, as
+                    (left, top, right, bottom) boxes.
+    :return: The JobProfile.
+    """
+    word_filter = {}
+    if min_confidence is not None:
+        word_filter['MinConfidence'] = min_confidence
+    if min_box_height is not None:
+        word_filter['MinBoundingBoxHeight'] = min_box_height
+    if min_box_width is not None:
+        word_filter['MinBoundingBoxWidth'] = min_box_width
+    filters = {}
+    if word_filter:
+        filters['WordFilter'] = word_filter
+    if regions:
+        filters['RegionsOfInterest'] = [_region_of_interest(region) for region in regions]
+    return JobProfile({'Filters': filters} if filters else {}, {})
+
+
+def label_profile(min_confidence=None, include=None, exclude=None,
+                  include_categories=None, exclude_categories=None,
+                  aggregate_by=None, sort_by=None):
+    """
+    Builds a label detection profile.
+
+    :param min_confidence: The smallest confidence of the returned labels.
+    :param include: The names of the only labels to return.
+    :param exclude: The names of labels not to return.
+    :param include_categories: The categories of the only labels to return.
+    :param exclude_categories: The categories of labels not to return.
+    :param aggregate_by: TIMESTAMPS for a result per label and sampled frame, or
+                         SEGMENTS for a result per label and continuous segment.
+    :param sort_by: NAME or TIMESTAMP.
+    :return: The JobProfile.
+    """
+    start_options = {}
+    if min_confidence is not None:
+        start_options['MinConfidence'] = min_confidence
+    general_labels = {}
+    for key, values in (('LabelInclusionFilters', include),
+                        ('LabelExclusionFilters', exclude),
+                        ('LabelCategoryInclusionFilters', include_categories),
+                        ('LabelCategoryExclusionFilters', exclude_categories)):
+        if values:
+            general_labels[key] = list(values)
+    if general_labels:
+        start_options['Features'] = ['GENERAL_LABELS']
+        start_options['Settings'] = {'GeneralLabels': general_labels}
+    return JobProfile(start_options, _get_options(sort_by, aggregate_by))
+
+
+def face_profile(all_attributes=False):
+    """
+    Builds a face detection profile.
+
+    :param all_attributes: Returns all the face attributes, such as emotions and
+                           age range, instead of the default ones.
+    :return: The JobProfile.
+    """
+    return JobProfile({'FaceAttributes': 'ALL' if all_attributes else 'DEFAULT'}, {})
+
+
+def person_profile(sort_by=None):
+    """
+    Builds a person tracking profile.
+
+    :param sort_by: INDEX or TIMESTAMP.
+    :return: The JobProfile.
+    """
+    return JobProfile({}, _get_options(sort_by))
+
+
+def celebrity_profile(sort_by=None):
+    """
+    Builds a celebrity recognition profile.
+
+    :param sort_by: ID or TIMESTAMP.
+    :return: The JobProfile.
+    """
+    return JobProfile({}, _get_options(sort_by))
+
+
+def moderation_profile(min_confidence=None, aggregate_by=None, sort_by=None):
+    """
+    Builds a content moderation profile.
+
+    :param min_confidence: The smallest confidence of the returned labels.
+    :param aggregate_by: TIMESTAMPS or SEGMENTS.
+    :param sort_by: NAME or TIMESTAMP.
+    :return: The JobProfile.
+    """
+    start_options = {}
+    if min_confidence is not None:
+        start_options['MinConfidence'] = min_confidence
+    return JobProfile(start_options, _get_options(sort_by, aggregate_by))
+
+
+# Named profiles of common jobs
+PROFILES = {
+    # Confident words of readable size, such as the overlay text of a video
+    'overlay_text': text_profile(min_confidence=80, min_box_height=0.02),
+    # One result per label and continuous segment instead of per sampled frame
+    'label_segments': label_profile(min_confidence=70, aggregate_by=SEGMENTS,
+                                    sort_by='TIMESTAMP'),
+    # People and vehicles only
+    'people_and_vehicles': label_profile(
+        min_confidence=70, include=['Person', 'Car', 'Truck', 'Bicycle', 'Motorcycle']),
+    'face_attributes': face_profile(all_attributes=True),
+    'moderation_segments': moderation_profile(min_confidence=60, aggregate_by=SEGMENTS),
+}
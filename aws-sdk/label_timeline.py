@@ -0,0 +1,295 @@
+"""
+Purpose
+
+Timeline statistics of the labels of a video, from the output of
+RekognitionVideo.do_label_detection(): when every label appears, how often, for
+what share of the video, its maximum and mean confidence, and how many instances
+of it, such as Person boxes, are visible over time.
+
+The label events are kept as NumPy arrays sorted by label and timestamp, so every
+statistic is computed for all labels at once with a few vectorized passes
+instead of a Python loop over the events.
+
+Label detection samples the video at a fixed interval, and a label is reported at
+every sampled frame in which it is seen. Consecutive detections of a label no more
+than max_gap_ms apart make one appearance interval, and every detection covers
+one sampling interval of the video. Labels aggregated by SEGMENTS, for example
+with job_profiles.label_profile(aggregate_by=SEGMENTS), carry the end of their
+segment, and cover it instead; segments of a label no more than max_gap_ms
+apart, by default only overlapping or touching ones, make one interval.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Gap between detections of a label, in sampling intervals, that ends an
+# appearance interval; above 2 so a single missed frame doesn't split it
+DEFAULT_GAP_INTERVALS = 2.5
+
+
+class LabelTimeline:
+    """Label detection events of a video as arrays sorted by label and timestamp."""
+    def __init__(self, names, codes, timestamps, confidences, instance_counts,
+                 duration_ms=None, max_gap_ms=None, end_timestamps=None):
+        """
+        Initializes the timeline. Use from_labels() or from_entries() to build one.
+
+        :param names: The label names, indexed by label code.
+        :param codes: The label code of every event.
+        :param timestamps: The timestamp of every event, in milliseconds.
+        :param confidences: The confidence of every event.
+        :param instance_counts: The number of instance boxes of every event.
+        :param duration_ms: The duration of the video, by default the last
+                            timestamp plus one sampling interval.
+        :param max_gap_ms: The largest gap between the detections of one
+                           appearance interval, by default DEFAULT_GAP_INTERVALS
+                           sampling intervals, or 0 with end_timestamps.
+        :param end_timestamps: The end of the segment of every event, for labels
+                               aggregated by segments, or -1 for an event that
+                               covers one sampling interval. None when no event
+                               is a segment.
+        """
+        codes = np.asarray(codes, dtype=np.int32)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        # One sort on a combined key is faster than a lexsort of the two arrays;
+        # timestamps stay below 2**40 ms.
+        order = np.argsort((codes.astype(np.int64) << 40) | timestamps)
+        self.names = list(names)
+        self.codes = codes[order]
+        self.timestamps = timestamps[order]
+        self.confidences = np.asarray(confidences, dtype=np.float32)[order]
+        self.instance_counts = np.asarray(instance_counts, dtype=np.int32)[order]
+        self.end_timestamps = (None if end_timestamps is None
+                               else np.asarray(end_timestamps, dtype=np.int64)[order])
+        self._index = {name: code for code, name in enumerate(self.names)}
+
+        # Every sampled frame in which a label was seen
+        self.frames = np.unique(self.timestamps)
+        frame_gaps = np.diff(self.frames)
+        self.frame_interval_ms = float(np.median(frame_gaps)) if len(frame_gaps) else 0.0
+        if self.end_timestamps is not None:
+            # The end of every event, a segment or one sampling interval
+            self.end_timestamps = np.where(
+                self.end_timestamps >= 0, self.end_timestamps,
+                self.timestamps + int(self.frame_interval_ms))
+        if duration_ms is None:
+            if self.end_timestamps is not None and len(self.end_timestamps):
+                duration_ms = self.end_timestamps.max()
+            else:
+                duration_ms = (self.frames[-1] + self.frame_interval_ms) if len(self.frames) else 0
+        self.duration_ms = float(duration_ms)
+        if max_gap_ms is None:
+            max_gap_ms = (0 if self.end_timestamps is not None
+                          else DEFAULT_GAP_INTERVALS * self.frame_interval_ms)
+        self.max_gap_ms = max_gap_ms
+
+        # Slice of the events of every label code
+        self.bounds = np.searchsorted(self.codes, np.arange(len(self.names) + 1))
+        self._compute_intervals()
+
+    @classmethod
+    def from_labels(cls, labels, duration_ms=None, max_gap_ms=None):
+        """
+        Builds the timeline of RekognitionLabel objects.
+
+        :param labels: The labels returned by do_label_detection().
+        :param duration_ms: The duration of the video, in milliseconds.
+        :param max_gap_ms: The largest gap within an appearance interval.
+        :return: The LabelTimeline.
+        """
+        index = {}
+        codes = np.fromiter(
+            (index.setdefault(label.name, len(index)) for label in labels),
+            dtype=np.int32, count=len(labels))
+        timestamps = np.fromiter((label.timestamp for label in labels),
+                                 dtype=np.int64, count=len(labels))
+        confidences = np.fromiter((label.confidence or 0.0 for label in labels),
+                                  dtype=np.float32, count=len(labels))
+        instance_counts = np.fromiter((len(label.instances or ()) for label in labels),
+                                      dtype=np.int32, count=len(labels))
+        end_timestamps = None
+        if any(getattr(label, 'end_timestamp', None) is not None for label in labels):
+            end_timestamps = np.fromiter(
+                (label.end_timestamp if label.end_timestamp is not None else -1
+                 for label in labels), dtype=np.int64, count=len(labels))
+        return cls(index, codes, timestamps, confidences, instance_counts,
+                   duration_ms, max_gap_ms, end_timestamps)
+
+    @classmethod
+    def from_entries(cls, entries, duration_ms=None, max_gap_ms=None):
+        """
+        Builds the timeline of the raw Labels entries of get_label_detection
+        responses, without wrapping them in objects.
+
+        :param entries: The Labels entries, each with Timestamp and Label, or
+                        with StartTimestampMillis and EndTimestampMillis for
+                        results aggregated by SEGMENTS.
+        :param duration_ms: The duration of the video, DurationMillis of the
+                            VideoMetadata of the response.
+        :param max_gap_ms: The largest gap within an appearance interval.
+        :return: The LabelTimeline.
+        """
+        index = {}
+        codes = np.fromiter(
+            (index.setdefault(entry['Label']['Name'], len(index)) for entry in entries),
+            dtype=np.int32, count=len(entries))
+        timestamps = np.fromiter(
+            (entry['Timestamp'] if 'Timestamp' in entry else entry['StartTimestampMillis']
+             for entry in entries), dtype=np.int64, count=len(entries))
+        confidences = np.fromiter((entry['Label'].get('Confidence', 0.0) for entry in entries),
+                                  dtype=np.float32, count=len(entries))
+        instance_counts = np.fromiter(
+            (len(entry['Label'].get('Instances', ())) for entry in entries),
+            dtype=np.int32, count=len(entries))
+        end_timestamps = None
+        if any('EndTimestampMillis' in entry for entry in entries):
+            end_timestamps = np.fromiter(
+                (entry.get('EndTimestampMillis', -1) for entry in entries),
+                dtype=np.int64, count=len(entries))
+        return cls(index, codes, timestamps, confidences, instance_counts,
+                   duration_ms, max_gap_ms, end_timestamps)
+
+    def _compute_intervals(self):
+        # An interval starts at the first event of a label and after every gap
+        # longer than max_gap_ms.
+        count = len(self.timestamps)
+        starts = np.ones(count, dtype=bool)
+        if self.end_timestamps is None:
+            if count:
+                starts[1:] = ((self.codes[1:] != self.codes[:-1])
+                              | (np.diff(self.timestamps) > self.max_gap_ms))
+            # A detection covers one sampling interval.
+            ends = self.timestamps + self.frame_interval_ms
+        else:
+            # The latest end so far of every label; the code in the high bits
+            # keeps the running maximum within the label.
+            offsets = self.codes.astype(np.int64) << 40
+            ends = np.maximum.accumulate(offsets | self.end_timestamps) - offsets
+            if count:
+                starts[1:] = ((self.codes[1:] != self.codes[:-1])
+                              | (self.timestamps[1:] - ends[:-1] > self.max_gap_ms))
+        start_index = np.flatnonzero(starts)
+        end_index = np.append(start_index[1:], count) - 1
+        self.interval_codes = self.codes[start_index]
+        self.interval_starts = self.timestamps[start_index]
+        self.interval_ends = np.minimum(ends[end_index], self.duration_ms)
+        self.interval_bounds = np.searchsorted(
+            self.interval_codes, np.arange(len(self.names) + 1))
+
+    def _code(self, name):
+        try:
+            return self._index[name]
+        except KeyError:
+            raise KeyError("Label {} isn't in the video.".format(name)) from None
+
+    def occurrences(self):
+        """The number of detections of every label, indexed by code."""
+        return np.diff(self.bounds)
+
+    def coverage(self):
+        """The share of the video in which every label appears, indexed by code."""
+        durations = (self.interval_ends - self.interval_starts).astype(np.float64)
+        per_label = np.bincount(self.interval_codes, weights=durations,
+                                minlength=len(self.names))
+        if not self.duration_ms:
+            return per_label
+        return np.minimum(per_label / self.duration_ms, 1.0)
+
+    def _reduce(self, ufunc, values):
+        # reduceat needs non-empty segments, and every label has an event.
+        if not len(values):
+            return np.zeros(0, dtype=values.dtype)
+        return ufunc.reduceat(values, self.bounds[:-1])
+
+    def max_confidence(self):
+        """The highest confidence of every label, indexed by code."""
+        return self._reduce(np.maximum, self.confidences)
+
+    def mean_confidence(self):
+        """The mean confidence of every label, indexed by code."""
+        return self._reduce(np.add, self.confidences.astype(np.float64)) / self.occurrences()
+
+    def max_instances(self):
+        """The most instances of every label in one frame, indexed by code."""
+        return self._reduce(np.maximum, self.instance_counts)
+
+    def intervals(self, name):
+        """
+        Gets the appearance intervals of a label.
+
+        :param name: The label name.
+        :return: An array of (start_ms, end_ms) rows.
+        """
+        code = self._code(name)
+        first, last = self.interval_bounds[code], self.interval_bounds[code + 1]
+        return np.column_stack((self.interval_starts[first:last],
+                                self.interval_ends[first:last]))
+
+    def instance_series(self, name):
+        """
+        Gets the number of instances of a label in every sampled frame, zero in the
+        frames in which it wasn't detected.
+
+        :param name: The label name.
+        :return: The frame timestamps and the instance counts, two arrays.
+        """
+        code = self._code(name)
+        first, last = self.bounds[code], self.bounds[code + 1]
+        counts = np.zeros(len(self.frames), dtype=np.int32)
+        counts[np.searchsorted(self.frames, self.timestamps[first:last])] = \
+            self.instance_counts[first:last]
+        return self.frames, counts
+
+    def instance_matrix(self, names=None):
+        """
+        Gets the instance counts of several labels in every sampled frame.
+
+        :param names: The label names, all labels by default.
+        :return: The frame timestamps, and a matrix of instance counts with a row
+                 per label and a column per frame.
+        """
+        codes = (np.arange(len(self.names)) if names is None
+                 else np.array([self._code(name) for name in names], dtype=np.int32))
+        rows = np.full(len(self.names), -1, dtype=np.int64)
+        rows[codes] = np.arange(len(codes))
+        selected = rows[self.codes] >= 0
+        matrix = np.zeros((len(codes), len(self.frames)), dtype=np.int32)
+        matrix[rows[self.codes[selected]],
+               np.searchsorted(self.frames, self.timestamps[selected])] = \
+            self.instance_counts[selected]
+        return self.frames, matrix
+
+    def summary(self, min_coverage=0.0):
+        """
+        Summarizes every label, most covered first.
+
+        :param min_coverage: The smallest coverage of the labels to include.
+        :return: A list of dicts with the label name, occurrences, first and last
+                 timestamps, number of intervals, coverage, maximum and mean
+                 confidence and maximum instance count.
+        """
+        if not self.names:
+            return []
+        occurrences = self.occurrences()
+        coverage = self.coverage()
+        max_confidence = self.max_confidence()
+        mean_confidence = self.mean_confidence()
+        max_instances = self.max_instances()
+        first_ms = self.timestamps[self.bounds[:-1]]
+        last_ms = self.timestamps[self.bounds[1:] - 1]
+        intervals = np.diff(self.interval_bounds)
+        order = np.argsort(-coverage, kind='stable')
+        return [{
+            'name': self.names[code],
+            'occurrences': int(occurrences[code]),
+            'first_ms': int(first_ms[code]),
+            'last_ms': int(last_ms[code]),
+            'intervals': int(intervals[code]),
+            'coverage': round(float(coverage[code]), 4),
+            'max_confidence': round(float(max_confidence[code]), 2),
+            'mean_confidence': round(float(mean_confidence[code]), 2),
+            'max_instances': int(max_instances[code]),
+        } for code in order if coverage[code] >= min_coverage]
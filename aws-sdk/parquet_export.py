@@ -0,0 +1,429 @@
+"""
+Purpose
+
+Exports Amazon Rekognition detections to a Parquet dataset, so months of text and
+label detections can be queried with Athena, Spark or DuckDB. The sources are the
+results of RekognitionVideo jobs, the concatenated JSON files of the aws-sdk/json
+folder and the results tables of the DynamoDB stack.
+
+Every detection becomes one row of a single schema. The dataset is partitioned
+Hive style by video and date, for example video=rov_video_trim/date=2021-06-29/.
+The labels of the label table are of images, not videos, and thousands of images
+would make thousands of small partitions, so they share the partition of their
+job type, video=label_detection, and keep their image in the image column.
+Rows are buffered per partition and written as a row group once the buffer is
+full. The buffers of all the partitions share a budget of rows; beyond it the
+largest buffers are written early, so memory stays bounded however many
+detections and partitions are exported. Text and label columns repeat few
+distinct values and are dictionary encoded.
+
+The export needs pyarrow, which is imported only when a dataset is written:
+
+    python parquet_export.py json json/*.json --output exports/
+    python parquet_export.py dynamodb --text-table TEXT --label-table LABELS --output exports/
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+
+from rekognition_objects import (
+    RekognitionCelebrity, RekognitionFace, RekognitionLabel, RekognitionModerationLabel,
+    RekognitionPerson, RekognitionText)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 128 * 1024
+# Rows buffered in all the partitions together before the largest are written
+DEFAULT_MAX_BUFFERED_ROWS = 4 * DEFAULT_ROW_GROUP_SIZE
+DEFAULT_COMPRESSION = 'snappy'
+# Partitions that keep an open file; the least recently written one is closed
+# beyond this, and a later row of it starts a new file.
+DEFAULT_MAX_OPEN_PARTITIONS = 64
+
+# Partition of the labels of the label table, which are of images
+LABEL_TABLE_VIDEO = 'label_detection'
+
+# Columns of a row, in order, without the video and date partition columns.
+# name is the detected text or label name, kind the text type, label category or
+# moderation parent, parent the text parent ID or the label parents, and image
+# the image of a label of the label table.
+COLUMNS = ('job_type', 'timestamp_ms', 'name', 'kind', 'confidence', 'parent',
+           'left', 'top', 'width', 'height', 'image')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise RuntimeError("The Parquet export needs pyarrow, install pyarrow.") from error
+    return pyarrow
+
+
+def make_schema(pa):
+    """
+    Builds the Arrow schema of the row columns.
+
+    :param pa: The pyarrow module.
+    :return: The schema.
+    """
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('job_type', dictionary),
+        ('timestamp_ms', pa.int64()),
+        ('name', dictionary),
+        ('kind', dictionary),
+        ('confidence', pa.float32()),
+        ('parent', dictionary),
+        ('left', pa.float32()),
+        ('top', pa.float32()),
+        ('width', pa.float32()),
+        ('height', pa.float32()),
+        ('image', pa.string())])
+
+
+def partition_value(value):
+    """Makes a video name or date safe to use as a partition directory name."""
+    return re.sub(r'[^A-Za-z0-9_.\-]+', '_', str(value))
+
+
+def _box(bounding_box):
+    if not bounding_box:
+        return None, None, None, None
+    return (bounding_box.get('Left'), bounding_box.get('Top'),
+            bounding_box.get('Width'), bounding_box.get('Height'))
+
+
+def result_rows(results):
+    """
+    Converts RekognitionVideo results to rows.
+
+    :param results: An iterable of RekognitionText, RekognitionLabel,
+                    RekognitionFace, RekognitionPerson, RekognitionCelebrity or
+                    RekognitionModerationLabel objects.
+    :return: A generator of row tuples in COLUMNS order.
+    """
+    for result in results:
+        if isinstance(result, RekognitionText):
+            geometry = result.geometry or {}
+            parent = str(result.parent_id) if result.parent_id is not None else None
+            yield ('text_detection', result.timestamp, result.text, result.kind,
+                   result.confidence, parent) + _box(geometry.get('BoundingBox')) + (None,)
+        elif isinstance(result, RekognitionLabel):
+            parents = ','.join(parent['Name'] for parent in result.parents or []) or None
+            instances = result.instances or [{}]
+            # One row per instance, so every box can be queried; a label without
+            # instances still gets a row.
+            for instance in instances:
+                yield ('label_detection', result.timestamp, result.name, None,
+                       result.confidence, parents) + _box(instance.get('BoundingBox')) + (None,)
+        elif isinstance(result, RekognitionModerationLabel):
+            yield ('content_moderation', result.timestamp, result.name, result.parent_name,
+                   result.confidence, None, None, None, None, None, None)
+        elif isinstance(result, RekognitionCelebrity):
+            yield ('celebrity_recognition', result.timestamp, result.name, None,
+                   result.confidence, None) + _box(result.bounding_box) + (None,)
+        elif isinstance(result, RekognitionPerson):
+            yield ('person_tracking', result.timestamp, str(result.index), None,
+                   None, None) + _box(result.bounding_box) + (None,)
+        elif isinstance(result, RekognitionFace):
+            yield ('face_detection', result.timestamp, result.face_id, None,
+                   result.confidence, None) + _box(result.bounding_box) + (None,)
+        else:
+            raise TypeError("Can't export {}.".format(type(result).__name__))
+
+
+def json_file_rows(path):
+    """
+    Converts an aws-sdk/json text detection file to rows.
+
+    :param path: The path of the file.
+    :return: A generator of row tuples.
+    """
+    from fake_aws import load_text_recording
+
+    for entry in load_text_recording(path).entries:
+        text = RekognitionText(entry['TextDetection'], entry['Timestamp'])
+        # The ids of the file are positions, not Rekognition ids.
+        text.id = text.parent_id = None
+        yield from result_rows([text])
+
+
+def _parse_timestamp(timestamp):
+    """Parses the 0h:0m:0s timestamps written by RekognitionText.to_dict_compact()."""
+    hours, minutes, seconds = (int(part[:-1]) for part in timestamp.split(':'))
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000
+
+
+def text_item_rows(item):
+    """
+    Converts an item of the text results table to rows.
+
+    :param item: The item, with the job tag as id, or job_tag#n for the later
+                 chunks of a job, and one map per detected text. Items of the
+                 other job types of the table give no rows.
+    :return: A generator of (video, row) tuples.
+    """
+    if item.get('job_type', 'text_detection') != 'text_detection':
+        return
+    video = item['id'].split('#', 1)[0]
+    for key, value in item.items():
+        if key == 'id' or not isinstance(value, dict):
+            continue
+        yield video, ('text_detection', _parse_timestamp(value['timestamp']),
+                      value.get('text', key), None, None, None, None, None, None, None, None)
+
+
+def label_item_rows(item):
+    """
+    Converts an item of the label results table to rows, one per instance box.
+
+    :param item: The item, keyed on Image and Label_Name, in the current schema or
+                 the earlier one with single Label_Category and Label_Aliases
+                 strings.
+    :return: A generator of (video, row) tuples. The video is LABEL_TABLE_VIDEO
+             and the image is in the image column.
+    """
+    confidence = item.get('Label_Confidence')
+    confidence = float(confidence) if confidence is not None else None
+    if 'Label_Categories' in item:
+        category = ','.join(item['Label_Categories']) or None
+    else:
+        category = item.get('Label_Category') or None
+    parents = ','.join(item.get('Label_Parents', [])) or None
+    for instance in item.get('Label_Instances') or [{}]:
+        box = [float(value) if value is not None else None
+               for value in _box(instance.get('BoundingBox'))]
+        yield LABEL_TABLE_VIDEO, (
+            'label_detection', 0, item['Label_Name'], category, confidence, parents, *box,
+            item['Image'])
+
+
+def scan_items(table, page_size=None):
+    """
+    Scans every item of a DynamoDB table.
+
+    :param table: A Boto3 DynamoDB Table.
+    :param page_size: The Limit of every Scan request, or None for 1 MB pages.
+    :return: A generator of the items.
+    """
+    kwargs = {}
+    if page_size:
+        kwargs['Limit'] = page_size
+    while True:
+        response = table.scan(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class ParquetDatasetWriter:
+    """
+    Writes rows to a Parquet dataset partitioned by video and date, one open
+    ParquetWriter per partition and one buffered row group per partition. The
+    buffers share a budget of rows: once it is reached, the largest buffers are
+    written until half of it is left, so the few large partitions get large row
+    groups and the many small ones don't hold memory.
+    """
+    def __init__(self, root, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 compression=DEFAULT_COMPRESSION,
+                 max_open_partitions=DEFAULT_MAX_OPEN_PARTITIONS,
+                 max_buffered_rows=DEFAULT_MAX_BUFFERED_ROWS):
+        """
+        Initializes the writer.
+
+        :param root: The root folder of the dataset.
+        :param row_group_size: The number of rows of every row group.
+        :param compression: The Parquet compression codec.
+        :param max_open_partitions: The number of partitions with an open file.
+        :param max_buffered_rows: The number of rows buffered in all the
+                                  partitions together.
+        """
+        self.pa = _import_pyarrow()
+        self.root = root
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.max_open_partitions = max_open_partitions
+        self.max_buffered_rows = max_buffered_rows
+        self.schema = make_schema(self.pa)
+        self.rows_written = 0
+        self.files_written = 0
+        self._buffers = {}
+        self._buffered_rows = 0
+        self._writers = {}
+        self._part_numbers = {}
+
+    def write_rows(self, video, date, rows):
+        """
+        Adds rows to a partition.
+
+        :param video: The video name.
+        :param date: The date of the partition, as a date or an ISO string.
+        :param rows: An iterable of row tuples in COLUMNS order.
+        """
+        partition = (partition_value(video), partition_value(date))
+        columns = self._buffer(partition)
+        appenders = [column.append for column in columns]
+        start = pending = len(columns[0])
+        # The buffer is full at the row group size, or earlier when the rows of
+        # all the buffers reach the budget.
+        limit = min(self.row_group_size,
+                    pending + self.max_buffered_rows - self._buffered_rows)
+        for row in rows:
+            for append, value in zip(appenders, row):
+                append(value)
+            pending += 1
+            if pending >= limit:
+                self._buffered_rows += pending - start
+                if pending >= self.row_group_size:
+                    self._flush_partition(partition)
+                else:
+                    self._flush_largest()
+                columns = self._buffer(partition)
+                appenders = [column.append for column in columns]
+                start = pending = len(columns[0])
+                limit = min(self.row_group_size,
+                            pending + self.max_buffered_rows - self._buffered_rows)
+        self._buffered_rows += pending - start
+
+    def _buffer(self, partition):
+        columns = self._buffers.get(partition)
+        if columns is None:
+            columns = self._buffers[partition] = tuple([] for _ in COLUMNS)
+        return columns
+
+    def _flush_largest(self):
+        """Writes the largest buffers until half the row budget is left."""
+        sizes = sorted(((len(columns[0]), partition)
+                        for partition, columns in self._buffers.items()), reverse=True)
+        for _, partition in sizes:
+            if self._buffered_rows <= self.max_buffered_rows // 2:
+                break
+            self._flush_partition(partition)
+
+    def _open_writer(self, partition):
+        writer = self._writers.pop(partition, None)
+        if writer is None:
+            if len(self._writers) >= self.max_open_partitions:
+                oldest = next(iter(self._writers))
+                self._writers.pop(oldest).close()
+            video, date = partition
+            directory = os.path.join(self.root, 'video=' + video, 'date=' + date)
+            os.makedirs(directory, exist_ok=True)
+            number = self._part_numbers.get(partition, 0)
+            self._part_numbers[partition] = number + 1
+            path = os.path.join(directory, 'part-{:05d}.parquet'.format(number))
+            writer = self.pa.parquet.ParquetWriter(
+                path, self.schema, compression=self.compression, use_dictionary=True)
+            self.files_written += 1
+        # Keep the writers ordered from least to most recently written.
+        self._writers[partition] = writer
+        return writer
+
+    def _flush_partition(self, partition):
+        columns = self._buffers.pop(partition, None)
+        if not columns or not columns[0]:
+            return
+        arrays = [self.pa.array(column, type=field.type)
+                  for column, field in zip(columns, self.schema)]
+        table = self.pa.Table.from_arrays(arrays, schema=self.schema)
+        self._open_writer(partition).write_table(table, row_group_size=self.row_group_size)
+        self.rows_written += table.num_rows
+        self._buffered_rows -= table.num_rows
+
+    def close(self):
+        """Writes the buffered rows and closes every file."""
+        for partition in list(self._buffers):
+            self._flush_partition(partition)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        logger.info("Wrote %s rows to %s files in %s.",
+                    self.rows_written, self.files_written, self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_results(writer, video_name, results, date=None):
+    """
+    Exports the results of a RekognitionVideo job.
+
+    :param writer: The ParquetDatasetWriter.
+    :param video_name: The name of the video.
+    :param results: The result objects returned by a RekognitionVideo do_* function.
+    :param date: The partition date, today (UTC) by default.
+    """
+    date = date or datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    writer.write_rows(video_name, date, result_rows(results))
+
+
+def export_json_files(writer, paths):
+    """
+    Exports aws-sdk/json text detection files. The video is the file name and the
+    date is the modification date of the file.
+
+    :param writer: The ParquetDatasetWriter.
+    :param paths: The paths of the files.
+    """
+    for path in paths:
+        video = os.path.splitext(os.path.basename(path))[0]
+        date = datetime.datetime.fromtimestamp(
+            os.path.getmtime(path), datetime.timezone.utc).date().isoformat()
+        writer.write_rows(video, date, json_file_rows(path))
+
+
+def export_table(writer, table, item_rows, date=None, page_size=None):
+    """
+    Exports a results table.
+
+    :param writer: The ParquetDatasetWriter.
+    :param table: A Boto3 DynamoDB Table.
+    :param item_rows: text_item_rows or label_item_rows.
+    :param date: The partition date, today (UTC) by default.
+    :param page_size: The Limit of every Scan request.
+    """
+    date = date or datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    for item in scan_items(table, page_size):
+        for video, row in item_rows(item):
+            writer.write_rows(video, date, (row,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--output', required=True, help='root folder of the dataset')
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument('--compression', default=DEFAULT_COMPRESSION)
+    parser.add_argument('--max-buffered-rows', type=int, default=DEFAULT_MAX_BUFFERED_ROWS,
+                        help='rows buffered in all the partitions together')
+    sources = parser.add_subparsers(dest='source', required=True)
+    json_parser = sources.add_parser('json', help='export aws-sdk/json files')
+    json_parser.add_argument('paths', nargs='+')
+    table_parser = sources.add_parser('dynamodb', help='export the results tables')
+    table_parser.add_argument('--text-table')
+    table_parser.add_argument('--label-table')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    with ParquetDatasetWriter(args.output, args.row_group_size, args.compression,
+                              max_buffered_rows=args.max_buffered_rows) as writer:
+        if args.source == 'json':
+            export_json_files(writer, args.paths)
+        else:
+            import boto3
+            dynamodb = boto3.resource('dynamodb')
+            if args.text_table:
+                export_table(writer, dynamodb.Table(args.text_table), text_item_rows)
+            if args.label_table:
+                export_table(writer, dynamodb.Table(args.label_table), label_item_rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Purpose
+
+Trajectories of the people tracked in a video, from the output of
+RekognitionVideo.do_person_tracking(). The person events are grouped by person
+index into contiguous NumPy arrays: one array of timestamps and one of bounding
+boxes for all tracks, sorted by track and time, and the offset of every track
+in them. Thousands of tracks take a few arrays instead of thousands of lists of
+objects.
+
+Positions at arbitrary times are interpolated linearly between the samples of a
+track, for one track or for every track at once, and speed and dwell statistics
+are computed for all tracks in vectorized passes. Positions and speeds are in
+the ratios of the frame size that Rekognition uses for bounding boxes, with the
+horizontal ratio scaled by the aspect ratio, so that distances are in frame
+heights.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bounding box columns of the boxes array
+LEFT, TOP, WIDTH, HEIGHT = range(4)
+# Speed, in frame heights per second, below which a person counts as dwelling
+DEFAULT_DWELL_SPEED = 0.05
+# Timestamps stay below 2**40 ms in the combined (track, timestamp) sort keys.
+_TIME_BITS = 40
+
+
+class TrajectoryStore:
+    """Person tracks of a video, as contiguous arrays sorted by track and time."""
+    def __init__(self, indexes, timestamps, boxes, aspect_ratio=1.0, max_gap_ms=None):
+        """
+        Initializes the store. Use from_persons() or from_entries() to build one.
+
+        :param indexes: The person index of every event.
+        :param timestamps: The timestamp of every event, in milliseconds.
+        :param boxes: The (left, top, width, height) bounding box of every event.
+        :param aspect_ratio: The width of the video frames divided by their height.
+        :param max_gap_ms: The longest gap between two samples of a track that is
+                           interpolated; a person is absent during longer gaps.
+                           None interpolates every gap.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        order = np.argsort((indexes << _TIME_BITS) | timestamps, kind='stable')
+        self.timestamps = timestamps[order]
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)[order]
+        self.track_ids, self.offsets = np.unique(indexes[order], return_index=True)
+        self.offsets = np.append(self.offsets, len(order))
+        # Track position of every event
+        self.event_tracks = np.repeat(
+            np.arange(len(self.track_ids), dtype=np.int32), np.diff(self.offsets))
+        self._keys = (self.event_tracks.astype(np.int64) << _TIME_BITS) | self.timestamps
+        self._track_positions = {int(track_id): position
+                                 for position, track_id in enumerate(self.track_ids)}
+        self.aspect_ratio = aspect_ratio
+        self.max_gap_ms = max_gap_ms
+
+    @classmethod
+    def from_persons(cls, persons, aspect_ratio=1.0, max_gap_ms=None):
+        """
+        Builds the store of RekognitionPerson objects. Events without a bounding
+        box are skipped.
+
+        :param persons: The persons returned by do_person_tracking().
+        :param aspect_ratio: The width of the video frames divided by their height.
+        :param max_gap_ms: The longest gap that is interpolated.
+        :return: The TrajectoryStore.
+        """
+        persons = [person for person in persons if person.bounding_box]
+        return cls(
+            [person.index for person in persons],
+            [person.timestamp for person in persons],
+            [(person.bounding_box.get('Left', 0.0), person.bounding_box.get('Top', 0.0),
+              person.bounding_box.get('Width', 0.0), person.bounding_box.get('Height', 0.0))
+             for person in persons],
+            aspect_ratio, max_gap_ms)
+
+    @classmethod
+    def from_entries(cls, entries, aspect_ratio=1.0, max_gap_ms=None):
+        """
+        Builds the store of the raw Persons entries of get_person_tracking
+        responses, without wrapping them in objects.
+
+        :param entries: The Persons entries, each with Timestamp and Person.
+        :param aspect_ratio: The width of the video frames divided by their
+                             height, FrameWidth / FrameHeight of the VideoMetadata.
+        :param max_gap_ms: The longest gap that is interpolated.
+        :return: The TrajectoryStore.
+        """
+        entries = [entry for entry in entries if entry['Person'].get('BoundingBox')]
+        return cls(
+            [entry['Person']['Index'] for entry in entries],
+            [entry['Timestamp'] for entry in entries],
+            [(box.get('Left', 0.0), box.get('Top', 0.0), box.get('Width', 0.0),
+              box.get('Height', 0.0))
+             for box in (entry['Person']['BoundingBox'] for entry in entries)],
+            aspect_ratio, max_gap_ms)
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def _position(self, track_id):
+        try:
+            return self._track_positions[track_id]
+        except KeyError:
+            raise KeyError("Person {} isn't tracked in the video.".format(track_id)) from None
+
+    def track(self, track_id):
+        """
+        Gets the samples of a track.
+
+        :param track_id: The person index.
+        :return: The timestamps and the (left, top, width, height) boxes, two
+                 views of the store arrays.
+        """
+        position = self._position(track_id)
+        first, last = self.offsets[position], self.offsets[position + 1]
+        return self.timestamps[first:last], self.boxes[first:last]
+
+    def _interpolate(self, tracks, times):
+        """
+        Interpolates the boxes of tracks at times, one time per track.
+
+        :return: The boxes, with NaN rows where the track isn't present.
+        """
+        tracks = np.asarray(tracks, dtype=np.int64)
+        times = np.asarray(times, dtype=np.int64)
+        result = np.full((len(tracks), 4), np.nan, dtype=np.float32)
+        # The last sample of the track at or before the time, and the one after it
+        before = np.searchsorted(self._keys, (tracks << _TIME_BITS) | times, side='right') - 1
+        present = before >= self.offsets[tracks]
+        after = np.minimum(before + 1, len(self.timestamps) - 1)
+        exact = present & (self.timestamps[np.maximum(before, 0)] == times)
+        between = present & ~exact & (before + 1 < self.offsets[tracks + 1])
+        if self.max_gap_ms is not None:
+            between &= (self.timestamps[after] - self.timestamps[np.maximum(before, 0)]
+                         <= self.max_gap_ms)
+        result[exact] = self.boxes[before[exact]]
+        start, end = before[between], after[between]
+        weight = ((times[between] - self.timestamps[start])
+                  / (self.timestamps[end] - self.timestamps[start])).astype(np.float32)
+        result[between] = (self.boxes[start] * (1 - weight)[:, None]
+                           + self.boxes[end] * weight[:, None])
+        return result
+
+    def interpolate(self, track_id, times):
+        """
+        Gets the boxes of a track at arbitrary times.
+
+        :param track_id: The person index.
+        :param times: The times, in milliseconds.
+        :return: An array of (left, top, width, height) rows, NaN where the person
+                 isn't present: before the first sample, after the last one and,
+                 with max_gap_ms, during longer gaps.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.int64))
+        tracks = np.full(len(times), self._position(track_id), dtype=np.int64)
+        return self._interpolate(tracks, times)
+
+    def at(self, time_ms):
+        """
+        Gets the box of every person present at a time.
+
+        :param time_ms: The time, in milliseconds.
+        :return: The person indexes and their (left, top, width, height) boxes.
+        """
+        tracks = np.arange(len(self.track_ids), dtype=np.int64)
+        boxes = self._interpolate(tracks, np.full(len(tracks), time_ms, dtype=np.int64))
+        present = ~np.isnan(boxes[:, 0])
+        return self.track_ids[present], boxes[present]
+
+    def in_region(self, region, time_ms, overlap=False):
+        """
+        Finds who was in a region at a time.
+
+        :param region: The (left, top, right, bottom) region, in frame ratios.
+        :param time_ms: The time, in milliseconds.
+        :param overlap: Counts a person whose box overlaps the region, instead of
+                        a person whose box center is in it.
+        :return: The person indexes.
+        """
+        left, top, right, bottom = region
+        track_ids, boxes = self.at(time_ms)
+        if overlap:
+            inside = ((boxes[:, LEFT] < right) & (boxes[:, LEFT] + boxes[:, WIDTH] > left)
+                      & (boxes[:, TOP] < bottom) & (boxes[:, TOP] + boxes[:, HEIGHT] > top))
+        else:
+            center_x = boxes[:, LEFT] + boxes[:, WIDTH] / 2
+            center_y = boxes[:, TOP] + boxes[:, HEIGHT] / 2
+            inside = ((center_x >= left) & (center_x < right)
+                      & (center_y >= top) & (center_y < bottom))
+        return track_ids[inside]
+
+    def _segments(self):
+        """
+        Gets the segments between consecutive samples of every track.
+
+        :return: The track position, duration in seconds, distance and center of
+                 the middle of every segment.
+        """
+        centers = np.column_stack((
+            (self.boxes[:, LEFT] + self.boxes[:, WIDTH] / 2) * self.aspect_ratio,
+            self.boxes[:, TOP] + self.boxes[:, HEIGHT] / 2)).astype(np.float64)
+        same_track = self.event_tracks[1:] == self.event_tracks[:-1]
+        durations = np.diff(self.timestamps) / 1000.0
+        if self.max_gap_ms is not None:
+            same_track &= durations * 1000.0 <= self.max_gap_ms
+        steps = np.diff(centers, axis=0)
+        distances = np.hypot(steps[:, 0], steps[:, 1])
+        middles = (centers[1:] + centers[:-1]) / 2
+        middles[:, 0] /= self.aspect_ratio
+        return (self.event_tracks[:-1][same_track], durations[same_track],
+                distances[same_track], middles[same_track])
+
+    def statistics(self, dwell_speed=DEFAULT_DWELL_SPEED, region=None):
+        """
+        Computes the speed and dwell statistics of every track.
+
+        :param dwell_speed: The speed, in frame heights per second, below which a
+                            person counts as dwelling.
+        :param region: An optional (left, top, right, bottom) region; the time
+                       every person spent with the middle of their path in it is
+                       added as region_ms.
+        :return: A dict of arrays indexed like track_ids: track_id, first_ms,
+                 last_ms, samples, path_length, mean_speed, max_speed, dwell_ms
+                 and, with a region, region_ms.
+        """
+        count = len(self.track_ids)
+        tracks, durations, distances, middles = self._segments()
+        path_length = np.bincount(tracks, weights=distances, minlength=count)
+        moving_time = np.bincount(tracks, weights=durations, minlength=count)
+        speeds = np.divide(distances, durations, out=np.zeros_like(distances),
+                           where=durations > 0)
+        max_speed = np.zeros(count)
+        if len(tracks):
+            # Segments are sorted by track, so every track is one reduceat slice.
+            starts = np.flatnonzero(np.r_[True, tracks[1:] != tracks[:-1]])
+            max_speed[tracks[starts]] = np.maximum.reduceat(speeds, starts)
+        dwelling = speeds < dwell_speed
+        statistics = {
+            'track_id': self.track_ids,
+            'first_ms': self.timestamps[self.offsets[:-1]],
+            'last_ms': self.timestamps[self.offsets[1:] - 1],
+            'samples': np.diff(self.offsets),
+            'path_length': path_length,
+            'mean_speed': np.divide(path_length, moving_time, out=np.zeros(count),
+                                    where=moving_time > 0),
+            'max_speed': max_speed,
+            'dwell_ms': np.bincount(tracks[dwelling], weights=durations[dwelling] * 1000.0,
+                                    minlength=count),
+        }
+        if region is not None:
+            left, top, right, bottom = region
+            inside = ((middles[:, 0] >= left) & (middles[:, 0] < right)
+                      & (middles[:, 1] >= top) & (middles[:, 1] < bottom))
+            statistics['region_ms'] = np.bincount(
+                tracks[inside], weights=durations[inside] * 1000.0, minlength=count)
+        return statistics
+
+    def nbytes(self):
+        """The memory used by the arrays of the store, in bytes."""
+        return sum(array.nbytes for array in (
+            self.timestamps, self.boxes, self.track_ids, self.offsets, self.event_tracks,
+            self._keys))
@@ -11,7 +11,6 @@ viewer.
 
 import io
 import logging
-from PIL import Image, ImageDraw
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +23,9 @@ def show_bounding_boxes(image_bytes, box_sets, colors):
     :param box_sets: A list of lists of bounding boxes to draw on the image.
     :param colors: A list of colors to use to draw the bounding boxes.
     """
+    # Pillow is only needed to draw, so wrapping results does not import it.
+    from PIL import Image, ImageDraw
+
     image = Image.open(io.BytesIO(image_bytes))
     draw = ImageDraw.Draw(image)
     for boxes, color in zip(box_sets, colors):
@@ -44,6 +46,8 @@ def show_polygons(image_bytes, polygons, color):
     :param polygons: The list of polygons to draw on the image.
     :param color: The color to use to draw the polygons.
     """
+    from PIL import Image, ImageDraw
+
     image = Image.open(io.BytesIO(image_bytes))
     draw = ImageDraw.Draw(image)
     for polygon in polygons:
@@ -199,20 +203,25 @@ class RekognitionPerson:
 
 class RekognitionLabel:
     """Encapsulates an Amazon Rekognition label."""
-    def __init__(self, label, timestamp=None):
+    def __init__(self, label, timestamp=None, end_timestamp=None, duration=None):
         """
         Initializes the label object.
 
         :param label: Label data, in the format returned by Amazon Rekognition
                       functions.
         :param timestamp: The time when the label was detected, if the label
-                          was detected in a video.
+                          was detected in a video, or the start of its segment.
+        :param end_timestamp: The end of the segment of a video label, for
+                              results aggregated by segments.
+        :param duration: The duration of the segment, in milliseconds.
         """
         self.name = label.get('Name')
         self.confidence = label.get('Confidence')
         self.instances = label.get('Instances')
         self.parents = label.get('Parents')
         self.timestamp = timestamp
+        self.end_timestamp = end_timestamp
+        self.duration = duration
 
     def to_dict(self):
         """
@@ -225,24 +234,34 @@ class RekognitionLabel:
             rendering['name'] = self.name
         if self.timestamp is not None:
             rendering['timestamp'] = self.timestamp
+        if self.end_timestamp is not None:
+            rendering['end_timestamp'] = self.end_timestamp
+        if self.duration is not None:
+            rendering['duration'] = self.duration
         return rendering
 
 
 class RekognitionModerationLabel:
     """Encapsulates an Amazon Rekognition moderation label."""
-    def __init__(self, label, timestamp=None):
+    def __init__(self, label, timestamp=None, end_timestamp=None, duration=None):
         """
         Initializes the moderation label object.
 
         :param label: Label data, in the format returned by Amazon Rekognition
                       functions.
         :param timestamp: The time when the moderation label was detected, if the
-                          label was detected in a video.
+                          label was detected in a video, or the start of its
+                          segment.
+        :param end_timestamp: The end of the segment of a video label, for
+                              results aggregated by segments.
+        :param duration: The duration of the segment, in milliseconds.
         """
         self.name = label.get('Name')
         self.confidence = label.get('Confidence')
         self.parent_name = label.get('ParentName')
         self.timestamp = timestamp
+        self.end_timestamp = end_timestamp
+        self.duration = duration
 
     def to_dict(self):
         """
@@ -257,6 +276,10 @@ class RekognitionModerationLabel:
             rendering['parent_name'] = self.parent_name
         if self.timestamp is not None:
             rendering['timestamp'] = self.timestamp
+        if self.end_timestamp is not None:
+            rendering['end_timestamp'] = self.end_timestamp
+        if self.duration is not None:
+            rendering['duration'] = self.duration
         return rendering
 
 
@@ -16,30 +16,63 @@ import boto3
 from botocore.exceptions import ClientError
 import requests
 import os
+import tempfile
 
+from job_profiler import default_profiler
+from job_profiles import DEFAULT_PROFILE
 from rekognition_objects import (
     RekognitionFace, RekognitionCelebrity, RekognitionLabel, RekognitionText,
     RekognitionModerationLabel, RekognitionPerson)
+from video_frame_sampler import (
+    DEFAULT_CHANGE_THRESHOLD, DEFAULT_FAST_PATH_MAX_SECONDS, DEFAULT_MAX_WORKERS,
+    DEFAULT_SAMPLE_RATE, DURATION_METADATA_KEY, detect_text_in_frames,
+    fast_path_available, probe_s3_duration, sample_frames)
 
 logger = logging.getLogger(__name__)
 
 
+def _result_times(result):
+    """
+    Gets the timestamp of a result, or for results aggregated by SEGMENTS the
+    start, end and duration of its segment.
+
+    :return: The timestamp, the end timestamp and the duration, None when the
+             result isn't a segment.
+    """
+    timestamp = result.get('Timestamp')
+    if timestamp is not None:
+        return timestamp, None, None
+    return (result.get('StartTimestampMillis'), result.get('EndTimestampMillis'),
+            result.get('DurationMillis'))
+
+
 class RekognitionVideo:
     """
     Encapsulates an Amazon Rekognition video. This class is a thin wrapper around
     parts of the Boto3 Amazon Rekognition API.
     """
-    def __init__(self, video, video_name, rekognition_client):
+    # Clips larger than this don't use the text detection fast path, whatever
+    # their duration.
+    FAST_PATH_MAX_BYTES = 200 * 1024 * 1024
+
+    def __init__(self, video, video_name, rekognition_client, s3_client=None,
+                 profiler=None):
         """
         Initializes the video object.
 
         :param video: Amazon S3 bucket and object key data where the video is located.
         :param video_name: The name of the video.
         :param rekognition_client: A Boto3 Rekognition client.
+        :param s3_client: A Boto3 S3 client, used to download the video for the
+                          text detection fast path.
+        :param profiler: The StageProfiler that times the stages of the jobs.
+                         Defaults to the profiler shared by all videos.
         """
         self.video = video
         self.video_name = video_name
         self.rekognition_client = rekognition_client
+        self.s3_client = s3_client
+        self.profiler = profiler if profiler is not None else default_profiler
         self.topic = None
         self.queue = None
         self.role = None
@@ -55,7 +88,7 @@ class RekognitionVideo:
         :return: The RekognitionVideo object, initialized with Amazon S3 object data.
         """
         video = {'S3Object': {'Bucket': s3_object.bucket_name, 'Name': s3_object.key}}
-        return cls(video, s3_object.key, rekognition_client)
+        return cls(video, s3_object.key, rekognition_client, s3_object.meta.client)
 
     def does_role_exist(self, client, resource_name):
         roles = []
@@ -219,18 +252,20 @@ class RekognitionVideo:
                 job_done = True
         return status
 
-    def _start_rekognition_job(self, job_description, start_job_func):
+    def _start_rekognition_job(self, job_description, start_job_func, start_options=None):
         """
         Starts a job by calling the specified job function.
 
         :param job_description: A description to log about the job.
         :param start_job_func: The specific Boto3 Rekognition start job function to
                                call, such as start_label_detection.
+        :param start_options: Extra parameters of the start call, such as Filters.
         :return: The ID of the job.
         """
         try:
             response = start_job_func(
-                Video=self.video, NotificationChannel=self.get_notification_channel())
+                Video=self.video, NotificationChannel=self.get_notification_channel(),
+                **(start_options or {}))
             job_id = response['JobId']
             logger.info(
                 "Started %s job %s on %s.", job_description, job_id, self.video_name)
@@ -241,7 +276,8 @@ class RekognitionVideo:
         else:
             return job_id
 
-    def _get_rekognition_job_results(self, job_id, get_results_func, result_extractor):
+    def _get_rekognition_job_results(
+            self, job_id, get_results_func, result_extractor, get_options=None):
         """
         Gets the results of a completed job by calling the specified results function.
         Results are extracted into objects by using the specified extractor function.
@@ -251,12 +287,24 @@ class RekognitionVideo:
                                  function to call, such as get_label_detection.
         :param result_extractor: A function that takes the results of the job
                                  and wraps the result data in object form.
+        :param get_options: Extra parameters of the get calls, such as SortBy.
         :return: The list of result objects.
         """
+        get_options = get_options or {}
         try:
-            response = get_results_func(JobId=job_id)
-            logger.info("Job %s has status: %s.", job_id, response['JobStatus'])
-            results = result_extractor(response)
+            results = []
+            next_token = None
+            while True:
+                if next_token is None:
+                    response = get_results_func(JobId=job_id, **get_options)
+                else:
+                    response = get_results_func(
+                        JobId=job_id, NextToken=next_token, **get_options)
+                logger.info("Job %s has status: %s.", job_id, response['JobStatus'])
+                results.extend(result_extractor(response))
+                next_token = response.get('NextToken')
+                if next_token is None:
+                    break
             logger.info("Found %s items in %s.", len(results), self.video_name)
         except ClientError:
             logger.exception("Couldn't get items for %s.", job_id)
@@ -265,7 +313,8 @@ class RekognitionVideo:
             return results
 
     def _do_rekognition_job(
-            self, job_description, start_job_func, get_results_func, result_extractor):
+            self, job_description, start_job_func, get_results_func, result_extractor,
+            profile=None):
         """
         Starts a job, waits for completion, and gets the results.
 
@@ -273,36 +322,130 @@ class RekognitionVideo:
         :param start_job_func: The Boto3 start job function to call.
         :param get_results_func: The Boto3 get job results function to call.
         :param result_extractor: A function that can extract the results into objects.
+        :param profile: The JobProfile with the filter and aggregation options of
+                        the job, see job_profiles.py.
         :return: The list of result objects.
         """
-        job_id = self._start_rekognition_job(job_description, start_job_func)
-        status = self.poll_notification(job_id)
-        if status == 'SUCCEEDED':
-            results = self._get_rekognition_job_results(
-                job_id, get_results_func, result_extractor)
-        else:
-            results = []
+        profile = profile if profile is not None else DEFAULT_PROFILE
+        job_type = job_description.replace(' ', '_')
+        with self.profiler.job(job_type, self.video_name) as timings:
+            with self.profiler.stage('start', job_type, self.video_name, timings):
+                job_id = self._start_rekognition_job(
+                    job_description, start_job_func, profile.start_options)
+            timings['job_id'] = job_id
+            with self.profiler.stage('wait', job_type, self.video_name, timings):
+                status = self.poll_notification(job_id)
+            timings['status'] = status
+            if status == 'SUCCEEDED':
+                with self.profiler.stage('get_results', job_type, self.video_name, timings):
+                    results = self._get_rekognition_job_results(
+                        job_id, get_results_func, result_extractor, profile.get_options)
+            else:
+                results = []
         return results
     
-    #Marcel    
-    def do_text_detection(self):
+    def _probe_duration(self):
         """
-        Performs text detection on the video.
+        Gets the duration of the video without downloading it, from the duration
+        metadata of the object or from the header of its container.
 
+        :return: The duration in seconds, or None when it is unknown or the video
+                 is too large for the text detection fast path.
+        """
+        s3_object = self.video['S3Object']
+        head = self.s3_client.head_object(Bucket=s3_object['Bucket'], Key=s3_object['Name'])
+        if head['ContentLength'] > self.FAST_PATH_MAX_BYTES:
+            return None
+        duration = head.get('Metadata', {}).get(DURATION_METADATA_KEY)
+        if duration is not None:
+            try:
+                return float(duration)
+            except ValueError:
+                logger.warning("Ignoring the duration metadata %r of %s.",
+                               duration, self.video_name)
+        return probe_s3_duration(self.s3_client, s3_object['Bucket'], s3_object['Name'],
+                                 head['ContentLength'])
+
+    def _download_video(self, directory):
+        """
+        Downloads the video to a local directory.
+
+        :param directory: The directory to download the video to.
+        :return: The path of the downloaded video.
+        """
+        s3_object = self.video['S3Object']
+        path = os.path.join(directory, os.path.basename(s3_object['Name']))
+        self.s3_client.download_file(s3_object['Bucket'], s3_object['Name'], path)
+        return path
+
+    def do_text_detection_sampled(
+            self, video_path, sample_rate=DEFAULT_SAMPLE_RATE,
+            change_threshold=DEFAULT_CHANGE_THRESHOLD, max_workers=DEFAULT_MAX_WORKERS,
+            filters=None):
+        """
+        Performs text detection on a local copy of the video by sampling frames and
+        calling the synchronous DetectText API on the frames that changed.
+
+        :param video_path: The path of the local copy of the video.
+        :param sample_rate: The number of frames sampled per second of video.
+        :param change_threshold: The mean absolute grayscale difference below which
+                                 a sampled frame is skipped as unchanged.
+        :param max_workers: The number of concurrent DetectText calls.
+        :param filters: The Filters parameter of DetectText, if any.
+        :return: The list of texts found in the video.
+        """
+        with self.profiler.stage('sampled_detection', 'text_detection', self.video_name):
+            texts = detect_text_in_frames(
+                self.rekognition_client,
+                sample_frames(video_path, sample_rate, change_threshold),
+                filters, max_workers)
+        logger.info("Found %s texts in %s by frame sampling.", len(texts), self.video_name)
+        return texts
+
+    #Marcel    
+    def do_text_detection(self, fast_path_max_seconds=DEFAULT_FAST_PATH_MAX_SECONDS,
+                          profile=None, **sampling_options):
+        """
+        Performs text detection on the video. Clips up to fast_path_max_seconds long
+        are routed to the frame sampling fast path, when the video has an S3 client
+        and OpenCV is installed. Longer videos, and videos whose duration can't be
+        found without downloading them, use an asynchronous Rekognition job.
+
+        :param fast_path_max_seconds: The duration threshold of the fast path, in
+                                      seconds. None always uses the asynchronous job.
+        :param profile: The JobProfile of the job, such as a text_profile(). Its
+                        Filters are also used by the fast path, unless filters is
+                        in sampling_options.
+        :param sampling_options: Options passed to do_text_detection_sampled.
         :return: The list of texts found in the video.
         """
+        if profile is not None and 'Filters' in profile.start_options:
+            sampling_options.setdefault('filters', profile.start_options['Filters'])
+        if (fast_path_max_seconds and self.s3_client is not None
+                and fast_path_available()):
+            duration = self._probe_duration()
+            if duration is not None:
+                logger.info("%s is %.1f seconds long.", self.video_name, duration)
+                if duration <= fast_path_max_seconds:
+                    with tempfile.TemporaryDirectory() as directory:
+                        return self.do_text_detection_sampled(
+                            self._download_video(directory), **sampling_options)
         return self._do_rekognition_job(
             "text detection",
             self.rekognition_client.start_text_detection,
             self.rekognition_client.get_text_detection,
             lambda response: [
                 RekognitionText(text['TextDetection'], text['Timestamp']) 
-                for text in response['TextDetections']])
+                for text in response['TextDetections']],
+            profile)
 
-    def do_label_detection(self):
+    def do_label_detection(self, profile=None):
         """
         Performs label detection on the video.
 
+        :param profile: The JobProfile of the job, such as a label_profile(). With
+                        AggregateBy SEGMENTS, the timestamp of a label is the start
+                        of its segment.
         :return: The list of labels found in the video.
         """
         return self._do_rekognition_job(
@@ -310,13 +453,15 @@ class RekognitionVideo:
             self.rekognition_client.start_label_detection,
             self.rekognition_client.get_label_detection,
             lambda response: [
-                RekognitionLabel(label['Label'], label['Timestamp']) for label in
-                response['Labels']])
+                RekognitionLabel(label['Label'], *_result_times(label)) for label in
+                response['Labels']],
+            profile)
 
-    def do_face_detection(self):
+    def do_face_detection(self, profile=None):
         """
         Performs face detection on the video.
 
+        :param profile: The JobProfile of the job, such as a face_profile().
         :return: The list of faces found in the video.
         """
         return self._do_rekognition_job(
@@ -325,14 +470,16 @@ class RekognitionVideo:
             self.rekognition_client.get_face_detection,
             lambda response: [
                 RekognitionFace(face['Face'], face['Timestamp']) for face in
-                response['Faces']])
+                response['Faces']],
+            profile)
 
-    def do_person_tracking(self):
+    def do_person_tracking(self, profile=None):
         """
         Performs person tracking in the video. Person tracking assigns IDs to each
         person detected in the video and each detection event is associated with
         one of the IDs.
 
+        :param profile: The JobProfile of the job, such as a person_profile().
         :return: The list of person tracking events found in the video.
         """
         return self._do_rekognition_job(
@@ -341,12 +488,14 @@ class RekognitionVideo:
             self.rekognition_client.get_person_tracking,
             lambda response: [
                 RekognitionPerson(person['Person'], person['Timestamp']) for person in
-                response['Persons']])
+                response['Persons']],
+            profile)
 
-    def do_celebrity_recognition(self):
+    def do_celebrity_recognition(self, profile=None):
         """
         Performs celebrity detection on the video.
 
+        :param profile: The JobProfile of the job, such as a celebrity_profile().
         :return: The list of celebrity detection events found in the video.
         """
         return self._do_rekognition_job(
@@ -355,12 +504,16 @@ class RekognitionVideo:
             self.rekognition_client.get_celebrity_recognition,
             lambda response: [
                 RekognitionCelebrity(celeb['Celebrity'], celeb['Timestamp'])
-                for celeb in response['Celebrities']])
+                for celeb in response['Celebrities']],
+            profile)
 
-    def do_content_moderation(self):
+    def do_content_moderation(self, profile=None):
         """
         Performs content moderation on the video.
 
+        :param profile: The JobProfile of the job, such as a moderation_profile().
+                        With AggregateBy SEGMENTS, the timestamp of a label is the
+                        start of its segment.
         :return: The list of moderation labels found in the video.
         """
         return self._do_rekognition_job(
@@ -368,8 +521,9 @@ class RekognitionVideo:
             self.rekognition_client.start_content_moderation,
             self.rekognition_client.get_content_moderation,
             lambda response: [
-                RekognitionModerationLabel(label['ModerationLabel'], label['Timestamp'])
-                for label in response['ModerationLabels']])
+                RekognitionModerationLabel(label['ModerationLabel'], *_result_times(label))
+                for label in response['ModerationLabels']],
+            profile)
 
 
 def usage_demo():
@@ -437,6 +591,8 @@ def usage_demo():
             print(f"Detected {len(labels)} texts, here are the first twenty:")
             for label in labels[:20]:
                 pprint(label.to_dict_compact())
+            print("Job stage latencies in seconds:")
+            pprint(video.profiler.to_dict())
             input("Press Enter when you're ready to continue.")
 
             print("Deleting resources created for the demo.")
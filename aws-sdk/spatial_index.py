@@ -0,0 +1,197 @@
+"""
+Purpose
+
+A uniform grid index over the bounding boxes of video detections, to find the
+detections that fell inside a region of the frame, optionally within a time
+window, without scanning every detection. Boxes come from the geometry of
+RekognitionText objects, the instances of RekognitionLabel objects and the boxes
+of RekognitionPerson objects, in the ratios of the frame size that Rekognition
+uses.
+
+The frame is divided into grid_size x grid_size cells, and every detection is
+registered in each cell its box overlaps. A region query reads only the cells
+the region overlaps, and tests the boxes of their detections exactly. The
+detections of every cell are kept in time order, so a time window is a binary
+search within every cell.
+
+Detections are added in batches, such as the results of a page, as they stream
+in. New detections of a cell are merged into it on its next query.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRID_SIZE = 16
+
+
+def _box_row(box):
+    left, top = box.get('Left', 0.0), box.get('Top', 0.0)
+    return left, top, left + box.get('Width', 0.0), top + box.get('Height', 0.0)
+
+
+class SpatialGridIndex:
+    """Detections registered in the cells of a uniform grid over the frame."""
+    def __init__(self, grid_size=DEFAULT_GRID_SIZE):
+        """
+        :param grid_size: The number of cells along each side of the frame. Boxes
+                          much smaller than a cell waste less of every query.
+        """
+        self.grid_size = grid_size
+        self.items = []
+        self._boxes = [np.zeros((0, 4))]
+        self._timestamps = [np.zeros(0, dtype=np.int64)]
+        cells = grid_size * grid_size
+        # Detection ids of every cell, in time order, and their timestamps
+        self._cell_ids = [np.zeros(0, dtype=np.int64)] * cells
+        self._cell_times = [np.zeros(0, dtype=np.int64)] * cells
+        # Detection ids added to every cell since its last query
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def _cell_ranges(self, boxes):
+        # The first and last cell column and row of every box, clipped to the frame
+        cells = np.clip((boxes * self.grid_size).astype(np.int64), 0, self.grid_size - 1)
+        return cells[:, 0], cells[:, 1], cells[:, 2], cells[:, 3]
+
+    def add(self, boxes, timestamps, items):
+        """
+        Adds a batch of detections.
+
+        :param boxes: The (left, top, right, bottom) box of every detection.
+        :param timestamps: The timestamp of every detection, in milliseconds.
+        :param items: The object of every detection, returned by items_in().
+        :return: The ids of the detections, their positions in items.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        first_id = len(self.items)
+        ids = np.arange(first_id, first_id + len(boxes))
+        self.items.extend(items)
+        self._boxes.append(boxes)
+        self._timestamps.append(timestamps)
+        if not len(boxes):
+            return ids
+
+        # One (cell, detection) pair for every cell a box overlaps
+        left, top, right, bottom = self._cell_ranges(boxes)
+        widths = right - left + 1
+        counts = widths * (bottom - top + 1)
+        pair_ids = np.repeat(np.arange(len(boxes)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_cells = ((top[pair_ids] + local // widths[pair_ids]) * self.grid_size
+                      + left[pair_ids] + local % widths[pair_ids])
+        order = np.argsort(pair_cells, kind='stable')
+        pair_cells, pair_ids = pair_cells[order], pair_ids[order] + first_id
+        cells, starts = np.unique(pair_cells, return_index=True)
+        for cell, cell_ids in zip(cells.tolist(), np.split(pair_ids, starts[1:])):
+            self._pending.setdefault(cell, []).append(cell_ids)
+        return ids
+
+    def add_texts(self, texts):
+        """
+        Adds the text detections that have a bounding box.
+
+        :param texts: RekognitionText objects.
+        :return: The ids of the detections.
+        """
+        texts = [text for text in texts if (text.geometry or {}).get('BoundingBox')]
+        return self.add([_box_row(text.geometry['BoundingBox']) for text in texts],
+                        [text.timestamp or 0 for text in texts], texts)
+
+    def add_labels(self, labels):
+        """
+        Adds a detection for every instance box of the labels.
+
+        :param labels: RekognitionLabel objects.
+        :return: The ids of the detections. The item of a detection is a
+                 (label, instance) tuple.
+        """
+        instances = [(label, instance) for label in labels
+                     for instance in label.instances or () if instance.get('BoundingBox')]
+        return self.add([_box_row(instance['BoundingBox']) for _, instance in instances],
+                        [label.timestamp or 0 for label, _ in instances], instances)
+
+    def add_persons(self, persons):
+        """
+        Adds the person detections that have a bounding box.
+
+        :param persons: RekognitionPerson objects.
+        :return: The ids of the detections.
+        """
+        persons = [person for person in persons if person.bounding_box]
+        return self.add([_box_row(person.bounding_box) for person in persons],
+                        [person.timestamp or 0 for person in persons], persons)
+
+    def _consolidate(self):
+        if len(self._boxes) > 1:
+            self._boxes = [np.concatenate(self._boxes)]
+            self._timestamps = [np.concatenate(self._timestamps)]
+        return self._boxes[0], self._timestamps[0]
+
+    def _cell(self, cell, timestamps):
+        """Merges the pending detections of a cell, keeping it in time order."""
+        pending = self._pending.pop(cell, None)
+        if pending is not None:
+            ids = np.concatenate([self._cell_ids[cell]] + pending)
+            times = timestamps[ids]
+            # Detections usually stream in time order, so a sort is rarely needed.
+            if len(times) > 1 and (np.diff(times) < 0).any():
+                order = np.argsort(times, kind='stable')
+                ids, times = ids[order], times[order]
+            self._cell_ids[cell], self._cell_times[cell] = ids, times
+        return self._cell_ids[cell], self._cell_times[cell]
+
+    def query(self, region, start_ms=None, end_ms=None, contained=False):
+        """
+        Finds the detections in a region, optionally within a time window.
+
+        :param region: The (left, top, right, bottom) region, in frame ratios.
+        :param start_ms: The start of the time window, inclusive.
+        :param end_ms: The end of the time window, inclusive.
+        :param contained: Finds only the detections whose box is entirely in the
+                          region, instead of the ones whose box overlaps it.
+        :return: The sorted ids of the detections.
+        """
+        boxes, timestamps = self._consolidate()
+        region = np.asarray(region, dtype=np.float64).reshape(1, 4)
+        left, top, right, bottom = (int(value[0]) for value in self._cell_ranges(region))
+        candidates = []
+        for row in range(top, bottom + 1):
+            for cell in range(row * self.grid_size + left, row * self.grid_size + right + 1):
+                ids, times = self._cell(cell, timestamps)
+                first = 0 if start_ms is None else np.searchsorted(times, start_ms, 'left')
+                last = len(times) if end_ms is None else np.searchsorted(times, end_ms, 'right')
+                candidates.append(ids[first:last])
+        ids = np.unique(np.concatenate(candidates))
+        candidate_boxes = boxes[ids]
+        region_left, region_top, region_right, region_bottom = region[0]
+        if contained:
+            inside = ((candidate_boxes[:, 0] >= region_left)
+                      & (candidate_boxes[:, 1] >= region_top)
+                      & (candidate_boxes[:, 2] <= region_right)
+                      & (candidate_boxes[:, 3] <= region_bottom))
+        else:
+            inside = ((candidate_boxes[:, 0] < region_right)
+                      & (candidate_boxes[:, 2] > region_left)
+                      & (candidate_boxes[:, 1] < region_bottom)
+                      & (candidate_boxes[:, 3] > region_top))
+        return ids[inside]
+
+    def items_in(self, region, start_ms=None, end_ms=None, contained=False):
+        """
+        Gets the objects of the detections in a region, in the order they were
+        added.
+
+        :param region: The (left, top, right, bottom) region, in frame ratios.
+        :param start_ms: The start of the time window, inclusive.
+        :param end_ms: The end of the time window, inclusive.
+        :param contained: Finds only the detections entirely in the region.
+        :return: The list of objects.
+        """
+        return [self.items[index] for index in
+                self.query(region, start_ms, end_ms, contained).tolist()]
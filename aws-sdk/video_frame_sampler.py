@@ -0,0 +1,227 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Fast path for text detection on short clips. Instead of starting an asynchronous
+Amazon Rekognition video job and waiting for its Amazon SNS notification, the clip
+is decoded locally, frames are sampled at a fixed rate, frames that did not change
+visually are skipped, and the synchronous DetectText API is called on the
+remaining frames concurrently.
+
+Whether a clip is short enough for the fast path is decided before it is
+downloaded: from a duration in the metadata of the S3 object, or else from the
+movie header box of an MP4 or QuickTime container, read with ranged GETs of the
+box headers and of the moov box.
+
+Decoding needs OpenCV (opencv-python-headless), which is imported only when the
+fast path is used.
+"""
+
+import importlib.util
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from rekognition_objects import RekognitionText
+
+logger = logging.getLogger(__name__)
+
+# Number of frames sampled per second of video
+DEFAULT_SAMPLE_RATE = 1.0
+# Mean absolute difference (0-255) of the grayscale thumbnails below which a
+# frame counts as unchanged
+DEFAULT_CHANGE_THRESHOLD = 4.0
+# Number of concurrent DetectText calls, keep below the account TPS limit
+DEFAULT_MAX_WORKERS = 5
+JPEG_QUALITY = 90
+THUMBNAIL_SIZE = (32, 18)
+# Clips up to this long, in seconds, use the fast path by default
+DEFAULT_FAST_PATH_MAX_SECONDS = 60
+# User metadata of an S3 object with the duration of the video, in seconds
+DURATION_METADATA_KEY = 'duration'
+# Bytes of every ranged read of the box headers of a container
+HEADER_READ_BYTES = 64 * 1024
+# Top-level boxes walked to find the moov box, such as ftyp, free and mdat
+MAX_HEADER_BOXES = 16
+
+
+def _import_cv2():
+    try:
+        import cv2
+    except ImportError as error:
+        raise RuntimeError(
+            "The frame sampling fast path needs OpenCV, install "
+            "opencv-python-headless.") from error
+    return cv2
+
+
+def fast_path_available():
+    """Checks that OpenCV is installed, without importing it."""
+    return importlib.util.find_spec('cv2') is not None
+
+
+def _box_header(data, offset):
+    # The size and type of an ISO base media box, and the length of its header.
+    # A size of 0 means the box goes on to the end of the file.
+    size, kind = struct.unpack_from('>I4s', data, offset)
+    if size == 1:
+        return struct.unpack_from('>Q', data, offset + 8)[0], kind, 16
+    return size, kind, 8
+
+
+def movie_header_duration(moov):
+    """
+    Gets the duration of a video from the mvhd box of its moov box.
+
+    :param moov: The content of the moov box, without its header.
+    :return: The duration in seconds, or None without a movie header.
+    """
+    offset = 0
+    try:
+        while offset + 8 <= len(moov):
+            size, kind, header = _box_header(moov, offset)
+            if kind == b'mvhd':
+                version = moov[offset + header]
+                if version == 1:
+                    timescale, duration = struct.unpack_from('>IQ', moov, offset + header + 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', moov, offset + header + 12)
+                return duration / timescale if timescale else None
+            if size < header:
+                return None
+            offset += size
+    except struct.error:
+        pass
+    return None
+
+
+def probe_s3_duration(s3_client, bucket, key, size):
+    """
+    Gets the duration of an MP4 or QuickTime video in Amazon S3 without
+    downloading it. The top-level box headers are read until the moov box, which
+    is usually at the start of the file or right after the media data, and only
+    the moov box is read whole.
+
+    :param s3_client: A Boto3 S3 client.
+    :param bucket: The bucket of the video.
+    :param key: The object key of the video.
+    :param size: The size of the object, in bytes.
+    :return: The duration in seconds, or None when it can't be found.
+    """
+    def read(start, length):
+        end = min(start + length, size) - 1
+        return s3_client.get_object(
+            Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body'].read()
+
+    data, data_start, offset = b'', 0, 0
+    try:
+        for _ in range(MAX_HEADER_BOXES):
+            if offset + 8 > size:
+                return None
+            if offset + 16 > data_start + len(data):
+                data, data_start = read(offset, HEADER_READ_BYTES), offset
+            box_size, kind, header = _box_header(data, offset - data_start)
+            if box_size == 0:
+                box_size = size - offset
+            if kind == b'moov':
+                if offset + box_size > data_start + len(data):
+                    data, data_start = read(offset, box_size), offset
+                start = offset - data_start
+                return movie_header_duration(data[start + header:start + box_size])
+            if box_size < header:
+                return None
+            offset += box_size
+    except struct.error:
+        pass
+    return None
+
+
+def probe_duration(video_path):
+    """
+    Gets the duration of a local video file.
+
+    :param video_path: The path of the video file.
+    :return: The duration in seconds.
+    """
+    cv2 = _import_cv2()
+    capture = cv2.VideoCapture(video_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        capture.release()
+    return frame_count / fps if fps else 0.0
+
+
+def sample_frames(video_path, sample_rate=DEFAULT_SAMPLE_RATE,
+                  change_threshold=DEFAULT_CHANGE_THRESHOLD):
+    """
+    Decodes a video and yields the sampled frames that changed since the last
+    yielded frame.
+
+    :param video_path: The path of the video file.
+    :param sample_rate: The number of frames sampled per second of video.
+    :param change_threshold: The mean absolute grayscale difference below which a
+                             sampled frame is skipped as unchanged.
+    :return: A generator of (timestamp in milliseconds, JPEG bytes) tuples.
+    """
+    cv2 = _import_cv2()
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    frame_step = max(1, int(round(fps / sample_rate)))
+    last_thumbnail = None
+    frame_index = 0
+    sampled = 0
+    kept = 0
+    try:
+        # grab() only demuxes and decodes, retrieve() is called on sampled frames only.
+        while capture.grab():
+            if frame_index % frame_step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                sampled += 1
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                thumbnail = cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+                if (last_thumbnail is None or
+                        cv2.absdiff(thumbnail, last_thumbnail).mean() >= change_threshold):
+                    last_thumbnail = thumbnail
+                    ok, jpeg = cv2.imencode(
+                        '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                    if ok:
+                        kept += 1
+                        yield int(frame_index * 1000 / fps), jpeg.tobytes()
+            frame_index += 1
+    finally:
+        capture.release()
+        logger.info("Sampled %s of %s frames, kept %s changed frames.",
+                    sampled, frame_index, kept)
+
+
+def detect_text_in_frames(rekognition_client, frames, filters=None,
+                          max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls the synchronous DetectText API on frames concurrently.
+
+    :param rekognition_client: A Boto3 Rekognition client.
+    :param frames: An iterable of (timestamp in milliseconds, JPEG bytes) tuples.
+    :param filters: The Filters parameter of DetectText, if any.
+    :param max_workers: The number of concurrent DetectText calls.
+    :return: The list of RekognitionText objects, ordered by timestamp.
+    """
+    def detect(frame):
+        timestamp, image_bytes = frame
+        request = {'Image': {'Bytes': image_bytes}}
+        if filters:
+            request['Filters'] = filters
+        response = rekognition_client.detect_text(**request)
+        return [RekognitionText(text, timestamp) for text in response['TextDetections']]
+
+    texts = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map() keeps the frame order, so the texts come out ordered by timestamp.
+        for frame_texts in executor.map(detect, frames):
+            texts.extend(frame_texts)
+    return texts